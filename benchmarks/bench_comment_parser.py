@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark and fuzz check for comment_parser
+
+    python benchmarks/bench_comment_parser.py [--rounds N] [--fuzz N]
+
+Checks every line of comment_corpus.tsv, feeds randomly mutated corpus
+entries to the parser to make sure it never raises, and compares the
+per-call cost of the compiled parser (cold and cached) with the substring
+chain it replaced.
+"""
+
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from comment_parser import parse_comment
+from game_registry import GAMES
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "comment_corpus.tsv")
+
+def legacy_parse(payment_comment):
+    """The substring chain process_payment_update used before comment_parser"""
+    game_type = None
+    bet_choice = None
+    if payment_comment:
+        payment_comment = payment_comment.lower().strip()
+        if "бол" in payment_comment:
+            game_type = "bowling"
+            if "победа" in payment_comment or "выигрыш" in payment_comment:
+                bet_choice = "win"
+            elif "проигрыш" in payment_comment or "поражение" in payment_comment:
+                bet_choice = "lose"
+        elif "чет" in payment_comment:
+            game_type = "even_odd"
+            if payment_comment.strip() == "чет":
+                bet_choice = "even"
+            elif payment_comment.strip() == "нечет":
+                bet_choice = "odd"
+        elif "больше" in payment_comment or "меньше" in payment_comment:
+            game_type = "higher_lower"
+            if "больше" in payment_comment:
+                bet_choice = "higher"
+            elif "меньше" in payment_comment:
+                bet_choice = "lower"
+    return game_type, bet_choice
+
+def load_corpus():
+    corpus = []
+    with open(CORPUS_FILE, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.startswith("#"):
+                continue
+            comment, game, choice = line.rstrip("\n").split("\t")
+            corpus.append((comment, None if game == "-" else game, None if choice == "-" else choice))
+    return corpus
+
+def check_corpus(corpus):
+    parser_errors = 0
+    legacy_errors = 0
+    for comment, game, choice in corpus:
+        parsed = parse_comment(comment)
+        if (parsed.game, parsed.choice) != (game, choice):
+            parser_errors += 1
+            print(f"  MISMATCH {comment!r}: got {parsed.game}/{parsed.choice}, expected {game}/{choice}")
+        if legacy_parse(comment) != (game, choice):
+            legacy_errors += 1
+    print(f"corpus: {len(corpus)} comments, parser errors {parser_errors}, legacy errors {legacy_errors}")
+    return parser_errors
+
+def mutate(comment, rng):
+    """Apply a few random character edits"""
+    alphabet = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяaeopcx0123456789 -!?.,<>"
+    chars = list(comment)
+    for _ in range(rng.randint(1, 4)):
+        operation = rng.randrange(3)
+        position = rng.randint(0, len(chars))
+        if operation == 0:
+            chars.insert(position, rng.choice(alphabet))
+        elif operation == 1 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(alphabet)
+    return "".join(chars)
+
+def fuzz(corpus, iterations, seed=0):
+    rng = random.Random(seed)
+    for _ in range(iterations):
+        comment = mutate(rng.choice(corpus)[0], rng)
+        parsed = parse_comment(comment)
+        assert parsed.game is None or parsed.game in GAMES, comment
+    print(f"fuzz: {iterations} mutated comments parsed without errors")
+
+def benchmark(corpus, rounds):
+    comments = [comment for comment, _, _ in corpus]
+
+    def run_cold():
+        parse_comment.cache_clear()
+        for comment in comments:
+            parse_comment(comment)
+
+    def run_cached():
+        for comment in comments:
+            parse_comment(comment)
+
+    def run_legacy():
+        for comment in comments:
+            legacy_parse(comment)
+
+    for name, function in (("legacy chain", run_legacy), ("parser, cold", run_cold), ("parser, cached", run_cached)):
+        seconds = min(timeit.repeat(function, number=rounds, repeat=5))
+        print(f"{name:>15}: {seconds / (rounds * len(comments)) * 1e9:8.0f} ns/comment")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rounds", type=int, default=2000)
+    arg_parser.add_argument("--fuzz", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    corpus = load_corpus()
+    errors = check_corpus(corpus)
+    fuzz(corpus, args.fuzz)
+    benchmark(corpus, args.rounds)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Allocations per update for inline keyboards
+
+    python benchmarks/bench_keyboards.py [--updates N]
+
+Replays a mix of callback updates (main menu, game menu, profile, play,
+instruction) and measures, with tracemalloc, the memory blocks and bytes
+allocated for their reply markups. The "before" side rebuilds every markup
+the way the handlers did before the keyboard registry. The "after" side uses
+the cached markups from handlers.py. Time per update is reported as well.
+"""
+
+import os
+import sys
+import timeit
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ.setdefault("CRYPTOBOT_TOKEN", "benchmark")
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from game_registry import GAMES
+from handlers import KEYBOARDS, url_keyboard, get_main_keyboard, get_game_keyboard
+
+PAYMENT_URL = "https://t.me/CryptoBot?start=IV15707697"
+CHANNEL_URL = "https://t.me/test5363627"
+
+def legacy_markups():
+    """Markups of one round of the update mix, built like before"""
+    back = [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+    return [
+        InlineKeyboardMarkup([[
+            InlineKeyboardButton("Профиль", callback_data="profile"),
+            InlineKeyboardButton("ИГРАТЬ", callback_data="play")
+        ]]),
+        InlineKeyboardMarkup(
+            [[InlineKeyboardButton(f"{game.icon} {game.title}", callback_data=f"game_{game.key}")]
+             for game in GAMES.values()]
+            + [[InlineKeyboardButton("🧪 Тест API", callback_data="test_api")],
+               [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]]
+        ),
+        InlineKeyboardMarkup([back]),
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎲 Перейти в канал", url=CHANNEL_URL)],
+            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+        ]),
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("💰 Сделать ставку", url=PAYMENT_URL)],
+            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+        ])
+    ]
+
+def cached_markups():
+    """Markups of one round of the update mix, from the keyboard registry"""
+    return [
+        get_main_keyboard(),
+        get_game_keyboard(),
+        KEYBOARDS["back"],
+        KEYBOARDS["channel"],
+        url_keyboard("💰 Сделать ставку", PAYMENT_URL)
+    ]
+
+def allocations(build, rounds):
+    """Blocks and bytes allocated per update while building markups"""
+    kept = [None] * rounds
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(rounds):
+        # Keep the markups alive, as they are while their requests are in flight
+        kept[i] = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    # The list returned per round is bookkeeping of this benchmark, not of the handlers
+    blocks = sum(stat.count_diff for stat in stats) - rounds
+    size = sum(stat.size_diff for stat in stats) - rounds * sys.getsizeof(kept[0])
+    updates = rounds * len(kept[0])
+    return blocks / updates, size / updates
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--updates", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    rounds = args.updates // len(cached_markups())
+    for name, build in (("before", legacy_markups), ("after", cached_markups)):
+        blocks, size = allocations(build, rounds)
+        seconds = min(timeit.repeat(build, number=rounds, repeat=5))
+        print(f"{name:>7}: {blocks:8.1f} blocks, {size:9.0f} bytes, "
+              f"{seconds / (rounds * len(cached_markups())) * 1e9:8.0f} ns per update")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cost and exactness of money arithmetic on the bet hot path
+
+    python benchmarks/bench_money.py [--rounds N] [--deposits N]
+
+Times the money work of one settled bet: reserving the stake, computing
+the payout, crediting it and adding the bet to the statistics record. The
+"float" side is the code used before money.py: TON floats read and
+written through the record's "balance" key, payouts truncated with int()
+and statistics summed as floats. The "Money" side is game_engine.settle(),
+the nano-TON balance update of crypto_payments and user_stats.record_bet().
+
+It also credits N deposits of 0.1 TON both ways and prints the drift of
+the float total.
+"""
+
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from money import Money, NANO_PER_TON, nano_to_ton
+from user_record import UserRecord
+from game_engine import Settlement, settle, _outcome
+from user_stats import new_stats, record_bet, period_keys
+
+GAME, CHOICE, DICE_VALUE = "basketball", "goal", 5
+
+def legacy_record_bet(record, game, stake, payout):
+    """record_bet as it was before money.py, summing TON floats"""
+    old = record.get("stats")
+    won = payout > 0
+    mode_games = old["modes"].get(game, 0) + 1
+
+    stats = dict(old)
+    stats["games"] = old["games"] + 1
+    stats["wagered"] = old["wagered"] + stake
+    stats["modes"] = {**old["modes"], game: mode_games}
+    if won:
+        stats["wins"] = old["wins"] + 1
+        stats["won"] = old["won"] + payout
+        stats["streak"] = old["streak"] + 1 if old["streak"] > 0 else 1
+        stats["best_streak"] = max(old["best_streak"], stats["streak"])
+    else:
+        stats["streak"] = old["streak"] - 1 if old["streak"] < 0 else -1
+    stats["best_win"] = max(old.get("best_win", 0), payout)
+    for period, key in period_keys().items():
+        totals = old.get(period)
+        if not totals or totals["period"] != key:
+            totals = {"period": key, "games": 0, "wagered": 0, "best_win": 0}
+        stats[period] = {
+            "period": key,
+            "games": totals["games"] + 1,
+            "wagered": totals["wagered"] + stake,
+            "best_win": max(totals["best_win"], payout)
+        }
+    favorite = old["favorite"]
+    if favorite is None or (favorite != game and mode_games > old["modes"].get(favorite, 0)):
+        stats["favorite"] = game
+    record["stats"] = stats
+
+def legacy_settle(game, choice, dice_value, stake):
+    """game_engine.settle() as it was before money.py"""
+    _, outcome = _outcome(game, choice)
+    won = dice_value in outcome.values
+    payout = int(stake * outcome.multiplier) if won else 0
+    return Settlement(game, choice, dice_value, stake, won, payout, payout - stake)
+
+def legacy_update_balance(record, amount_change):
+    """update_user_balance arithmetic before money.py: TON floats through the "balance" key"""
+    balance = max(0, nano_to_ton(record.balance_nano) + amount_change)
+    record.balance_nano = round(balance * NANO_PER_TON)
+    return balance
+
+def float_bet(record, stake):
+    """One bet with float balances, as before money.py"""
+    if nano_to_ton(record.balance_nano) < stake:
+        return
+    legacy_update_balance(record, -stake)
+    payout = legacy_settle(GAME, CHOICE, DICE_VALUE, stake).payout
+    if payout > 0:
+        legacy_update_balance(record, payout)
+    legacy_record_bet(record, GAME, stake, payout)
+
+def money_bet(record, stake):
+    """One bet with Money, as settle_bet does it now"""
+    stake = Money.of(stake)
+    if record.balance_nano < stake.nano:
+        return
+    record.balance_nano = max(0, record.balance_nano - stake.nano)
+    payout = settle(GAME, CHOICE, DICE_VALUE, stake).payout
+    if payout > 0:
+        record.balance_nano = max(0, record.balance_nano + payout.nano)
+    record_bet(record, GAME, stake, payout)
+
+def fresh_record():
+    return UserRecord(user_id=1, username="player", balance_nano=10 ** 18)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rounds", type=int, default=100000)
+    arg_parser.add_argument("--deposits", type=int, default=1000000)
+    args = arg_parser.parse_args()
+
+    float_record = fresh_record()
+    float_record.stats = dict(new_stats(), wagered=0, won=0, best_win=0)
+    money_record = fresh_record()
+    # Stakes arrive as invoice amounts, parsed into Money once per payment
+    stake = Money.of("2.5")
+    timings = (
+        ("float", lambda: float_bet(float_record, 2.5)),
+        ("Money", lambda: money_bet(money_record, stake)),
+    )
+    # Alternate the two sides so both see the same machine load
+    best = {name: float("inf") for name, _ in timings}
+    for _ in range(5):
+        for name, function in timings:
+            best[name] = min(best[name], timeit.timeit(function, number=args.rounds))
+    for name, seconds in best.items():
+        print(f"{name:>6}: {seconds / args.rounds * 1e9:8.0f} ns per bet")
+
+    total = 0.0
+    for _ in range(args.deposits):
+        total += 0.1
+    exact = Money(0)
+    deposit = Money.of("0.1")
+    for _ in range(args.deposits):
+        exact += deposit
+    print(f"{args.deposits} deposits of 0.1 TON: float {total!r}, Money {exact}, "
+          f"drift {abs(total - float(exact)) * 1e9:.0f} nano-TON")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of the sharded runtime by number of worker processes
+
+    python benchmarks/bench_sharding.py [--shards 1,2,4] [--users 2000]
+                                        [--presses 4] [--concurrency 64]
+
+For every shard count, starts `main.py --mode sharded` in an empty
+directory against benchmarks/fake_apis.py and posts webhook updates to the
+front: /start for every user, then profile button presses. An update counts
+as handled once the fake Bot API has received its reply (sendMessage for
+/start, answerCallbackQuery for a press), so the rate covers the whole path
+through the front, the worker and back to Telegram.
+
+Workers scale with cores; on a machine with fewer cores than workers the
+processes only take turns.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_harness import UpdateFactory, start_fake_apis, scale_environment, free_port, FIRST_USER_ID, REPO_DIR
+from fake_apis import BOT_USER
+
+async def api_calls(session, url, method):
+    async with session.get(f"{url}/stats") as response:
+        return (await response.json())["calls"].get(f"telegram.{method}", 0)
+
+async def wait_for_calls(session, url, method, count, timeout):
+    deadline = time.perf_counter() + timeout
+    while await api_calls(session, url, method) < count:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"Timed out waiting for {count} {method} calls")
+        await asyncio.sleep(0.02)
+
+async def post_all(session, webhook, payloads, concurrency):
+    """POST updates to the front, retrying those answered with 503"""
+    async def worker():
+        for payload in payloads:
+            while True:
+                async with session.post(webhook, json=payload) as response:
+                    if response.status == 200:
+                        break
+                await asyncio.sleep(0.05)
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def wait_until_up(session, url, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"{url} did not come up")
+        await asyncio.sleep(0.2)
+
+async def measure(fake_url, shards, users, presses, concurrency):
+    port = free_port()
+    env = scale_environment(fake_url)
+    env.update({
+        "SHARD_COUNT": str(shards),
+        "SHARD_BASE_PORT": str(free_port()),
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(port),
+        "LOG_LEVEL": "WARNING"
+    })
+    with tempfile.TemporaryDirectory(prefix="bench_sharding_") as directory:
+        front = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py"), "--mode", "sharded"],
+                                 cwd=directory, env=env)
+        try:
+            async with aiohttp.ClientSession() as session:
+                await wait_until_up(session, f"http://127.0.0.1:{port}/healthz")
+                factory = UpdateFactory(BOT_USER, ["dice"], 1)
+                user_ids = range(FIRST_USER_ID, FIRST_USER_ID + users)
+                webhook = f"http://127.0.0.1:{port}/telegram"
+                sent = await api_calls(session, fake_url, "sendMessage")
+                answered = await api_calls(session, fake_url, "answerCallbackQuery")
+
+                started = time.perf_counter()
+                await post_all(session, webhook, (factory.start(user_id)[1] for user_id in user_ids), concurrency)
+                await wait_for_calls(session, fake_url, "sendMessage", sent + users, 300)
+                factory.buttons, factory.weights = ["profile"], [1]
+                await post_all(session, webhook,
+                               (factory.button(factory.random.choice(user_ids))[1] for _ in range(users * presses)),
+                               concurrency)
+                await wait_for_calls(session, fake_url, "answerCallbackQuery", answered + users * presses, 300)
+                elapsed = time.perf_counter() - started
+        finally:
+            front.terminate()
+            front.wait()
+    return users * (1 + presses) / elapsed
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--shards", default="1,2,4", help="comma-separated worker counts")
+    arg_parser.add_argument("--users", type=int, default=2000)
+    arg_parser.add_argument("--presses", type=int, default=4, help="profile presses per user")
+    arg_parser.add_argument("--concurrency", type=int, default=64, help="webhook requests in flight")
+    args = arg_parser.parse_args()
+
+    fake_apis, fake_url = start_fake_apis(0, 1)
+    try:
+        print(f"{os.cpu_count()} CPUs, {args.users} users, {args.users * (1 + args.presses)} updates per run")
+        baseline = None
+        for shards in (int(count) for count in args.shards.split(",")):
+            rate = asyncio.run(measure(fake_url, shards, args.users, args.presses, args.concurrency))
+            baseline = baseline or rate
+            print(json.dumps({"shards": shards, "updates_per_second": round(rate), "speedup": round(rate / baseline, 2)}))
+    finally:
+        fake_apis.terminate()
+        fake_apis.wait()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per-game formatting cost of result messages
+
+    python benchmarks/bench_templates.py [--rounds N]
+
+For every registered game, checks that the compiled templates produce the
+same text as str.format on the raw templates, then times building all four
+result messages (roll, user, channel, duplicate) three ways: str.format with
+a fields dict as play_game did before message_templates, the compiled
+render functions, and lazy texts of which only the roll message is read.
+"""
+
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from game_registry import GAMES
+from message_templates import GameResult, templates_for
+
+MESSAGES = ("roll", "user", "channel", "duplicate")
+
+def sample_record(game, won):
+    choice = next(iter(game.outcomes))
+    return GameResult(
+        choice=choice, stake=2.5, payout=3 if won else 0, won=won,
+        value=min(game.outcomes[choice].values) if won else max(game.values),
+        balance=117.5, username="player", games_played=42, mode_games=7
+    )
+
+def format_with_fields(game, record):
+    """The str.format approach: build a fields dict, format every message"""
+    templates = game.templates
+    fields = {
+        "title": game.title, "emoji": game.emoji, "icon": game.icon,
+        "choice": game.outcomes[record.choice].title, "stake": record.stake,
+        "payout": record.payout, "value": record.value,
+        "label": game.labels.get(record.value, ""), "balance": record.balance,
+        "username": record.username, "games_played": record.games_played,
+        "mode_games": record.mode_games
+    }
+    outcome = "won" if record.won else "lost"
+    fields["result"] = templates[f"result_{outcome}"].format(**fields)
+    fields["result_short"] = templates[f"result_short_{outcome}"].format(**fields)
+    fields["verdict"] = templates[f"verdict_{outcome}"].format(**fields)
+    return [templates[name].format(**fields) for name in MESSAGES]
+
+def check(game):
+    compiled = templates_for(game)
+    for won in (True, False):
+        record = sample_record(game, won)
+        expected = format_with_fields(game, record)
+        rendered = [compiled.render(name, record) for name in MESSAGES]
+        assert rendered == expected, (game.key, won)
+
+def benchmark(game, rounds):
+    compiled = templates_for(game)
+    records = [sample_record(game, True), sample_record(game, False)]
+
+    def run_format():
+        for record in records:
+            format_with_fields(game, record)
+
+    def run_compiled():
+        for record in records:
+            for name in MESSAGES:
+                compiled.render(name, record)
+
+    def run_lazy():
+        for record in records:
+            str(compiled.lazy("roll", record))
+            for name in MESSAGES[1:]:
+                compiled.lazy(name, record)
+
+    results = []
+    for function in (run_format, run_compiled, run_lazy):
+        seconds = min(timeit.repeat(function, number=rounds, repeat=5))
+        results.append(seconds / (rounds * len(records)) * 1e9)
+    return results
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rounds", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    print(f"{'game':>14} {'str.format':>12} {'compiled':>12} {'lazy':>12}  (ns per result)")
+    for game in GAMES.values():
+        check(game)
+        format_ns, compiled_ns, lazy_ns = benchmark(game, args.rounds)
+        print(f"{game.key:>14} {format_ns:12.0f} {compiled_ns:12.0f} {lazy_ns:12.0f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory and codec cost of user records
+
+    python benchmarks/bench_user_records.py [--users N] [--rounds N]
+
+Builds N users the way /start used to (a dict with string timestamps and a
+float balance), then the same users as UserRecord objects. Compares the
+memory each form holds, measured with tracemalloc, and times decoding from
+and encoding to the persisted form.
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from user_record import UserRecord
+
+def legacy_user(user_id):
+    """A user as /start created it before UserRecord"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "user_id": user_id,
+        "username": f"player{user_id}",
+        "registration_date": now,
+        "games_played": 0,
+        "favorite_game": None,
+        "balance": user_id % 100 / 10,
+        "even_odd_games": 0,
+        "higher_lower_games": 0,
+        "last_activity": now
+    }
+
+def record_user(user_id):
+    now = int(time.time())
+    return UserRecord(user_id=user_id, username=f"player{user_id}", registered_at=now,
+                      last_active=now, balance_nano=user_id % 100 * 10 ** 8)
+
+def measure(build, count):
+    """Bytes held per user by a dict of count users"""
+    tracemalloc.start()
+    users = {str(user_id): build(user_id) for user_id in range(count)}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(users), users
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--users", type=int, default=100000)
+    arg_parser.add_argument("--rounds", type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    legacy_size, legacy_users = measure(legacy_user, args.users)
+    record_size, _ = measure(record_user, args.users)
+    print(f"memory per user: dict {legacy_size:.0f} bytes, UserRecord {record_size:.0f} bytes "
+          f"({1 - record_size / legacy_size:.0%} less)")
+
+    legacy = legacy_users["12345"]
+    record = UserRecord.from_persisted(legacy)
+    persisted = record.to_persisted()
+    line = json.dumps(persisted)
+    timings = (
+        ("decode legacy dict", lambda: UserRecord.from_persisted(legacy)),
+        ("decode persisted", lambda: UserRecord.from_persisted(persisted)),
+        ("encode persisted", record.to_persisted),
+        ("json line round trip", lambda: UserRecord.from_persisted(json.loads(line)).to_persisted()),
+    )
+    for name, function in timings:
+        seconds = min(timeit.repeat(function, number=args.rounds, repeat=5))
+        print(f"{name:>21}: {seconds / args.rounds * 1e9:8.0f} ns")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
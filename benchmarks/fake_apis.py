@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fake Telegram Bot API and CryptoBot API for load tests
+
+    python benchmarks/fake_apis.py [--port 8099] [--latency-ms 0]
+
+One aiohttp server answers both APIs with well-formed responses:
+
+    /bot<token>/<method>   Telegram Bot API (getMe, sendMessage, sendDice,
+                           editMessageText, answerCallbackQuery, ...)
+    /api/<method>          CryptoBot API (getMe, getInvoices, transfer, ...)
+    /stats                 calls per method and request bytes received
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8099 and
+CRYPTOBOT_API_URL=http://127.0.0.1:8099/api. --latency-ms delays every
+answer to mimic the network round trip to the real services.
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Casino", "username": "casino_load_bot"}
+
+# Dice values per emoji, as Telegram draws them
+DICE_VALUES = {"🎰": 64, "🏀": 5, "⚽": 5}
+
+
+class FakeApis:
+    """State of the fake servers: message IDs and call statistics"""
+
+    def __init__(self, latency=0.0, seed=None):
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.request_bytes = 0
+        self._message_id = 0
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_telegram)
+        app.router.add_route("*", "/api/{method}", self.handle_cryptobot)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def _parameters(self, request):
+        self.request_bytes += request.content_length or 0
+        if request.content_type == "application/json":
+            return await request.json()
+        parameters = dict(await request.post())
+        parameters.update(request.query)
+        return parameters
+
+    def _message(self, chat_id, **fields):
+        self._message_id += 1
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "channel"
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": BOT_USER
+        }
+        message.update(fields)
+        return message
+
+    async def handle_telegram(self, request):
+        method = request.match_info["method"]
+        parameters = await self._parameters(request)
+        self.calls[f"telegram.{method}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = parameters.get("chat_id", 1)
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "sendMessage":
+            result = self._message(chat_id, text=parameters.get("text", ""))
+        elif method == "sendDice":
+            emoji = parameters.get("emoji", "🎲")
+            value = self.random.randint(1, DICE_VALUES.get(emoji, 6))
+            result = self._message(chat_id, dice={"emoji": emoji, "value": value})
+        elif method in ("editMessageText", "editMessageReplyMarkup"):
+            if "inline_message_id" in parameters:
+                result = True
+            else:
+                result = self._message(chat_id, text=parameters.get("text", ""))
+                result["message_id"] = int(parameters.get("message_id", result["message_id"]))
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook and the like
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_cryptobot(self, request):
+        method = request.match_info["method"]
+        await self._parameters(request)
+        self.calls[f"cryptobot.{method}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = {"app_id": 1, "name": "Fake CryptoBot", "payment_processing_bot_username": "CryptoBot"}
+        elif method == "getInvoices":
+            result = {"items": []}
+        elif method == "transfer":
+            result = {"transfer_id": self.random.randint(1, 10 ** 9), "status": "completed"}
+        elif method == "createInvoice":
+            invoice_id = self.random.randint(1, 10 ** 9)
+            result = {"invoice_id": invoice_id, "status": "active",
+                      "pay_url": f"https://t.me/CryptoBot?start=IV{invoice_id}"}
+        else:
+            return web.json_response({"ok": False, "error": {"code": 400, "name": "METHOD_NOT_FOUND"}})
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_stats(self, request):
+        return web.json_response({"calls": dict(self.calls), "request_bytes": self.request_bytes})
+
+
+async def serve(port, latency, seed):
+    apis = FakeApis(latency, seed)
+    runner = web.AppRunner(apis.build_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    print(json.dumps({"listening": port}), flush=True)
+    await asyncio.Event().wait()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=8099)
+    arg_parser.add_argument("--latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    args = arg_parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency_ms / 1000, args.seed))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
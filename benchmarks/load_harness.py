@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end load test of the bot against fake Telegram and CryptoBot APIs
+
+    python benchmarks/load_harness.py run [--users 1000,10000,100000,1000000]
+                                          [--updates-per-user 4] [--concurrency 8]
+                                          [--latency-ms 0] [--output report.json]
+    python benchmarks/load_harness.py compare BASELINE.json CURRENT.json [--tolerance 0.10]
+
+"run" starts benchmarks/fake_apis.py and, for every user count, a fresh
+process that builds the Application with bot.create_bot() in an empty data
+directory and feeds it synthetic updates through process_update(): every
+user sends /start, then a mix of play, game_*, profile and back_to_main
+button presses. Each scale reports p50/p95/p99 handler latency, updates/s,
+bytes written to data/users.json and its journal, and memory growth.
+
+The report is JSON with the settings, git commit and Python version, so two
+runs can be compared: "compare" prints the change of every metric and exits
+with status 1 when latency, throughput, bytes written or memory got worse
+than the tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from array import array
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCHMARKS_DIR, "..")
+
+# Button presses after /start: (callback data, weight); "game" is any game_<key>
+UPDATE_MIX = (("play", 30), ("game", 20), ("profile", 25), ("back_to_main", 25))
+
+# User IDs start here so they look like real Telegram IDs
+FIRST_USER_ID = 100000000
+
+# (metric, direction) compared between reports; 1 means higher is better
+COMPARED_METRICS = (
+    ("latency_ms.p50", -1),
+    ("latency_ms.p95", -1),
+    ("latency_ms.p99", -1),
+    ("updates_per_second", 1),
+    ("bytes_written_per_update", -1),
+    ("rss_growth_per_user", -1),
+)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def rss_bytes():
+    """Resident set size of this process"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted sequence"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        "p50": percentile(ordered, 0.50) * 1000,
+        "p95": percentile(ordered, 0.95) * 1000,
+        "p99": percentile(ordered, 0.99) * 1000,
+        "max": (ordered[-1] if ordered else 0.0) * 1000
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Synthetic updates
+
+class UpdateFactory:
+    """Telegram update payloads for simulated users"""
+
+    def __init__(self, bot_user, game_keys, seed):
+        self.bot_user = bot_user
+        self.game_keys = game_keys
+        self.random = random.Random(seed)
+        self.update_id = 0
+        self.buttons = [data for data, _ in UPDATE_MIX]
+        self.weights = [weight for _, weight in UPDATE_MIX]
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def start(self, user_id):
+        self.update_id += 1
+        return "/start", {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+            }
+        }
+
+    def button(self, user_id):
+        self.update_id += 1
+        kind = self.random.choices(self.buttons, self.weights)[0]
+        data = f"game_{self.random.choice(self.game_keys)}" if kind == "game" else kind
+        return kind, {
+            "update_id": self.update_id,
+            "callback_query": {
+                "id": str(self.update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": self.bot_user,
+                    "text": "menu"
+                }
+            }
+        }
+
+
+async def drive(application, payloads, concurrency, latencies, kinds):
+    """Process (kind, payload) pairs with concurrent workers, timing each update"""
+    from telegram import Update
+
+    bot = application.bot
+    process_update = application.process_update
+
+    async def worker():
+        for kind, payload in payloads:
+            update = Update.de_json(payload, bot)
+            started = time.perf_counter()
+            await process_update(update)
+            elapsed = time.perf_counter() - started
+            latencies.append(elapsed)
+            kinds.setdefault(kind, array("d")).append(elapsed)
+
+    # The workers share one generator, so updates are built as they are needed
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_scale(users, updates_per_user, concurrency, seed):
+    """One scale in this process; the environment already points at the fake APIs"""
+    sys.path.insert(0, REPO_DIR)
+    import bot
+    import user_data
+    from game_registry import GAMES
+    from fake_apis import BOT_USER
+
+    rss_start = rss_bytes()
+    application = bot.create_bot()
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    storage = user_data.storage
+
+    factory = UpdateFactory(BOT_USER, sorted(GAMES), seed)
+    latencies = array("d")
+    kinds = {}
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + users)
+
+    started = time.perf_counter()
+    # Registration first: a user's buttons must not overtake their /start
+    await drive(application, (factory.start(user_id) for user_id in user_ids),
+                concurrency, latencies, kinds)
+    buttons = (factory.button(factory.random.choice(user_ids)) for _ in range(users * updates_per_user))
+    await drive(application, buttons, concurrency, latencies, kinds)
+    elapsed = time.perf_counter() - started
+    rss_end = rss_bytes()
+
+    await application.stop()
+    await application.post_shutdown(application)
+    await application.shutdown()
+    user_data.close_user_data()
+
+    users_file = os.path.join("data", "users.json")
+    total_updates = len(latencies)
+    return {
+        "users": users,
+        "updates": total_updates,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "updates_per_second": total_updates / elapsed if elapsed else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "latency_ms_by_update": {kind: dict(latency_summary(samples), count=len(samples))
+                                 for kind, samples in sorted(kinds.items())},
+        "bytes_written": storage.bytes_written,
+        "bytes_written_per_update": storage.bytes_written / total_updates if total_updates else 0.0,
+        "users_json_bytes": os.path.getsize(users_file) if os.path.exists(users_file) else 0,
+        "rss_growth_bytes": rss_end - rss_start,
+        "rss_growth_per_user": (rss_end - rss_start) / users,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+
+def scale_main(args):
+    """Child process entry point: prints the result of one scale as JSON"""
+    sys.path.insert(0, BENCHMARKS_DIR)
+    from log_pipeline import setup_logging, shutdown_logging
+    setup_logging(level=os.getenv("LOG_LEVEL", "WARNING"))
+    # Every scale starts with no users; data/ paths are relative to the working directory
+    with tempfile.TemporaryDirectory(prefix="load_harness_") as directory:
+        os.chdir(directory)
+        os.makedirs("data")
+        try:
+            result = asyncio.run(run_scale(args.users, args.updates_per_user, args.concurrency, args.seed))
+        finally:
+            shutdown_logging()
+            os.chdir(REPO_DIR)
+    print(json.dumps(result))
+    return 0
+
+
+# Orchestration
+
+def start_fake_apis(latency_ms, seed):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, "fake_apis.py"), "--port", str(port),
+         "--latency-ms", str(latency_ms), "--seed", str(seed)],
+        stdout=subprocess.PIPE, text=True
+    )
+    # The server prints one line once it is listening
+    if not process.stdout.readline():
+        raise RuntimeError("Fake API server did not start")
+    return process, f"http://127.0.0.1:{port}"
+
+def scale_environment(url):
+    """Environment of a scale process: fake APIs, no send pacing, no /metrics port"""
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "123456:LOAD-TEST",
+        "TELEGRAM_API_URL": url,
+        "CRYPTOBOT_API_URL": f"{url}/api",
+        "CRYPTOBOT_TOKEN": "load-test",
+        "RESULTS_CHANNEL_ID": "-1001000000000",
+        "METRICS_PORT": "0",
+        "SEND_GLOBAL_RATE": "1000000",
+        "SEND_PRIVATE_RATE": "1000000",
+        "SEND_GROUP_RATE": "1000000",
+        "SEND_BURST": "1000000",
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, BENCHMARKS_DIR, env.get("PYTHONPATH")]))
+    })
+    return env
+
+def run_main(args):
+    scales = [int(users) for users in args.users.split(",")]
+    fake_apis, url = start_fake_apis(args.latency_ms, args.seed)
+    runs = []
+    try:
+        for users in scales:
+            print(f"{users} users...", file=sys.stderr, flush=True)
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_scale", "--users", str(users),
+                 "--updates-per-user", str(args.updates_per_user), "--concurrency", str(args.concurrency),
+                 "--seed", str(args.seed)],
+                env=scale_environment(url), stdout=subprocess.PIPE, text=True
+            )
+            if completed.returncode != 0:
+                print(f"{users} users: run failed with status {completed.returncode}", file=sys.stderr)
+                return 1
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            runs.append(run)
+            latency = run["latency_ms"]
+            print(f"{users:>8} users {run['updates']:>9} updates  "
+                  f"p50 {latency['p50']:7.2f} ms  p95 {latency['p95']:7.2f} ms  p99 {latency['p99']:7.2f} ms  "
+                  f"{run['updates_per_second']:8.0f} upd/s  "
+                  f"written {run['bytes_written'] / 2 ** 20:8.1f} MiB  "
+                  f"users.json {run['users_json_bytes'] / 2 ** 20:7.1f} MiB  "
+                  f"RSS +{run['rss_growth_bytes'] / 2 ** 20:7.1f} MiB "
+                  f"({run['rss_growth_per_user']:.0f} B/user)")
+    finally:
+        fake_apis.terminate()
+        fake_apis.wait()
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "updates_per_user": args.updates_per_user,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency_ms,
+            "seed": args.seed
+        },
+        "runs": runs
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    return 0
+
+
+# Comparison
+
+def metric_value(run, path):
+    value = run
+    for key in path.split("."):
+        value = value[key]
+    return value
+
+def compare_main(args):
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.current, encoding="utf-8") as file:
+        current = json.load(file)
+
+    if baseline["settings"] != current["settings"]:
+        print(f"Warning: settings differ: {baseline['settings']} vs {current['settings']}", file=sys.stderr)
+    print(f"baseline {baseline.get('git_commit')} ({baseline['created']}), "
+          f"current {current.get('git_commit')} ({current['created']})")
+
+    baseline_runs = {run["users"]: run for run in baseline["runs"]}
+    regressions = []
+    for run in current["runs"]:
+        old = baseline_runs.get(run["users"])
+        if old is None:
+            print(f"{run['users']} users: not in the baseline, skipped")
+            continue
+        print(f"\n{run['users']} users")
+        for path, direction in COMPARED_METRICS:
+            before, after = metric_value(old, path), metric_value(run, path)
+            change = (after - before) / before if before else 0.0
+            regressed = change * direction < -args.tolerance
+            if regressed:
+                regressions.append((run["users"], path, change))
+            print(f"  {path:<26} {before:14.3f} -> {after:14.3f}  {change:+8.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        return 1
+    print(f"\nNo regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the load test")
+    run_parser.add_argument("--users", default="1000", help="comma-separated user counts")
+    run_parser.add_argument("--updates-per-user", type=int, default=4,
+                            help="button presses per user after /start")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="updates processed at once")
+    run_parser.add_argument("--latency-ms", type=float, default=0.0, help="answer delay of the fake APIs")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--output", help="write the report to this JSON file")
+
+    scale_parser = commands.add_parser("_scale")
+    scale_parser.add_argument("--users", type=int, required=True)
+    scale_parser.add_argument("--updates-per-user", type=int, required=True)
+    scale_parser.add_argument("--concurrency", type=int, required=True)
+    scale_parser.add_argument("--seed", type=int, required=True)
+
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10,
+                                help="relative change counted as a regression")
+
+    args = arg_parser.parse_args()
+    if args.command == "run":
+        return run_main(args)
+    if args.command == "_scale":
+        return scale_main(args)
+    return compare_main(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,18 +6,84 @@ Bot initialization and configuration
 
 import os
 import logging
+import functools
 from telegram.ext import (Application, CommandHandler, CallbackQueryHandler,
                           MessageHandler, filters, ChatMemberHandler)
 from handlers import (start, profile_handler, play_handler, 
                      game_selection_handler, cancel_handler,
                      chat_member_handler, instruction_handler,
-                     test_api_command)
+                     test_api_command, leaders_handler)
 from user_data import load_user_data
+from ledger import ledger
+from leaderboard import leaderboards
+import persistence
+from cryptobot_client import cryptobot
+from payment_reconciler import reconciler
+from send_scheduler import scheduler
+from channel_publisher import publisher
+from update_processor import processor
+from metrics import metrics, timed, server as metrics_server
+from log_pipeline import log_context
 
 logger = logging.getLogger(__name__)
 
+# Bot API server, e.g. a local Bot API server or the fake one in benchmarks/fake_apis.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 
-def create_bot():
+HANDLER_LATENCY = metrics.histogram(
+    "bot_handler_seconds", "Handler latency per callback pattern, command or message handler", ["handler"]
+)
+
+def instrumented(callback, name):
+    """
+    Callback that records its latency under the given handler name and
+    tags its log records with the update's correlation fields
+    """
+    callback = timed(HANDLER_LATENCY.labels(name))(callback)
+
+    @functools.wraps(callback)
+    async def handler(update, context):
+        user = update.effective_user
+        chat = update.effective_chat
+        with log_context(update_id=update.update_id, handler=name,
+                         user_id=user.id if user else None, chat_id=chat.id if chat else None):
+            return await callback(update, context)
+    return handler
+
+def command(name, callback):
+    return CommandHandler(name, instrumented(callback, f"/{name}"))
+
+def callback_query(callback, pattern):
+    return CallbackQueryHandler(instrumented(callback, pattern), pattern=pattern)
+
+
+async def post_init(application: Application, singletons=True) -> None:
+    """
+    Start background services once the application is initialized
+
+    Workers of the sharded runtime pass singletons=False: the invoice
+    reconciler runs once, in the front process (see sharding.py).
+    """
+    await persistence.worker.start()
+    await cryptobot.start()
+    if singletons:
+        await reconciler.start()
+    await scheduler.start()
+    await publisher.start(application.bot)
+    await metrics_server.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background services and flush their pending work"""
+    await metrics_server.stop()
+    await publisher.stop()
+    await scheduler.stop()
+    await reconciler.stop()
+    await cryptobot.close()
+    await persistence.worker.stop()
+
+
+def create_bot(singletons=True):
     """Create and configure the bot application"""
 
     # Get bot token from environment variable
@@ -27,45 +93,65 @@ def create_bot():
             "No TELEGRAM_BOT_TOKEN found in environment variables")
 
     # Create the application
-    application = Application.builder().token(token).build()
+    application = (Application.builder()
+                   .token(token)
+                   .base_url(f"{TELEGRAM_API_URL}/bot")
+                   .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+                   # Different users concurrently, each user's updates in order
+                   .concurrent_updates(processor)
+                   .post_init(functools.partial(post_init, singletons=singletons))
+                   .post_shutdown(post_shutdown)
+                   .build())
 
     # Load user data
     load_user_data()
 
-    # Register handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", start))
-    application.add_handler(CommandHandler("test", test_api_command))
+    # Load the transaction ledger
+    ledger.load()
+
+    # Rebuild leaderboards from the users' statistics
+    leaderboards.rebuild()
+
+    # Updates received but not yet handled
+    metrics.gauge("bot_update_queue", "Updates waiting to be handled", application.update_queue.qsize)
+
+    # Register handlers; each one records its latency in bot_handler_seconds
+    application.add_handler(command("start", start))
+    application.add_handler(command("help", start))
+    application.add_handler(command("test", test_api_command))
+    application.add_handler(command("top", leaders_handler))
 
     # Main navigation handlers
     application.add_handler(
-        CallbackQueryHandler(profile_handler, pattern="^profile$"))
+        callback_query(profile_handler, "^profile$"))
+    application.add_handler(
+        callback_query(play_handler, "^play$"))
     application.add_handler(
-        CallbackQueryHandler(play_handler, pattern="^play$"))
+        callback_query(leaders_handler, "^leaders"))
 
     # Game handlers
     application.add_handler(
-        CallbackQueryHandler(game_selection_handler, pattern="^game_"))
+        callback_query(game_selection_handler, "^game_"))
         
     # API Test handler
     application.add_handler(
-        CallbackQueryHandler(test_api_command, pattern="^test_api$"))
+        callback_query(test_api_command, "^test_api$"))
         
     # Instruction handler
     application.add_handler(
-        CallbackQueryHandler(instruction_handler, pattern="^instruction$"))
+        callback_query(instruction_handler, "^instruction$"))
 
     # Return to main menu
     application.add_handler(
-        CallbackQueryHandler(cancel_handler, pattern="^back_to_main$"))
+        callback_query(cancel_handler, "^back_to_main$"))
 
     # Handle other messages
     application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, cancel_handler))
+        MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(cancel_handler, "text")))
 
     # Обработчик добавления/удаления бота из канала или группы
     application.add_handler(
-        ChatMemberHandler(chat_member_handler,
+        ChatMemberHandler(instrumented(chat_member_handler, "my_chat_member"),
                           ChatMemberHandler.MY_CHAT_MEMBER))
 
     return application
\ No newline at end of file
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Coalesced publishing to the results channel
+
+Bet announcements and game results are not posted one message each.
+They are buffered and flushed together at most CHANNEL_FLUSH_INTERVAL
+seconds after the first buffered entry, or as soon as CHANNEL_FLUSH_SIZE
+entries are waiting. A flush edits one rolling "live feed" message in place.
+A new feed message is started only when the current one already holds
+CHANNEL_FEED_ENTRIES entries or would exceed Telegram's message size limit.
+Each feed message carries the betting instructions and the payment buttons
+that used to be attached to every "НОВАЯ СТАВКА" post.
+"""
+
+import os
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
+from send_scheduler import scheduler, PRIORITY_CHANNEL
+from game_registry import GAMES
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Channel ID for posting game results
+RESULTS_CHANNEL_ID = os.getenv("RESULTS_CHANNEL_ID")
+
+# Maximum delay between an entry and its appearance in the channel
+CHANNEL_FLUSH_INTERVAL = float(os.getenv("CHANNEL_FLUSH_INTERVAL", "3"))
+
+# Number of buffered entries that triggers an immediate flush
+CHANNEL_FLUSH_SIZE = int(os.getenv("CHANNEL_FLUSH_SIZE", "10"))
+
+# Entries kept in one feed message before a new one is started
+CHANNEL_FEED_ENTRIES = int(os.getenv("CHANNEL_FEED_ENTRIES", "20"))
+
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+FEED_HEADER = (
+    "🎮 *СТАВКИ* 🔥\n\n"
+    "📝 *В комментарии к платежу укажите режим и исход:*\n"
+    + "".join(f"• {game.icon} {game.title}: {game.hint}\n" for game in GAMES.values()) + "\n"
+    "👇 *Введите удобную для вас сумму от 0.1 до 10 TON* при оплате через CryptoBot\n\n"
+    "📢 *Лента:*\n"
+)
+
+
+class ChannelPublisher:
+    """Buffers channel entries and flushes them into a rolling feed message"""
+
+    def __init__(self, chat_id=RESULTS_CHANNEL_ID, interval=CHANNEL_FLUSH_INTERVAL,
+                 flush_size=CHANNEL_FLUSH_SIZE, feed_entries=CHANNEL_FEED_ENTRIES):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.flush_size = flush_size
+        self.feed_entries = feed_entries
+        self.payment_url = "https://t.me/CryptoBot?start=IV15707697"
+        self._markup = None
+        self._markup_url = None
+        self._bot = None
+        self._buffer = []
+        # Entries shown in the current feed message and the message itself
+        self._feed = []
+        self._message = None
+        self._message_text = None
+        self._pending = None
+        self._full = None
+        self._task = None
+        self._flush_lock = None
+        self.flushes = 0
+        # Coroutine function taking (entries, payment_url); when set, flushes hand
+        # the rendered entries to it instead of writing the feed. Workers of the
+        # sharded runtime forward them to the front process, which owns the feed.
+        self.forward = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    @property
+    def feed_message(self):
+        """The current live feed message, None until the first flush"""
+        return self._message
+
+    async def start(self, bot):
+        if self.running:
+            return
+        self._bot = bot
+        self._pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Channel publisher started for {self.chat_id}")
+
+    async def stop(self):
+        """Stop the publisher and flush whatever is still buffered"""
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def publish(self, text):
+        """Buffer one feed entry: plain text or a LazyText, rendered and escaped on flush"""
+        if not self.chat_id:
+            return
+        self._buffer.append(text)
+        if self._pending is not None:
+            self._pending.set()
+            if len(self._buffer) >= self.flush_size:
+                self._full.set()
+
+    def announce_bet(self, user):
+        """Announce that a player is about to bet"""
+        self.publish(f"👤 {user.first_name} делает ставку")
+        return self._message
+
+    def publish_result(self, text):
+        """Add a settled game result to the feed"""
+        self.publish(text)
+
+    def reply_markup(self):
+        """Buttons of the feed message, rebuilt only when the payment URL changes"""
+        if self._markup_url != self.payment_url:
+            self._markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton("💰 Сделать ставку", url=self.payment_url)],
+                [InlineKeyboardButton("📋 Инструкция", callback_data="instruction")]
+            ])
+            self._markup_url = self.payment_url
+        return self._markup
+
+    async def flush(self):
+        """Write buffered entries into the live feed message"""
+        async with self._flush_lock:
+            self._pending.clear()
+            self._full.clear()
+            if self.forward is not None:
+                entries, self._buffer = self._buffer, []
+                if entries:
+                    await self.forward([str(entry) for entry in entries], self.payment_url)
+                self.flushes += 1
+                return
+            while self._buffer:
+                entries, self._buffer = self._buffer, []
+                for entry in entries:
+                    entry = escape_markdown(str(entry))
+                    if self._feed and (len(self._feed) >= self.feed_entries
+                                       or len(self._render(self._feed + [entry])) > MAX_MESSAGE_LENGTH):
+                        # The current message is complete, the rest starts a new one
+                        await self._write()
+                        self._feed = []
+                        self._message = None
+                        self._message_text = None
+                    self._feed.append(entry)
+                await self._write()
+            self.flushes += 1
+
+    def _render(self, feed):
+        return FEED_HEADER + "\n\n".join(feed)
+
+    async def _write(self):
+        """Edit the live feed message, or send it if there is none yet"""
+        text = self._render(self._feed)
+        if text == self._message_text:
+            return
+        if self._message is not None:
+            message = self._message
+            try:
+                await scheduler.send(
+                    lambda: message.edit_text(text, parse_mode="Markdown", reply_markup=self.reply_markup()),
+                    self.chat_id,
+                    PRIORITY_CHANNEL
+                )
+                self._message_text = text
+                return
+            except BadRequest as e:
+                if "not modified" in str(e):
+                    return
+                # Deleted or too old to edit, continue with a fresh message
+                logger.warning(f"Could not edit the live feed message: {e}")
+        try:
+            self._message = await scheduler.send_message(
+                self._bot,
+                chat_id=self.chat_id,
+                priority=PRIORITY_CHANNEL,
+                text=text,
+                parse_mode="Markdown",
+                reply_markup=self.reply_markup()
+            )
+            self._message_text = text
+        except Exception as e:
+            logger.error(f"Error posting to the results channel: {e}")
+
+    async def _run(self):
+        while True:
+            await self._pending.wait()
+            try:
+                # Collect more entries, but never hold the first one longer than the interval
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing the results channel feed: {e}")
+
+
+# Publisher shared by the application
+publisher = ChannelPublisher()
+
+metrics.gauge("channel_feed_buffered", "Feed entries waiting for the next channel flush",
+              lambda: len(publisher._buffer))
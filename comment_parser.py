@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Payment comment parser
+
+Players choose the game and the outcome in the comment of their CryptoBot
+payment, e.g. "бол - победа", "нечет" or "Больше!". The grammar (GRAMMAR)
+of games, their aliases and the aliases of each outcome comes from the game
+registry. It is compiled once into:
+
+* a precompiled word regex,
+* an exact lookup table from alias to meaning, and
+* a deletion index that resolves single-letter typos in words of four or
+  more letters (one insertion, deletion, substitution or transposition).
+
+Comments are normalized before matching: lower case, "ё" as "е", and Latin
+letters that look like Cyrillic ones ("чeт" typed with a Latin "e") are
+mapped to Cyrillic. Matching is done on whole words, so "нечет" is never
+mistaken for "чет" and extra words around the choice are ignored.
+"""
+
+from functools import lru_cache
+from collections import namedtuple
+import re
+from game_registry import GAMES
+
+# game -> aliases of the game itself and aliases of each outcome,
+# as declared in the game registry
+GRAMMAR = {
+    game.key: {
+        "aliases": list(game.aliases),
+        "outcomes": {choice: list(outcome.aliases) for choice, outcome in game.outcomes.items()}
+    }
+    for game in GAMES.values()
+}
+
+# Latin letters that look like Cyrillic ones
+HOMOGLYPHS = str.maketrans({
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у"
+})
+
+# Shortest word that is matched with typos
+FUZZY_MIN_LENGTH = 4
+
+# game: registered game key or None, choice: outcome key or None,
+# fuzzy: whether a typo had to be corrected to get the result
+ParsedComment = namedtuple("ParsedComment", ["game", "choice", "fuzzy"])
+
+_EMPTY = ParsedComment(None, None, False)
+
+_WORD = re.compile(r"[<>]?[0-9a-zа-я]+")
+_LATIN = re.compile(r"[a-z]")
+
+def _normalize(text):
+    """Lower-case text and spell "ё" as "е"; homoglyphs are mapped per word"""
+    return text.lower().replace("ё", "е")
+
+def _lookup(word):
+    """Resolve a word exactly, after mapping homoglyphs, or with one typo"""
+    meaning = _EXACT.get(word)
+    if meaning is not None:
+        return meaning, False
+    if _LATIN.search(word):
+        # Translating is comparatively slow, so only mixed words pay for it
+        word = word.translate(HOMOGLYPHS)
+        meaning = _EXACT.get(word)
+        if meaning is not None:
+            return meaning, False
+    meaning = _lookup_fuzzy(word)
+    if meaning is not None:
+        return meaning, True
+    return None, False
+
+def _deletes(word):
+    """All variants of a word with one letter removed"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+def _compile(grammar):
+    """Build the exact and the typo lookup tables from the grammar"""
+    exact = {}
+    for game, spec in grammar.items():
+        for alias in spec["aliases"]:
+            exact[_normalize(alias).translate(HOMOGLYPHS)] = (game, None)
+        for outcome, aliases in spec["outcomes"].items():
+            for alias in aliases:
+                exact[_normalize(alias).translate(HOMOGLYPHS)] = (game, outcome)
+
+    fuzzy = {}
+    for alias, meaning in exact.items():
+        if len(alias) < FUZZY_MIN_LENGTH:
+            continue
+        for variant in _deletes(alias) | {alias}:
+            fuzzy.setdefault(variant, set()).add(meaning)
+    return exact, fuzzy
+
+_EXACT, _FUZZY = _compile(GRAMMAR)
+
+_FUZZY_MAX_LENGTH = max(len(alias) for alias in _EXACT) + 1
+
+def _lookup_fuzzy(word):
+    """Resolve a word with one typo; ambiguous words resolve to nothing"""
+    if not FUZZY_MIN_LENGTH <= len(word) <= _FUZZY_MAX_LENGTH:
+        return None
+    found = _FUZZY.get(word)
+    meanings = set(found) if found else set()
+    for i in range(len(word)):
+        found = _FUZZY.get(word[:i] + word[i + 1:])
+        if found:
+            meanings |= found
+    if len(meanings) == 1:
+        return next(iter(meanings))
+    return None
+
+@lru_cache(maxsize=4096)
+def parse_comment(comment):
+    """
+    Parse a payment comment into the chosen game and outcome
+
+    The first word that names an outcome decides the game and the choice.
+    A word naming only a game is used when no outcome is given.
+
+    Returns:
+        ParsedComment: game and choice, both None if nothing was recognized
+    """
+    if not comment:
+        return _EMPTY
+
+    game = None
+    used_fuzzy = False
+    for word in _WORD.findall(_normalize(comment)):
+        meaning, fuzzy = _lookup(word)
+        if meaning is None:
+            continue
+        used_fuzzy = used_fuzzy or fuzzy
+        word_game, outcome = meaning
+        if outcome is not None and (game is None or game == word_game):
+            return ParsedComment(word_game, outcome, used_fuzzy)
+        if game is None:
+            game = word_game
+
+    if game is None:
+        return _EMPTY
+    return ParsedComment(game, None, used_fuzzy)
@@ -25,3 +25,17 @@ HIGHER_LOWER_MULTIPLIER = 1.5
 
 # Number to compare in Higher/Lower game
 HIGHER_LOWER_THRESHOLD = 3  # Higher than 3, Lower than 4
+
+# Bowling multiplier, paid when four pins or more fall or when they don't
+BOWLING_MULTIPLIER = 1.5
+
+# Darts multiplier for a bullseye or a miss, each 1 in 6
+DARTS_MULTIPLIER = 4.5
+
+# Basketball multipliers: a goal lands 2 times in 5, a miss 3 times in 5
+BASKETBALL_GOAL_MULTIPLIER = 1.875
+BASKETBALL_MISS_MULTIPLIER = 1.25
+
+# Slot machine multipliers: any three equal symbols (4 of 64) and 777 (1 of 64)
+SLOTS_TRIPLE_MULTIPLIER = 12
+SLOTS_JACKPOT_MULTIPLIER = 48
@@ -5,11 +5,17 @@ CryptoBot payment integration
 """
 
 import os
+import time
 import uuid
 import json
+import sqlite3
 import logging
-import aiohttp
-from user_data import get_user_data, update_user_data, save_user_data
+from collections import OrderedDict
+from user_data import get_user_data, update_user_data, save_user_data, flush_user_data
+from cryptobot_client import cryptobot
+from ledger import ledger
+from comment_parser import parse_comment
+from money import Money, ZERO
 
 logger = logging.getLogger(__name__)
 
@@ -17,11 +23,118 @@ logger = logging.getLogger(__name__)
 CRYPTOBOT_TOKEN = os.getenv("CRYPTOBOT_TOKEN")
 RESULTS_CHANNEL_ID = os.getenv("RESULTS_CHANNEL_ID")
 
-# CryptoBot API URL
-CRYPTOBOT_API_URL = "https://pay.crypt.bot/api"
+# Persistent set of invoice IDs that have already been credited
+PROCESSED_INVOICES_DB = "data/processed_invoices.db"
 
-# Track transactions
-TRANSACTIONS = {}
+# Recently processed invoice IDs are answered from memory for this long
+PROCESSED_INVOICES_WINDOW = float(os.getenv("PROCESSED_INVOICES_WINDOW", "3600"))
+PROCESSED_INVOICES_CACHE_SIZE = int(os.getenv("PROCESSED_INVOICES_CACHE_SIZE", "100000"))
+
+# Latest credited invoice IDs kept in each user record, written together with the balance
+CREDITED_INVOICES_PER_USER = int(os.getenv("CREDITED_INVOICES_PER_USER", "20"))
+
+# Fee charged on withdrawals to an external wallet; CryptoBot transfers are free
+WITHDRAWAL_FEE = Money.of(os.getenv("WITHDRAWAL_FEE_TON", "0.1"))
+
+class ProcessedInvoiceIndex:
+    """
+    Long-term index of credited invoices
+
+    The set lives in SQLite with invoice_id as the primary key, so looking
+    up or claiming an invoice is a single indexed query regardless of how
+    many invoices were processed before. Redeliveries usually arrive shortly
+    after the original, so IDs claimed within the last `window` seconds are
+    kept in a bounded in-memory LRU that answers them without touching the
+    database.
+
+    An invoice is claimed here only after its credit has been written to the
+    user store; until then the ID stored in the user record guards it (see
+    credit_deposit()). Invoices whose write failed are deferred: they count
+    as seen, stay in the user record and are claimed after the next write
+    that succeeds.
+    """
+
+    def __init__(self, path=PROCESSED_INVOICES_DB, window=PROCESSED_INVOICES_WINDOW,
+                 cache_size=PROCESSED_INVOICES_CACHE_SIZE):
+        self.path = path
+        self.window = window
+        self.cache_size = cache_size
+        self._recent = OrderedDict()
+        # Credited invoices waiting for their credit to be written
+        self._deferred = set()
+        self._conn = None
+
+    def seen(self, invoice_id):
+        """Whether an invoice was claimed or deferred before"""
+        invoice_id = str(invoice_id)
+        if invoice_id in self._deferred:
+            return True
+        self._expire(time.monotonic())
+        if invoice_id in self._recent:
+            return True
+        row = self._connect().execute(
+            "SELECT 1 FROM processed_invoices WHERE invoice_id = ?", (invoice_id,)
+        ).fetchone()
+        return row is not None
+
+    def claim(self, invoice_id):
+        """Mark an invoice as processed; returns False if it already was"""
+        invoice_id = str(invoice_id)
+        now = time.monotonic()
+        self._expire(now)
+        if invoice_id in self._recent:
+            return False
+
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_invoices (invoice_id, processed_at) VALUES (?, ?)",
+                (invoice_id, int(time.time()))
+            )
+        self._recent[invoice_id] = now
+        if len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+        return cursor.rowcount == 1
+
+    def defer(self, invoice_id):
+        """Remember a credited invoice whose credit is not written yet"""
+        self._deferred.add(str(invoice_id))
+
+    def is_deferred(self, invoice_id):
+        return str(invoice_id) in self._deferred
+
+    def claim_deferred(self):
+        """Claim the deferred invoices; call once a write of the user store succeeded"""
+        while self._deferred:
+            self.claim(self._deferred.pop())
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _expire(self, now):
+        """Drop IDs that left the time window; the oldest are at the front"""
+        deadline = now - self.window
+        while self._recent:
+            invoice_id, claimed_at = next(iter(self._recent.items()))
+            if claimed_at >= deadline:
+                break
+            del self._recent[invoice_id]
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_invoices "
+                "(invoice_id TEXT PRIMARY KEY, processed_at INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+processed_invoices = ProcessedInvoiceIndex()
 
 async def create_fixed_invoice(coin_id="TON"):
     """
@@ -39,7 +152,7 @@ async def create_fixed_invoice(coin_id="TON"):
     # Просто возвращаем фиксированный инвойс IV15707697, который
     # показывает страницу выбора монеты, а затем страницу ввода суммы
     # точно как на предоставленных пользователем скриншотах
-    logger.warning(f"🧿 Используем только фиксированный инвойс IV15707697 для выбора монеты")
+    logger.debug("Используем только фиксированный инвойс IV15707697 для выбора монеты")
     return "https://t.me/CryptoBot?start=IV15707697"
 
 async def create_deposit_invoice(user_id, amount, use_cryptobot_user=False, cryptobot_user_id=None):
@@ -53,11 +166,32 @@ async def create_deposit_invoice(user_id, amount, use_cryptobot_user=False, cryp
         cryptobot_user_id: CryptoBot user ID for direct transfer
     """
     logger.info(f"Создание счета на пополнение для пользователя {user_id} на сумму {amount} TON")
-    
-    # Используем только фиксированный инвойс IV15707697, который показывает
-    # сначала страницу выбора валюты, а затем страницу ввода произвольной суммы
+
+    # Если создать счет не удалось, используем фиксированный инвойс IV15707697, который
+    # показывает сначала страницу выбора валюты, а затем страницу ввода произвольной суммы
     fixed_invoice_url = "https://t.me/CryptoBot?start=IV15707697"
-    logger.warning(f"💰 Используем фиксированный инвойс: {fixed_invoice_url}")
+
+    # The reconciler imports this module for process_payment_update()
+    from payment_reconciler import reconciler
+
+    try:
+        status, result = await cryptobot.call("createInvoice", payload={
+            "asset": "TON",
+            "amount": str(Money.of(amount)),
+            "description": "Пополнение баланса",
+            "hidden_message": f"user_id:{user_id}"
+        }, http_method="POST")
+        if status == 200 and result.get("ok"):
+            invoice = result.get("result", {})
+            # Polled until paid, so the deposit is credited even if its webhook is lost
+            reconciler.track(invoice["invoice_id"])
+            return invoice.get("bot_invoice_url") or invoice.get("pay_url")
+        error_msg = result.get("error", {}).get("message", "Unknown error")
+        logger.error(f"CryptoBot API error: {error_msg}")
+    except Exception as e:
+        logger.error(f"Exception during invoice creation: {e}")
+
+    logger.debug("Используем фиксированный инвойс: %s", fixed_invoice_url)
     return fixed_invoice_url
 
 async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=False, cryptobot_user_id=None):
@@ -71,6 +205,7 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
         use_cryptobot_user: Whether to use CryptoBot user ID for direct transfer
         cryptobot_user_id: CryptoBot user ID for direct transfer
     """
+    amount = Money.of(amount)
     logger.info(f"Создание запроса на вывод для пользователя {user_id} на сумму {amount} TON")
     
     # Проверка достаточности средств
@@ -92,13 +227,15 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
     # Генерируем уникальный ID транзакции
     transaction_id = str(uuid.uuid4())
     
-    # Формируем URL запроса
-    url = f"{CRYPTOBOT_API_URL}/transfer"
-    
-    # Комиссия на вывод (можно настраивать)
+    # Комиссия на вывод (WITHDRAWAL_FEE_TON)
     # При выводе на CryptoBot нет комиссии
-    fee = 0 if use_cryptobot_user else 0.1  # TON
+    fee = ZERO if use_cryptobot_user else WITHDRAWAL_FEE
     net_amount = amount - fee
+    if net_amount <= 0:
+        return {
+            "success": False,
+            "message": f"Сумма вывода должна превышать комиссию {fee} TON"
+        }
     
     # Готовим данные для запроса
     if use_cryptobot_user and cryptobot_user_id:
@@ -120,67 +257,62 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
             "comment": f"Withdrawal for user {user_id}"
         }
     
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
     # Сохраняем информацию о транзакции
-    TRANSACTIONS[transaction_id] = {
-        "user_id": user_id,
-        "type": "withdrawal",
-        "amount": amount,
-        "net_amount": net_amount,
-        "fee": fee,
-        "wallet": wallet_address if not use_cryptobot_user else f"CryptoBot: {cryptobot_user_id}",
-        "status": "pending"
-    }
+    ledger.record(
+        transaction_id,
+        user_id,
+        type="withdrawal",
+        amount=str(amount),
+        net_amount=str(net_amount),
+        fee=str(fee),
+        wallet=wallet_address if not use_cryptobot_user else f"CryptoBot: {cryptobot_user_id}",
+        status="pending"
+    )
     
     try:
         # Списываем средства заранее
         update_user_balance(user_id, -amount)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                result = await response.json()
-                
-                if response.status == 200 and result.get("ok"):
-                    transfer_data = result.get("result", {})
-                    transfer_id = transfer_data.get("transfer_id")
-                    
-                    # Обновляем информацию о транзакции
-                    TRANSACTIONS[transaction_id]["transfer_id"] = transfer_id
-                    TRANSACTIONS[transaction_id]["status"] = "completed"
-                    
-                    logger.info(f"Успешно создан вывод #{transfer_id} для пользователя {user_id}")
-                    
-                    if use_cryptobot_user:
-                        return {
-                            "success": True,
-                            "message": f"{net_amount} TON успешно отправлены на ваш CryptoBot аккаунт.",
-                            "transaction_id": transaction_id
-                        }
-                    else:
-                        return {
-                            "success": True,
-                            "message": f"{net_amount} TON успешно отправлены на кошелек {wallet_address}.\nКомиссия: {fee} TON",
-                            "transaction_id": transaction_id
-                        }
-                else:
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    logger.error(f"CryptoBot API error: {error_msg}")
-                    
-                    # Возвращаем средства пользователю
-                    update_user_balance(user_id, amount)
-                    
-                    # Обновляем статус транзакции
-                    TRANSACTIONS[transaction_id]["status"] = "failed"
-                    TRANSACTIONS[transaction_id]["error"] = error_msg
-                    
-                    return {
-                        "success": False,
-                        "message": f"Ошибка при создании вывода: {error_msg}"
-                    }
+        # Повторять перевод безопасно только при наличии spend_id
+        status, result = await cryptobot.call(
+            "transfer", payload=payload, http_method="POST", idempotent="spend_id" in payload
+        )
+        
+        if status == 200 and result.get("ok"):
+            transfer_data = result.get("result", {})
+            transfer_id = transfer_data.get("transfer_id")
+
+            # Обновляем информацию о транзакции
+            ledger.update(transaction_id, transfer_id=transfer_id, status="completed")
+
+            logger.info(f"Успешно создан вывод #{transfer_id} для пользователя {user_id}")
+
+            if use_cryptobot_user:
+                return {
+                    "success": True,
+                    "message": f"{net_amount} TON успешно отправлены на ваш CryptoBot аккаунт.",
+                    "transaction_id": transaction_id
+                }
+            else:
+                return {
+                    "success": True,
+                    "message": f"{net_amount} TON успешно отправлены на кошелек {wallet_address}.\nКомиссия: {fee} TON",
+                    "transaction_id": transaction_id
+                }
+        else:
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            logger.error(f"CryptoBot API error: {error_msg}")
+
+            # Возвращаем средства пользователю
+            update_user_balance(user_id, amount)
+
+            # Обновляем статус транзакции
+            ledger.update(transaction_id, status="failed", error=error_msg)
+
+            return {
+                "success": False,
+                "message": f"Ошибка при создании вывода: {error_msg}"
+            }
     except Exception as e:
         logger.error(f"Exception during withdrawal creation: {e}")
         
@@ -188,8 +320,7 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
         update_user_balance(user_id, amount)
         
         # Обновляем статус транзакции
-        TRANSACTIONS[transaction_id]["status"] = "failed"
-        TRANSACTIONS[transaction_id]["error"] = str(e)
+        ledger.update(transaction_id, status="failed", error=str(e))
         
         return {
             "success": False,
@@ -197,50 +328,96 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
         }
 
 async def check_transaction_status(transaction_id):
-    """Check status of a transaction"""
-    if transaction_id in TRANSACTIONS:
-        return TRANSACTIONS[transaction_id]
-    return None
-
-async def get_transaction_history(user_id, limit=10):
-    """Get transaction history for a user"""
-    user_transactions = []
-    
-    for tx_id, tx_data in TRANSACTIONS.items():
-        if tx_data.get("user_id") == user_id:
-            tx_info = tx_data.copy()
-            tx_info["transaction_id"] = tx_id
-            user_transactions.append(tx_info)
+    """Check status of a transaction by its ID, CryptoBot transfer ID or invoice ID"""
+    return (ledger.get(transaction_id)
+            or ledger.find(transfer_id=transaction_id)
+            or ledger.find(invoice_id=transaction_id))
+
+async def get_transaction_history(user_id, limit=10, cursor=None):
+    """
+    Get transaction history for a user, newest first
     
-    # Sort by timestamp if available, otherwise just return the most recent (limited)
-    return user_transactions[:limit]
+    Args:
+        user_id: Telegram user ID
+        limit: Maximum number of transactions
+        cursor: "seq" of the last transaction of the previous page
+    """
+    return [tx_data.copy() for tx_data in ledger.history(user_id, limit, cursor)]
 
 def get_user_balance(user_id):
-    """Get user balance from user data"""
+    """Get user balance from user data as Money"""
     user_data = get_user_data(user_id)
     if user_data:
-        return user_data.get("balance", 0)
-    return 0
+        return Money(user_data.balance_nano)
+    return ZERO
 
 def update_user_balance(user_id, amount_change):
-    """Update user balance by adding/subtracting amount"""
+    """Update user balance by adding/subtracting amount (Money or TON), returns the new balance"""
+    amount_change = Money.of(amount_change)
     user_data = get_user_data(user_id)
     if user_data:
         # Ensure we don't go below zero
-        user_data["balance"] = max(0, user_data.get("balance", 0) + amount_change)
+        user_data.balance_nano = max(0, user_data.balance_nano + amount_change.nano)
         update_user_data(user_id, user_data)
         save_user_data()
+        balance = Money(user_data.balance_nano)
         
-        # Log the balance change
-        if amount_change > 0:
-            logger.info(f"Пополнение баланса пользователя {user_id} на {amount_change} TON. Новый баланс: {user_data['balance']} TON")
-        else:
-            logger.info(f"Списание с баланса пользователя {user_id} на {abs(amount_change)} TON. Новый баланс: {user_data['balance']} TON")
+        # Every bet changes the balance twice; deposits and withdrawals are logged where they happen
+        logger.debug("Изменение баланса пользователя %s на %s TON. Новый баланс: %s TON",
+                     user_id, amount_change, balance)
             
-        return user_data["balance"]
-    return 0
+        return balance
+    return ZERO
 
-# This function would be called by a webhook handler when CryptoBot sends payment confirmation
+def reserve_balance(user_id, amount):
+    """
+    Debit amount only if the balance covers it
+
+    Returns:
+        The new balance, or None if the user is unknown or the balance is too low
+    """
+    amount = Money.of(amount)
+    user_data = get_user_data(user_id)
+    if not user_data or user_data.balance_nano < amount.nano:
+        return None
+    return update_user_balance(user_id, -amount)
+
+def credit_deposit(user_id, amount, invoice_id):
+    """
+    Add a paid invoice to a user's balance, returns the new balance
+
+    The invoice ID is stored in the same record as the balance, so a single
+    write persists both: after a crash either the deposit and its ID are
+    there or neither is, and a redelivered invoice is rejected in both cases.
+    Only the latest CREDITED_INVOICES_PER_USER IDs are kept, plus older ones
+    that are not claimed in processed_invoices yet.
+    """
+    user_data = get_user_data(user_id)
+    if invoice_id is not None:
+        credited = list(user_data.get("credited_invoices", ()))
+        credited.append(invoice_id)
+        older, latest = credited[:-CREDITED_INVOICES_PER_USER], credited[-CREDITED_INVOICES_PER_USER:]
+        user_data["credited_invoices"] = [
+            credited_id for credited_id in older if processed_invoices.is_deferred(credited_id)
+        ] + latest
+    user_data.balance_nano += amount.nano
+    update_user_data(user_id, user_data)
+    save_user_data()
+    return Money(user_data.balance_nano)
+
+def parse_hidden_message(hidden_message):
+    """(user_id, transaction_id) stored in an invoice's hidden message, None where missing"""
+    user_id = None
+    transaction_id = None
+    if "user_id:" in hidden_message:
+        for part in hidden_message.split(","):
+            if part.startswith("user_id:"):
+                user_id = int(part.replace("user_id:", "").strip())
+            elif part.startswith("txid:"):
+                transaction_id = part.replace("txid:", "").strip()
+    return user_id, transaction_id
+
+# Called by the webhook server (webhook.py) and the invoice reconciler with paid invoices
 async def process_payment_update(update_data):
     """Process payment update from CryptoBot"""
     try:
@@ -250,70 +427,67 @@ async def process_payment_update(update_data):
             payment_comment = invoice.get("comment", "")
             
             # Логируем комментарий платежа для отладки
-            logger.info(f"Получен платеж с комментарием: {payment_comment}")
-            
-            user_id = None
-            transaction_id = None
+            logger.debug("Получен платеж с комментарием: %s", payment_comment)
             
             # Определяем тип игры и выбор пользователя из комментария
-            game_type = None
-            bet_choice = None
-            
-            # Обработка комментария для определения режима игры и выбора
-            if payment_comment:
-                payment_comment = payment_comment.lower().strip()
-                
-                # Боулинг
-                if "бол" in payment_comment:
-                    game_type = "bowling"
-                    if "победа" in payment_comment or "выигрыш" in payment_comment:
-                        bet_choice = "win"
-                    elif "проигрыш" in payment_comment or "поражение" in payment_comment:
-                        bet_choice = "lose"
-                
-                # Чет/нечет
-                elif "чет" in payment_comment:
-                    game_type = "even_odd"
-                    if payment_comment.strip() == "чет":
-                        bet_choice = "even"
-                    elif payment_comment.strip() == "нечет":
-                        bet_choice = "odd"
-                
-                # Больше/меньше
-                elif "больше" in payment_comment or "меньше" in payment_comment:
-                    game_type = "higher_lower"
-                    if "больше" in payment_comment:
-                        bet_choice = "higher"
-                    elif "меньше" in payment_comment:
-                        bet_choice = "lower"
+            parsed_comment = parse_comment(payment_comment)
+            game_type = parsed_comment.game
+            bet_choice = parsed_comment.choice
             
             # Логируем определенный тип игры и выбор
-            logger.info(f"Определен тип игры: {game_type}, выбор ставки: {bet_choice}")
+            logger.debug("Определен тип игры: %s, выбор ставки: %s", game_type, bet_choice)
             
-            # Extract user_id and transaction_id from hidden_message
-            if "user_id:" in hidden_message:
-                parts = hidden_message.split(",")
-                for part in parts:
-                    if part.startswith("user_id:"):
-                        user_id = int(part.replace("user_id:", "").strip())
-                    elif part.startswith("txid:"):
-                        transaction_id = part.replace("txid:", "").strip()
+            user_id, transaction_id = parse_hidden_message(hidden_message)
             
             if user_id:
-                amount = float(invoice.get("amount", 0))
+                # CryptoBot sends amounts as decimal strings, parsed exactly
+                amount = Money.of(invoice.get("amount", 0))
                 asset = invoice.get("asset", "TON")
-                invoice_id = invoice.get("invoice_id", "unknown")
-                
-                # Update user balance
-                update_user_balance(user_id, amount)
-                logger.info(f"Updated balance for user {user_id} with +{amount} {asset}")
+                invoice_id = str(invoice.get("invoice_id", "unknown"))
+                known_invoice = invoice_id != "unknown"
+
+                user_data = get_user_data(user_id)
+                if not user_data:
+                    # Nothing is claimed, so a redelivery after the user registered is still credited
+                    logger.warning(f"Payment for unknown user {user_id}, invoice {invoice_id}")
+                    return {
+                        "success": False,
+                        "message": "User not found"
+                    }
+
+                # The webhook and the reconciler may both deliver the same payment
+                if known_invoice and (invoice_id in user_data.get("credited_invoices", ())
+                                      or processed_invoices.seen(invoice_id)):
+                    logger.info(f"Invoice {invoice_id} was already processed, skipping")
+                    return {
+                        "success": False,
+                        "duplicate": True,
+                        "message": "Invoice already processed"
+                    }
+
+                # Balance and invoice ID change together, before any await lets a redelivery in
+                credit_deposit(user_id, amount, invoice_id if known_invoice else None)
+                logger.info("Deposit credited", extra={"user_id": user_id, "invoice_id": invoice_id,
+                                                       "amount": str(amount), "asset": asset})
+
+                # Claim the invoice for good only once the credit is on disk
+                if await flush_user_data():
+                    if known_invoice:
+                        processed_invoices.claim(invoice_id)
+                    # This write also carried credits whose own write failed
+                    processed_invoices.claim_deferred()
+                else:
+                    logger.warning(f"Credit of invoice {invoice_id} is not written yet, it will be retried")
+                    if known_invoice:
+                        processed_invoices.defer(invoice_id)
                 
-                # Update transaction if exists
-                if transaction_id and transaction_id in TRANSACTIONS:
-                    TRANSACTIONS[transaction_id]["status"] = "completed"
-                    TRANSACTIONS[transaction_id]["amount"] = amount
-                    TRANSACTIONS[transaction_id]["asset"] = asset
-                    TRANSACTIONS[transaction_id]["invoice_id"] = invoice_id
+                # Update transaction if exists, otherwise record the deposit
+                if transaction_id and ledger.get(transaction_id):
+                    ledger.update(transaction_id, status="completed", amount=str(amount),
+                                  asset=asset, invoice_id=invoice_id)
+                else:
+                    ledger.record(f"invoice_{invoice_id}", user_id, type="deposit", status="completed",
+                                  amount=str(amount), asset=asset, invoice_id=invoice_id)
                 
                 # Return payment information
                 return {
@@ -352,41 +526,31 @@ async def check_payment_status(invoice_id):
             "message": "CryptoBot token not available"
         }
     
-    url = f"{CRYPTOBOT_API_URL}/getInvoices"
-    params = {"invoice_ids": [invoice_id]}
-    
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
+    # The reconciler imports this module for process_payment_update()
+    from payment_reconciler import reconciler
+
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, headers=headers) as response:
-                result = await response.json()
-                
-                if response.status == 200 and result.get("ok"):
-                    invoices = result.get("result", {}).get("items", [])
-                    if invoices:
-                        invoice = invoices[0]
-                        return {
-                            "success": True,
-                            "status": invoice.get("status"),
-                            "paid": invoice.get("paid"),
-                            "amount": invoice.get("amount"),
-                            "asset": invoice.get("asset")
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "message": "Invoice not found"
-                        }
-                else:
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    return {
-                        "success": False,
-                        "message": f"API error: {error_msg}"
-                    }
+        # Joins the reconciler's next batched getInvoices request, and a paid
+        # invoice is credited by it before the status comes back
+        invoice = await reconciler.lookup(invoice_id)
+        if invoice:
+            return {
+                "success": True,
+                "status": invoice.get("status"),
+                "paid": invoice.get("paid"),
+                "amount": invoice.get("amount"),
+                "asset": invoice.get("asset")
+            }
+        else:
+            return {
+                "success": False,
+                "message": "Invoice not found"
+            }
+    except RuntimeError as e:
+        return {
+            "success": False,
+            "message": str(e)
+        }
     except Exception as e:
         logger.error(f"Error checking payment status: {e}")
         return {
@@ -403,34 +567,25 @@ async def test_api_connection():
             "message": "CryptoBot token not available"
         }
     
-    url = f"{CRYPTOBOT_API_URL}/getMe"
-    
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                
-                if response.status == 200 and result.get("ok"):
-                    app_info = result.get("result", {})
-                    return {
-                        "success": True,
-                        "app_id": app_info.get("app_id"),
-                        "name": app_info.get("name"),
-                        "payment_processing_bot_username": app_info.get("payment_processing_bot_username")
-                    }
-                else:
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    error_code = result.get("error", {}).get("code", None)
-                    return {
-                        "success": False,
-                        "message": error_msg,
-                        "code": error_code
-                    }
+        status, result = await cryptobot.call("getMe")
+        
+        if status == 200 and result.get("ok"):
+            app_info = result.get("result", {})
+            return {
+                "success": True,
+                "app_id": app_info.get("app_id"),
+                "name": app_info.get("name"),
+                "payment_processing_bot_username": app_info.get("payment_processing_bot_username")
+            }
+        else:
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            error_code = result.get("error", {}).get("code", None)
+            return {
+                "success": False,
+                "message": error_msg,
+                "code": error_code
+            }
     except Exception as e:
         logger.error(f"Error testing API connection: {e}")
         return {
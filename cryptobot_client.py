@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+CryptoBot API client with a shared connection pool
+
+One aiohttp session is kept open for the lifetime of the application, so
+requests to pay.crypt.bot reuse warm keep-alive connections instead of doing
+a TCP and TLS handshake every time. Requests get a per-call timeout and are
+retried with jittered exponential backoff on connection errors, timeouts,
+429 and 5xx responses.
+
+CRYPTOBOT_API_URL can point the client at a local stub server.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# CryptoBot API URL
+CRYPTOBOT_API_URL = os.getenv("CRYPTOBOT_API_URL", "https://pay.crypt.bot/api")
+
+# Connection pool limits
+CRYPTOBOT_POOL_LIMIT = int(os.getenv("CRYPTOBOT_POOL_LIMIT", "20"))
+CRYPTOBOT_KEEPALIVE = float(os.getenv("CRYPTOBOT_KEEPALIVE", "60"))
+
+# Per-request timeout in seconds
+CRYPTOBOT_TIMEOUT = float(os.getenv("CRYPTOBOT_TIMEOUT", "10"))
+
+# Retries after the first attempt and the base backoff delay in seconds
+CRYPTOBOT_RETRIES = int(os.getenv("CRYPTOBOT_RETRIES", "3"))
+CRYPTOBOT_BACKOFF = float(os.getenv("CRYPTOBOT_BACKOFF", "0.2"))
+
+# Response statuses worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+API_LATENCY = metrics.histogram(
+    "cryptobot_request_seconds", "Duration of CryptoBot API calls including retries", ["method"]
+)
+API_RESPONSES = metrics.counter(
+    "cryptobot_responses", "CryptoBot API calls by final HTTP status, or error", ["method", "status"]
+)
+
+
+class CryptoBotClient:
+    """Long-lived CryptoBot API client that owns one pooled aiohttp session"""
+
+    def __init__(self, token, base_url=CRYPTOBOT_API_URL, pool_limit=CRYPTOBOT_POOL_LIMIT,
+                 keepalive=CRYPTOBOT_KEEPALIVE, timeout=CRYPTOBOT_TIMEOUT,
+                 retries=CRYPTOBOT_RETRIES, backoff=CRYPTOBOT_BACKOFF):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.pool_limit = pool_limit
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+
+    async def start(self):
+        """Open the pooled session"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit,
+            keepalive_timeout=self.keepalive,
+            ttl_dns_cache=300
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Crypto-Pay-API-Token": self.token or ""}
+        )
+        logger.info(f"CryptoBot client started ({self.base_url}, pool of {self.pool_limit})")
+
+    async def close(self):
+        """Close the session and its pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.info("CryptoBot client closed")
+
+    async def call(self, api_method, params=None, payload=None, http_method="GET", idempotent=None):
+        """
+        Call a CryptoBot API method
+
+        Args:
+            api_method: API method name, e.g. "getMe" or "transfer"
+            params: Query string parameters
+            payload: JSON body
+            http_method: "GET" or "POST"
+            idempotent: Whether the call may be retried; defaults to True for GET
+
+        Returns:
+            tuple: (HTTP status, decoded JSON response)
+        """
+        if self._session is None or self._session.closed:
+            # Used outside of the application lifecycle (scripts, tests)
+            await self.start()
+        if idempotent is None:
+            idempotent = http_method == "GET"
+        started = time.perf_counter()
+        status = "error"
+        try:
+            status, result = await self._request(api_method, params, payload, http_method, idempotent)
+            return status, result
+        finally:
+            API_LATENCY.labels(api_method).observe(time.perf_counter() - started)
+            API_RESPONSES.labels(api_method, str(status)).inc()
+
+    async def _request(self, api_method, params, payload, http_method, idempotent):
+        attempts = 1 + (self.retries if idempotent else 0)
+        url = f"{self.base_url}/{api_method}"
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                async with self._session.request(http_method, url, params=params, json=payload) as response:
+                    if response.status in RETRY_STATUSES and not last_attempt:
+                        delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                        logger.warning(f"CryptoBot {api_method} returned {response.status}, "
+                                       f"retrying in {delay:.2f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    return response.status, await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"CryptoBot {api_method} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, honouring Retry-After when given"""
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+
+# Client shared by the application
+cryptobot = CryptoBotClient(os.getenv("CRYPTOBOT_TOKEN"))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pure game rules
+
+Outcome and payout logic of the registered games, free of Telegram,
+balances and message formatting. settle() turns a dice value, a choice and
+a stake into a Settlement using the outcomes declared in game_registry;
+game_simulator.py replays the same rules at volume to check house edge and
+payout variance. Stakes and payouts are Money: a payout is the stake times
+the exact multiplier, rounded down to whole nano-TON.
+"""
+
+from collections import namedtuple
+from game_registry import GAMES
+from money import Money, ZERO
+
+# won: whether the choice won, payout: amount credited back (0 for a loss),
+# net: payout minus stake, the change of the player's balance
+Settlement = namedtuple("Settlement", ["game", "choice", "dice_value", "stake", "won", "payout", "net"])
+
+def _outcome(game, choice):
+    spec = GAMES.get(game)
+    if spec is None:
+        raise ValueError(f"Unknown game: {game}")
+    outcome = spec.outcomes.get(choice)
+    if outcome is None:
+        raise ValueError(f"Unknown choice for {game}: {choice}")
+    return spec, outcome
+
+def payout_for(game, choice, stake):
+    """Amount paid for a winning bet of the given stake, as Money"""
+    return Money.of(stake) * _outcome(game, choice)[1].multiplier
+
+def settle(game, choice, dice_value, stake):
+    """
+    Settle one bet
+
+    Args:
+        game: Registered game key
+        choice: Outcome the player bet on
+        dice_value: Value the dice showed
+        stake: Bet amount, Money or TON
+
+    Returns:
+        Settlement: outcome, payout and net balance change of the bet, as Money
+    """
+    _, outcome = _outcome(game, choice)
+    if not isinstance(stake, Money):
+        stake = Money.of(stake)
+    won = dice_value in outcome.values
+    payout = stake * outcome.multiplier if won else ZERO
+    return Settlement(game, choice, dice_value, stake, won, payout, Money(payout.nano - stake.nano))
+
+def win_probability(game, choice):
+    """Chance that a choice wins on a fair dice"""
+    spec, outcome = _outcome(game, choice)
+    return len(outcome.values) / len(spec.values)
+
+def expected_result(game, choice, stake):
+    """
+    Exact expected net result and its variance for one bet
+
+    Returns:
+        dict: mean, variance, return to player and house edge per bet
+    """
+    p = win_probability(game, choice)
+    payout = float(payout_for(game, choice, stake))
+    stake = float(stake)
+    mean = p * payout - stake
+    return {
+        "mean": mean,
+        "variance": p * (1 - p) * payout ** 2,
+        "rtp": p * payout / stake,
+        "house_edge": -mean / stake
+    }
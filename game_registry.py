@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Registry of the casino games
+
+Every game is declared once here: its Telegram dice emoji, the values that
+dice can show, the outcomes a player can bet on with their winning values
+and multipliers, the words that select it in a payment comment and the
+message templates used to report a result. The settlement pipeline in
+games.py, the rules in game_engine, the comment parser, the menus and the
+channel feed all read this registry, so adding a game is one
+register_game() call.
+"""
+
+from collections import namedtuple
+from constants import (EVEN_ODD_MULTIPLIER, HIGHER_LOWER_MULTIPLIER, HIGHER_LOWER_THRESHOLD,
+                       BOWLING_MULTIPLIER, DARTS_MULTIPLIER, BASKETBALL_GOAL_MULTIPLIER,
+                       BASKETBALL_MISS_MULTIPLIER, SLOTS_TRIPLE_MULTIPLIER, SLOTS_JACKPOT_MULTIPLIER)
+
+# title: shown to players, values: winning dice values,
+# multiplier: payout per staked TON, aliases: words naming it in a comment
+Outcome = namedtuple("Outcome", ["title", "values", "multiplier", "aliases"])
+
+# emoji: dice sent to Telegram, icon: shown in menus and messages,
+# values: everything the dice can show, labels: dice value -> description,
+# hint: example comments for the channel feed
+Game = namedtuple("Game", ["key", "title", "emoji", "icon", "values", "outcomes",
+                           "labels", "aliases", "hint", "templates"])
+
+# Result messages; a game may override any of them
+DEFAULT_TEMPLATES = {
+    "roll": (
+        "{emoji} Результат броска: {value} ({label})\n"
+        "Ваша ставка: {choice} ({stake} TON)\n"
+        "Результат: {result_short}\n"
+        "Текущий баланс: {balance} TON"
+    ),
+    "user": (
+        "{icon} Результат игры {title}:\n\n"
+        "Ваша ставка: {choice} - {stake} TON\n"
+        "Выпало: {value} ({label})\n\n"
+        "{verdict}\n"
+        "Ваш текущий баланс: {balance} TON"
+    ),
+    "channel": (
+        "{icon} Игра: {title}\n"
+        "Игрок: @{username}\n"
+        "Ставка: {choice} - {stake} TON\n"
+        "Выпало: {value} ({label})\n"
+        "Результат: {result}"
+    ),
+    "duplicate": (
+        "🎮 Игра: {title}\n"
+        "🎯 Ваша ставка: {choice} ({stake} TON)\n"
+        "🎲 Выпало: {value} ({label})\n"
+        "💰 Результат: {result}\n"
+        "💵 Текущий баланс: {balance} TON\n\n"
+        "📊 Статистика игр:\n"
+        "🎮 Всего игр: {games_played}\n"
+        "{icon} Игр в режиме {title}: {mode_games}"
+    ),
+    "result_won": "Выигрыш {payout} TON",
+    "result_lost": "Проигрыш {stake} TON",
+    "result_short_won": "🎉 Выигрыш! +{payout} TON",
+    "result_short_lost": "😢 Проигрыш! -{stake} TON",
+    "verdict_won": "🎉 Поздравляем! Вы выиграли {payout} TON!\n",
+    "verdict_lost": "😢 К сожалению, вы проиграли {stake} TON.\n"
+}
+
+# game key -> Game, in menu order
+GAMES = {}
+
+# Comment word -> game key, to keep aliases unambiguous across games
+_ALIASES = {}
+
+def register_game(key, title, emoji, values, outcomes, labels, aliases=(), hint="",
+                  icon=None, templates=None):
+    """
+    Add a game to the registry
+
+    Args:
+        key: Identifier used in callbacks, user data and comments
+        title: Name shown to players
+        emoji: Telegram dice emoji the game is played with
+        values: All values that dice can show
+        outcomes: choice -> Outcome
+        labels: dice value -> short description of what happened
+        aliases: Words that name the game in a payment comment
+        hint: Example comments shown in the channel feed
+        icon: Menu icon, the dice emoji by default
+        templates: Overrides of DEFAULT_TEMPLATES
+    """
+    if key in GAMES:
+        raise ValueError(f"Game {key} is already registered")
+    values = tuple(values)
+    for choice, outcome in outcomes.items():
+        if not outcome.values or not set(outcome.values) <= set(values):
+            raise ValueError(f"Outcome {key}/{choice} must win on some of the dice values {values}")
+    if set(labels) != set(values):
+        raise ValueError(f"Game {key} needs a label for every dice value")
+
+    words = [(alias, key) for alias in aliases]
+    words += [(alias, key) for outcome in outcomes.values() for alias in outcome.aliases]
+    for alias, owner in words:
+        if _ALIASES.get(alias, owner) != owner:
+            raise ValueError(f"Alias {alias!r} of {key} is already used by {_ALIASES[alias]}")
+
+    game = Game(
+        key=key,
+        title=title,
+        emoji=emoji,
+        icon=icon or emoji,
+        values=values,
+        outcomes={choice: outcome._replace(values=frozenset(outcome.values))
+                  for choice, outcome in outcomes.items()},
+        labels=dict(labels),
+        aliases=tuple(aliases),
+        hint=hint,
+        templates={**DEFAULT_TEMPLATES, **(templates or {})}
+    )
+    for alias, owner in words:
+        _ALIASES[alias] = owner
+    GAMES[key] = game
+    return game
+
+def get_game(key):
+    """Look up a registered game, None if there is no such game"""
+    return GAMES.get(key)
+
+def _slot_label(value):
+    """Symbols on the three reels of a 🎰 dice value"""
+    symbols = ("BAR", "🍇", "🍋", "7️⃣")
+    index = value - 1
+    return " ".join(symbols[(index >> shift) & 3] for shift in (0, 2, 4))
+
+
+DICE = range(1, 7)
+
+register_game(
+    "even_odd", "Чет/Нечет", "🎲", DICE,
+    outcomes={
+        "even": Outcome("Чет", [v for v in DICE if v % 2 == 0], EVEN_ODD_MULTIPLIER,
+                        ["чет", "четное", "четный"]),
+        "odd": Outcome("Нечет", [v for v in DICE if v % 2 == 1], EVEN_ODD_MULTIPLIER,
+                       ["нечет", "нечетное", "нечетный"])
+    },
+    labels={v: "Чет" if v % 2 == 0 else "Нечет" for v in DICE},
+    aliases=["чн", "четнечет"],
+    hint="`чет` или `нечет`"
+)
+
+register_game(
+    "higher_lower", "Больше/Меньше", "🎲", DICE, icon="📊",
+    outcomes={
+        "higher": Outcome(f"Больше {HIGHER_LOWER_THRESHOLD}",
+                          [v for v in DICE if v > HIGHER_LOWER_THRESHOLD], HIGHER_LOWER_MULTIPLIER,
+                          ["больше", "выше", f">{HIGHER_LOWER_THRESHOLD}"]),
+        "lower": Outcome(f"Меньше {HIGHER_LOWER_THRESHOLD + 1}",
+                         [v for v in DICE if v <= HIGHER_LOWER_THRESHOLD], HIGHER_LOWER_MULTIPLIER,
+                         ["меньше", "ниже", f"<{HIGHER_LOWER_THRESHOLD + 1}"])
+    },
+    labels={v: f"Больше {HIGHER_LOWER_THRESHOLD}" if v > HIGHER_LOWER_THRESHOLD
+            else f"Меньше {HIGHER_LOWER_THRESHOLD + 1}" for v in DICE},
+    aliases=["бм", "большеменьше"],
+    hint="`больше` или `меньше`"
+)
+
+register_game(
+    "bowling", "Боулинг", "🎳", DICE,
+    outcomes={
+        # Four pins or more count as a win
+        "win": Outcome("Победа", [4, 5, 6], BOWLING_MULTIPLIER, ["победа", "выигрыш", "вин", "страйк"]),
+        "lose": Outcome("Поражение", [1, 2, 3], BOWLING_MULTIPLIER, ["поражение", "проигрыш", "луз", "мимо"])
+    },
+    labels={1: "мимо", 2: "1 кегля", 3: "3 кегли", 4: "4 кегли", 5: "5 кеглей", 6: "страйк"},
+    aliases=["бол", "боул", "боулинг", "кегли"],
+    hint="`бол - победа` или `бол - поражение`"
+)
+
+register_game(
+    "darts", "Дартс", "🎯", DICE,
+    outcomes={
+        "center": Outcome("В яблочко", [6], DARTS_MULTIPLIER, ["центр", "яблочко", "булл"]),
+        "miss": Outcome("Промах", [1], DARTS_MULTIPLIER, ["промах", "молоко"])
+    },
+    labels={1: "промах", 2: "внешнее кольцо", 3: "кольцо", 4: "кольцо", 5: "у центра", 6: "в яблочко"},
+    aliases=["дартс", "дарт"],
+    hint="`дартс - центр` или `дартс - промах`"
+)
+
+register_game(
+    "basketball", "Баскетбол", "🏀", range(1, 6),
+    outcomes={
+        "goal": Outcome("Попадание", [4, 5], BASKETBALL_GOAL_MULTIPLIER, ["гол", "попадание", "забил"]),
+        "miss": Outcome("Мимо кольца", [1, 2, 3], BASKETBALL_MISS_MULTIPLIER, ["аут", "незабил"])
+    },
+    labels={1: "мимо", 2: "мимо", 3: "отскок от кольца", 4: "попадание", 5: "чистое попадание"},
+    aliases=["баскет", "баскетбол"],
+    hint="`баскет - гол` или `баскет - аут`"
+)
+
+register_game(
+    "slots", "Слоты", "🎰", range(1, 65),
+    outcomes={
+        # 1, 22, 43 and 64 are the values with three equal symbols
+        "triple": Outcome("Три в ряд", [1, 22, 43, 64], SLOTS_TRIPLE_MULTIPLIER, ["три", "тройка", "триплет"]),
+        "jackpot": Outcome("Джекпот 777", [64], SLOTS_JACKPOT_MULTIPLIER, ["джекпот", "777"])
+    },
+    labels={v: _slot_label(v) for v in range(1, 65)},
+    aliases=["слот", "слоты", "автомат"],
+    hint="`слоты - три` или `слоты - джекпот`"
+)
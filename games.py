@@ -3,207 +3,117 @@
 
 """
 Game logic for casino games
+
+Every registered game goes through play_game(): roll the game's dice,
+settle the bet atomically and report the result with the game's templates.
 """
 
-import random
+import uuid
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from crypto_payments import update_user_balance, get_user_balance
-from user_data import get_user_data
+from settlement import settle_bet
+from game_registry import get_game
+from game_engine import settle
+from message_templates import GameResult, templates_for
+from send_scheduler import scheduler, PRIORITY_USER
+from channel_publisher import publisher
+from money import Money
+from log_pipeline import log_context
 
 logger = logging.getLogger(__name__)
 
-async def play_even_odd(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, bet_choice, bet_amount):
+async def play_game(update: Update, context: ContextTypes.DEFAULT_TYPE, game_key, user_id, bet_choice, bet_amount):
     """
-    Play even/odd game
-    
+    Play one round of a registered game
+
     Args:
         update: Telegram update object
         context: Context object
+        game_key: Registered game key, e.g. 'even_odd' or 'darts'
         user_id: User ID
-        bet_choice: 'even' or 'odd'
-        bet_amount: Bet amount in TON
-        
+        bet_choice: One of the game's outcomes
+        bet_amount: Bet amount, Money or TON
+
     Returns:
-        dict: Result information including messages and dice value
+        dict: Result information including messages (LazyText, rendered by str())
+              and dice value, or success=False with a message if the bet
+              could not be placed
     """
-    # First subtract the bet amount from user balance
-    current_balance = update_user_balance(user_id, -bet_amount)
-    
-    # Send dice animation
-    message = await update.callback_query.message.reply_dice(emoji="🎲")
-    dice_value = message.dice.value
-    
-    # Determine if the result is even or odd
-    is_even = dice_value % 2 == 0
-    result_text = "Чет" if is_even else "Нечет"
-    user_won = (bet_choice == "even" and is_even) or (bet_choice == "odd" and not is_even)
-    
-    # Format user-friendly bet choice text
-    bet_choice_text = "Чет" if bet_choice == "even" else "Нечет"
-    
-    # Отправляем сразу дубликат сообщения с результатом броска
-    # Рассчитываем выигрыш для отображения
-    display_winnings = int(bet_amount * 1.5) if user_won else 0
-    
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=f"🎲 Результат броска: {dice_value} ({result_text})\n"
-             f"Ваша ставка: {bet_choice_text} ({bet_amount} TON)\n"
-             f"Результат: {'🎉 Выигрыш! +' + str(display_winnings) + ' TON' if user_won else '😢 Проигрыш! -' + str(bet_amount) + ' TON'}\n"
-             f"Текущий баланс: {get_user_balance(user_id)} TON"
-    )
-    
-    # Update balance if user won
-    winnings = 0
-    if user_won:
-        winnings = int(bet_amount * 1.5)  # Уменьшен коэффициент с 2 до 1.5
-        update_user_balance(user_id, winnings)
-    
-    # Format user-friendly bet choice text
-    bet_choice_text = "Чет" if bet_choice == "even" else "Нечет"
-    
-    # Create result message for user
-    user_message = (
-        f"🎲 Результат игры Чет/Нечет:\n\n"
-        f"Ваша ставка: {bet_choice_text} - {bet_amount} TON\n"
-        f"Выпало: {dice_value} ({result_text})\n\n"
-    )
-    
-    if user_won:
-        user_message += f"🎉 Поздравляем! Вы выиграли {winnings} TON!\n"
-    else:
-        user_message += f"😢 К сожалению, вы проиграли {bet_amount} TON.\n"
-    
-    user_message += f"\nВаш текущий баланс: {get_user_balance(user_id)} TON"
-    
-    # Create channel message
-    username = update.callback_query.from_user.username or f"user{user_id}"
-    channel_message = (
-        f"🎲 Игра: Чет/Нечет\n"
-        f"Игрок: @{username}\n"
-        f"Ставка: {bet_choice_text} - {bet_amount} TON\n"
-        f"Выпало: {dice_value} ({result_text})\n"
-        f"Результат: {'Выигрыш ' + str(winnings) + ' TON' if user_won else 'Проигрыш ' + str(bet_amount) + ' TON'}"
-    )
-    
-    logger.info(f"User {user_id} played even/odd game. Bet: {bet_choice}, Amount: {bet_amount}, Result: {dice_value}, Won: {user_won}")
-    
-    # Создаем детальное сообщение с информацией о ставке для дублирования
-    duplicate_message = (
-        f"🎮 Игра: Чет/нечет\n"
-        f"🎯 Ваша ставка: {bet_choice_text} ({bet_amount} TON)\n"
-        f"🎲 Выпало: {dice_value} ({result_text})\n"
-        f"💰 Результат: {'Выигрыш ' + str(winnings) + ' TON' if user_won else 'Проигрыш ' + str(bet_amount) + ' TON'}\n"
-        f"💵 Текущий баланс: {get_user_balance(user_id)} TON\n\n"
-        f"📊 Статистика игр:\n"
-        f"🎮 Всего игр: {get_user_data(user_id).get('games_played', 0) + 1}\n"
-        f"🎲 Игр в режиме Чет/нечет: {get_user_data(user_id).get('even_odd_games', 0) + 1}"
+    game = get_game(game_key)
+    bet_amount = Money.of(bet_amount)
+    if game is None or bet_choice not in game.outcomes:
+        return {
+            "success": False,
+            "message": "Неизвестная игра или исход ставки"
+        }
+
+    # Every record logged for this round carries the same bet_id
+    with log_context(bet_id=uuid.uuid4().hex[:16], user_id=user_id, game=game.key):
+        return await _play_round(update, context, game, user_id, bet_choice, bet_amount)
+
+async def _play_round(update, context, game, user_id, bet_choice, bet_amount):
+    """Roll, settle and report one validated bet"""
+    async def roll():
+        # Send dice animation
+        message = await update.callback_query.message.reply_dice(emoji=game.emoji)
+        return message.dice.value
+
+    def resolve(dice_value):
+        return settle(game.key, bet_choice, dice_value, bet_amount).payout
+
+    # Reserve the bet, roll and pay out while holding the user's lock
+    settlement = await settle_bet(user_id, bet_amount, roll, resolve, game=game.key)
+    if not settlement["success"]:
+        return settlement
+    dice_value = settlement["dice_value"]
+    winnings = settlement["winnings"]
+    user_won = winnings > 0
+
+    # Everything the messages need comes from the settlement
+    stats = settlement["stats"]
+    record = GameResult(
+        choice=bet_choice,
+        stake=bet_amount,
+        payout=winnings,
+        won=user_won,
+        value=dice_value,
+        balance=settlement["balance"],
+        username=update.callback_query.from_user.username or f"user{user_id}",
+        games_played=stats["games"],
+        mode_games=stats["modes"][game.key]
     )
-    
-    return {
-        "message": user_message,
-        "channel_message": channel_message,
-        "duplicate_message": duplicate_message,
-        "dice_value": dice_value,
-        "user_won": user_won,
-        "winnings": winnings if user_won else -bet_amount
-    }
+    templates = templates_for(game)
 
-async def play_higher_lower(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, bet_choice, bet_amount):
-    """
-    Play higher/lower game
-    
-    Args:
-        update: Telegram update object
-        context: Context object
-        user_id: User ID
-        bet_choice: 'higher' or 'lower'
-        bet_amount: Bet amount in TON
-        
-    Returns:
-        dict: Result information including messages and dice value
-    """
-    # First subtract the bet amount from user balance
-    current_balance = update_user_balance(user_id, -bet_amount)
-    
-    # Send dice animation
-    message = await update.callback_query.message.reply_dice(emoji="🎲")
-    dice_value = message.dice.value
-    
-    # Determine if the result is higher than 3 or lower than 4
-    is_higher = dice_value > 3
-    result_text = "Больше 3" if is_higher else "Меньше 4"
-    user_won = (bet_choice == "higher" and is_higher) or (bet_choice == "lower" and not is_higher)
-    
-    # Format user-friendly bet choice text
-    bet_choice_text = "Больше 3" if bet_choice == "higher" else "Меньше 4"
-    
     # Отправляем сразу дубликат сообщения с результатом броска
-    # Рассчитываем выигрыш для отображения
-    display_winnings = int(bet_amount * 1.5) if user_won else 0
-    
-    await context.bot.send_message(
+    await scheduler.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
-        text=f"🎲 Результат броска: {dice_value} ({result_text})\n"
-             f"Ваша ставка: {bet_choice_text} ({bet_amount} TON)\n"
-             f"Результат: {'🎉 Выигрыш! +' + str(display_winnings) + ' TON' if user_won else '😢 Проигрыш! -' + str(bet_amount) + ' TON'}\n"
-             f"Текущий баланс: {get_user_balance(user_id)} TON"
-    )
-    
-    # Update balance if user won
-    winnings = 0
-    if user_won:
-        winnings = int(bet_amount * 1.5)  # Уменьшен коэффициент с 2 до 1.5
-        update_user_balance(user_id, winnings)
-    
-    # Format user-friendly bet choice text
-    bet_choice_text = "Больше 3" if bet_choice == "higher" else "Меньше 4"
-    
-    # Create result message for user
-    user_message = (
-        f"📊 Результат игры Больше/Меньше:\n\n"
-        f"Ваша ставка: {bet_choice_text} - {bet_amount} TON\n"
-        f"Выпало: {dice_value} ({result_text})\n\n"
+        priority=PRIORITY_USER,
+        text=templates.render("roll", record)
     )
-    
-    if user_won:
-        user_message += f"🎉 Поздравляем! Вы выиграли {winnings} TON!\n"
-    else:
-        user_message += f"😢 К сожалению, вы проиграли {bet_amount} TON.\n"
-    
-    user_message += f"\nВаш текущий баланс: {get_user_balance(user_id)} TON"
-    
-    # Create channel message
-    username = update.callback_query.from_user.username or f"user{user_id}"
-    channel_message = (
-        f"📊 Игра: Больше/Меньше\n"
-        f"Игрок: @{username}\n"
-        f"Ставка: {bet_choice_text} - {bet_amount} TON\n"
-        f"Выпало: {dice_value} ({result_text})\n"
-        f"Результат: {'Выигрыш ' + str(winnings) + ' TON' if user_won else 'Проигрыш ' + str(bet_amount) + ' TON'}"
-    )
-    
-    logger.info(f"User {user_id} played higher/lower game. Bet: {bet_choice}, Amount: {bet_amount}, Result: {dice_value}, Won: {user_won}")
-    
-    # Создаем детальное сообщение с информацией о ставке для дублирования
-    duplicate_message = (
-        f"🎮 Игра: Больше/меньше\n"
-        f"🎯 Ваша ставка: {bet_choice_text} ({bet_amount} TON)\n"
-        f"🎲 Выпало: {dice_value} ({result_text})\n"
-        f"💰 Результат: {'Выигрыш ' + str(winnings) + ' TON' if user_won else 'Проигрыш ' + str(bet_amount) + ' TON'}\n"
-        f"💵 Текущий баланс: {get_user_balance(user_id)} TON\n\n"
-        f"📊 Статистика игр:\n"
-        f"🎮 Всего игр: {get_user_data(user_id).get('games_played', 0) + 1}\n"
-        f"📈 Игр в режиме Больше/меньше: {get_user_data(user_id).get('higher_lower_games', 0) + 1}"
-    )
-    
+
+    # Rendered only if the channel feed or a caller actually uses them
+    channel_message = templates.lazy("channel", record)
+    publisher.publish_result(channel_message)
+
+    logger.info("Bet settled", extra={"choice": bet_choice, "stake": str(bet_amount), "dice_value": dice_value,
+                                      "payout": str(winnings), "won": user_won})
+
     return {
-        "message": user_message,
+        "success": True,
+        "message": templates.lazy("user", record),
         "channel_message": channel_message,
-        "duplicate_message": duplicate_message,
+        "duplicate_message": templates.lazy("duplicate", record),
         "dice_value": dice_value,
         "user_won": user_won,
         "winnings": winnings if user_won else -bet_amount
     }
+
+async def play_even_odd(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, bet_choice, bet_amount):
+    """Play even/odd game, bet_choice is 'even' or 'odd'"""
+    return await play_game(update, context, "even_odd", user_id, bet_choice, bet_amount)
+
+async def play_higher_lower(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, bet_choice, bet_amount):
+    """Play higher/lower game, bet_choice is 'higher' or 'lower'"""
+    return await play_game(update, context, "higher_lower", user_id, bet_choice, bet_amount)
@@ -8,11 +8,18 @@ import os
 import datetime
 import logging
 import random
+from functools import lru_cache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from user_data import (get_user_data, update_user_data, save_user_data, 
-                      get_games_played, get_registration_date, get_favorite_game)
+from user_data import get_user_data, update_user_data, save_user_data
+from user_stats import stats_of
+from user_record import UserRecord
+from money import Money
 from crypto_payments import create_deposit_invoice, test_api_connection, create_fixed_invoice
+from send_scheduler import scheduler, PRIORITY_USER, PRIORITY_CHANNEL
+from channel_publisher import publisher
+from game_registry import GAMES, get_game
+from leaderboard import leaderboards, PERIODS, PERIOD_TITLES
 
 logger = logging.getLogger(__name__)
 
@@ -30,13 +37,13 @@ async def create_payment_url(user_id, bet_amount=4.0):
     Returns:
         str: URL для оплаты через CryptoBot с экраном выбора монеты и произвольной суммы
     """
-    logger.info(f"Создаем платёжный счет с выбором монеты для пользователя {user_id}")
+    logger.debug("Создаем платёжный счет с выбором монеты для пользователя %s", user_id)
     
     # ВАЖНО! Всегда используем только фиксированный инвойс IV15707697
     # который показывает сначала страницу выбора валюты, а потом страницу с вводом суммы
     # Это прямая ссылка на предварительно созданный инвойс, который настроен для работы с произвольной суммой
     fixed_invoice_url = "https://t.me/CryptoBot?start=IV15707697"
-    logger.warning(f"===DEBUG=== Созданный WebApp payment_url: {fixed_invoice_url}")
+    logger.debug("Созданный WebApp payment_url: %s", fixed_invoice_url)
     return fixed_invoice_url
 
     # Закомментированный оригинальный код, который можно будет использовать позже
@@ -65,86 +72,95 @@ async def create_payment_url(user_id, bet_amount=4.0):
 
 async def send_channel_bet_message(context, user, game_type=None, bet_choice=None, bet_amount=4.0):
     """
-    Отправляет сообщение о ставке в игровой канал в новом формате
+    Добавляет объявление о ставке в ленту игрового канала
     
     Args:
         context: Context объект
         user: Объект пользователя
-        game_type: Тип игры ('even_odd', 'higher_lower', 'bowling') или None для универсального сообщения
-        bet_choice: Выбор пользователя ('even', 'odd', 'higher', 'lower', 'win', 'lose') или None
+        game_type: Ключ игры из реестра ('even_odd', 'bowling', ...) или None для универсального сообщения
+        bet_choice: Исход, на который ставит пользователь ('even', 'win', ...) или None
         bet_amount: Сумма ставки в USD (по умолчанию 4.0)
     
     Returns:
-        Message: Объект отправленного сообщения
+        Message: Текущее сообщение ленты канала или None до первой публикации
     """
     # Если game_type и bet_choice указаны, конвертируем их в русские названия
     # В противном случае используем универсальное сообщение
     if game_type and bet_choice:
         # Преобразование названий в русский
-        game_type_ru = {
-            "higher_lower": "Больше / Меньше",
-            "even_odd": "Чет / Нечет",
-            "bowling": "Боулинг"
-        }.get(game_type, game_type)
-        
-        bet_choice_ru = {
-            "even": "Чет", 
-            "odd": "Нечет", 
-            "higher": "Больше", 
-            "lower": "Меньше",
-            "win": "Победа",
-            "lose": "Поражение"
-        }.get(bet_choice, bet_choice)
+        game = get_game(game_type)
+        game_type_ru = game.title if game else game_type
+        bet_choice_ru = game.outcomes[bet_choice].title if game and bet_choice in game.outcomes else bet_choice
     
     # Получаем ссылку для платежа с возможностью выбора ПРОИЗВОЛЬНОЙ суммы
-    logger.warning(f"🔴🔴🔴 СОЗДАНИЕ ССЫЛКИ ДЛЯ ПЛАТЕЖА С ПРОИЗВОЛЬНОЙ СУММОЙ для пользователя {user.id}")
+    logger.debug("Создание ссылки для платежа с произвольной суммой для пользователя %s", user.id)
     
     # Используем минимальную сумму 0.1 TON, реальную сумму введет пользователь 
     # в интерфейсе CryptoBot благодаря параметру allow_custom_amount="true"
     payment_url = await create_payment_url(user.id, 0.1)
     
-    # Отправляем в канал сообщение с одной кнопкой для ставки напрямую в чате CryptoBot
-    channel_message = await context.bot.send_message(
-        chat_id=RESULTS_CHANNEL_ID,
-        text=(
-            f"🎮 *НОВАЯ СТАВКА* 🔥\n\n"
-            f"👤 Игрок: {user.first_name}\n\n"
-            f"📝 *В комментарии к платежу укажите:*\n\n"
-            f"*Режим и исход:*\n"
-            f"• 🎳 Боулинг: `бол - победа` или `бол - поражение`\n"
-            f"• 🎲 Чет/Нечет: `чет` или `нечет`\n"
-            f"• 📊 Больше/Меньше: `больше` или `меньше`\n\n"
-            f"👇 *Введите удобную для вас сумму от 0.1 до 10 TON* при оплате через CryptoBot:"
+    # Ставка попадает в ленту канала: одно сообщение с кнопкой для ставки,
+    # которое обновляется пачками вместо отдельного сообщения на каждую ставку
+    publisher.payment_url = payment_url
+    return publisher.announce_bet(user)
+
+# Number of parameterized keyboards kept in memory
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "256"))
+
+# Фиксированная ссылка на публичный игровой канал
+CHANNEL_URL = "https://t.me/test5363627"
+
+BACK_BUTTON = InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")
+
+def _build_static_keyboards():
+    """Markups that never change; telegram objects are immutable, so they are shared"""
+    return {
+        # Main menu keyboard
+        "main": InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("Профиль", callback_data="profile"),
+                InlineKeyboardButton("ИГРАТЬ", callback_data="play")
+            ],
+            [InlineKeyboardButton("🏆 Лидеры", callback_data="leaders_day")]
+        ]),
+        # Leaderboard periods
+        "leaders": InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("День", callback_data="leaders_day"),
+                InlineKeyboardButton("Неделя", callback_data="leaders_week"),
+                InlineKeyboardButton("Всё время", callback_data="leaders_all")
+            ],
+            [BACK_BUTTON]
+        ]),
+        # Game selection keyboard
+        "games": InlineKeyboardMarkup(
+            [[InlineKeyboardButton(f"{game.icon} {game.title}", callback_data=f"game_{game.key}")]
+             for game in GAMES.values()]
+            + [[InlineKeyboardButton("🧪 Тест API", callback_data="test_api")], [BACK_BUTTON]]
         ),
-        parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-            [InlineKeyboardButton("📋 Инструкция", callback_data="instruction")]
+        "back": InlineKeyboardMarkup([[BACK_BUTTON]]),
+        "channel": InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎲 Перейти в канал", url=CHANNEL_URL)],
+            [BACK_BUTTON]
         ])
-    )
-    
-    return channel_message
+    }
+
+# Built once at startup
+KEYBOARDS = _build_static_keyboards()
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def url_keyboard(text, url, with_back=True):
+    """Keyboard with one link button and optionally a back button, memoized per URL"""
+    rows = [[InlineKeyboardButton(text, url=url)]]
+    if with_back:
+        rows.append([BACK_BUTTON])
+    return InlineKeyboardMarkup(rows)
 
-# Main menu keyboard
 def get_main_keyboard():
-    keyboard = [
-        [
-            InlineKeyboardButton("Профиль", callback_data="profile"),
-            InlineKeyboardButton("ИГРАТЬ", callback_data="play")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return KEYBOARDS["main"]
 
-# Game selection keyboard
 def get_game_keyboard():
-    keyboard = [
-        [InlineKeyboardButton("🎲 Чет/нечет", callback_data="game_even_odd")],
-        [InlineKeyboardButton("📊 Больше/меньше", callback_data="game_higher_lower")],
-        [InlineKeyboardButton("🎳 Боулинг", callback_data="game_bowling")],
-        [InlineKeyboardButton("🧪 Тест API", callback_data="test_api")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return KEYBOARDS["games"]
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /start command."""
@@ -154,17 +170,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Initialize user data if first time
     user_data = get_user_data(user_id)
     if not user_data:
-        user_data = {
-            "user_id": user_id,
-            "username": user.username or "Anonymous",
-            "registration_date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "games_played": 0,
-            "favorite_game": None,
-            "balance": 0,
-            "even_odd_games": 0,
-            "higher_lower_games": 0,
-            "last_activity": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
+        user_data = UserRecord.new(user_id, user.username or "Anonymous")
         update_user_data(user_id, user_data)
         save_user_data()
     
@@ -188,13 +194,24 @@ async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
     
-    user_id = query.from_user.id
-    games_played = get_games_played(user_id)
-    registration_date = get_registration_date(user_id)
-    favorite_game = get_favorite_game(user_id)
-    
-    games_text = f"🎮 Количество сыгранных игр: {games_played}" if games_played > 0 else "🎮 Вы еще не сыграли ни одной игры!"
-    favorite_text = f"❤️ Любимый режим: {favorite_game}" if favorite_game else "❤️ У вас еще нет любимого режима игры."
+    # Everything the profile shows comes from one record
+    user_data = get_user_data(query.from_user.id) or {}
+    stats = stats_of(user_data)
+    registration_date = user_data.get("registration_date", "Unknown")
+    favorite_game = get_game(stats["favorite"]) if stats["favorite"] else None
+    
+    if stats["games"] > 0:
+        games_text = (
+            f"🎮 Количество сыгранных игр: {stats['games']} (побед: {stats['wins']})\n"
+            f"💰 Поставлено: {Money(stats['wagered_nano'])} TON, выиграно: {Money(stats['won_nano'])} TON\n"
+            f"🔥 Лучшая серия побед: {stats['best_streak']}"
+        )
+    else:
+        games_text = "🎮 Вы еще не сыграли ни одной игры!"
+    if favorite_game:
+        favorite_text = f"❤️ Любимый режим: {favorite_game.icon} {favorite_game.title}"
+    else:
+        favorite_text = "❤️ У вас еще нет любимого режима игры."
     
     profile_text = (
         "👤 Ваш профиль:\n\n"
@@ -205,11 +222,25 @@ async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     await query.edit_message_text(
         text=profile_text,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-        ])
+        reply_markup=KEYBOARDS["back"]
     )
 
+async def leaders_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает таблицу лидеров (кнопка «Лидеры» или команда /top)"""
+    period = "day"
+    if update.callback_query:
+        await update.callback_query.answer()
+        period = update.callback_query.data.split("_", 1)[-1]
+    if period not in PERIODS:
+        period = "day"
+    
+    text = await leaderboards.render_all(period) or f"🏆 Лидеров {PERIOD_TITLES[period]} пока нет. Сыграйте первым!"
+    
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text=text, reply_markup=KEYBOARDS["leaders"])
+    else:
+        await update.message.reply_text(text=text, reply_markup=KEYBOARDS["leaders"])
+
 async def play_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle play button click."""
     query = update.callback_query
@@ -218,23 +249,18 @@ async def play_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Получаем ID канала из переменной окружения - для логов
     channel_id = RESULTS_CHANNEL_ID
     
-    # Используем фиксированную ссылку на ваш публичный канал
-    fixed_channel_url = "https://t.me/test5363627"
-    
     # Используем фиксированную ссылку на канал
-    channel_url = fixed_channel_url
+    channel_url = CHANNEL_URL
     
-    # Подробный лог для отладки
-    logger.warning(f"===DEBUG=== RESULTS_CHANNEL_ID={channel_id}, type={type(channel_id)}")
-    logger.warning(f"===DEBUG=== Используем фиксированную ссылку на канал: {channel_url}")
+    # Подробный лог для отладки, строки собираются только при LOG_LEVEL=DEBUG
+    logger.debug("RESULTS_CHANNEL_ID=%r, ссылка на канал: %s", channel_id, channel_url)
     
     # Отправляем сообщение в игровой канал
     user = query.from_user
     payment_url = await create_payment_url(user.id, 4.0)
     
     # Подробно логируем URL платежа для отладки
-    logger.warning(f"===DEBUG PLAY HANDLER=== Созданный payment_url: {payment_url}")
-    logger.warning(f"===DEBUG PLAY HANDLER=== Тип payment_url: {type(payment_url)}")
+    logger.debug("Созданный payment_url: %r", payment_url)
     
     # Проверяем валидность URL перед использованием
     valid_url = isinstance(payment_url, str) and payment_url.startswith("https://")
@@ -262,10 +288,7 @@ async def play_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Новое сообщение с кнопкой "Перейти в канал"
     await query.edit_message_text(
         text="💎 Хочешь испытать удачу?\n\n💰 Сообщение со ставкой отправлено в канал! Нажмите на кнопку для перехода в канал и оплаты ставки.",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🎲 Перейти в канал", url=channel_url)],
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-        ])
+        reply_markup=KEYBOARDS["channel"]
     )
     
     # Инструкция удалена по запросу
@@ -275,7 +298,7 @@ async def game_selection_handler(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     
-    logger.info(f"Выбран режим игры: {query.data}")
+    logger.debug("Выбран режим игры: %s", query.data)
     
     # Получаем тип игры из callback_data
     parts = query.data.split("_", 1)  # Разделяем только по первому символу '_'
@@ -328,20 +351,14 @@ async def instruction_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     instruction_text = "Для продолжения нажмите кнопку 'Сделать ставку' ниже и выберите удобную вам сумму (от 0.1 до 10 TON)"
     
     # Создаем платежный URL для прямой оплаты в чате CryptoBot с произвольной суммой
-    logger.warning(f"🔴🔴🔴 СОЗДАНИЕ ССЫЛКИ В ИНСТРУКЦИИ для пользователя {user_id}")
+    logger.debug("Создание ссылки в инструкции для пользователя %s", user_id)
     payment_url = await create_payment_url(user_id, 0.1)  # Используем минимальную сумму
     
-    # Подробно логируем URL платежа для отладки
-    logger.warning(f"===DEBUG=== Созданный WebApp payment_url: {payment_url}")
-    
     # Создаем клавиатуру с кнопкой для ставки
     await query.edit_message_text(
         text=instruction_text,
         parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-        ])
+        reply_markup=url_keyboard("💰 Сделать ставку", payment_url)
     )
 
 async def send_welcome_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -354,13 +371,13 @@ async def send_welcome_command(update: Update, context: ContextTypes.DEFAULT_TYP
             
             # Отправляем приветственное сообщение с кнопкой для ставки
             welcome_message = "Приветствую! *Скорее лутай кеш* ↓↓↓↓"
-            await context.bot.send_message(
+            await scheduler.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
+                priority=PRIORITY_CHANNEL,
                 text=welcome_message,
                 parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)]
-                ])
+                reply_markup=url_keyboard("💰 Сделать ставку", payment_url, with_back=False)
             )
             logger.info(f"Отправлено приветственное сообщение в канал/группу {update.effective_chat.id}")
         except Exception as e:
@@ -405,7 +422,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         amount = 0.1  # минимальная сумма для теста
         
         # Создаем инвойс через API с произвольной суммой
-        logger.warning(f"🔴🔴🔴 СОЗДАНИЕ ТЕСТОВОГО ИНВОЙСА с произвольной суммой для пользователя {user_id}")
+        logger.debug("Создание тестового инвойса с произвольной суммой для пользователя %s", user_id)
         # Используем минимальную сумму TON, пользователь выберет нужную сумму
         payment_url = await create_payment_url(user_id, 0.1)
         
@@ -425,15 +442,14 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 # Для кнопки используем edit_message_text с клавиатурой
                 await message.edit_text(
                     text=test_success_text,
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Оплатить тестовый счет", url=payment_url)],
-                        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-                    ])
+                    reply_markup=url_keyboard("Оплатить тестовый счет", payment_url)
                 )
                 
                 # Отправляем инструкции как отдельное сообщение
-                await context.bot.send_message(
+                await scheduler.send_message(
+                    context.bot,
                     chat_id=update.effective_user.id,
+                    priority=PRIORITY_USER,
                     text=test_instructions,
                     parse_mode="Markdown"
                 )
@@ -441,9 +457,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 # Для команды используем обычный reply
                 await update.message.reply_text(
                     text=test_success_text,
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Оплатить тестовый счет", url=payment_url)]
-                    ])
+                    reply_markup=url_keyboard("Оплатить тестовый счет", payment_url, with_back=False)
                 )
                 
                 # Добавляем инструкции по проверке через видео как отдельное сообщение
@@ -459,9 +473,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             if is_callback:
                 await message.edit_text(
                     text=error_text,
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-                    ])
+                    reply_markup=KEYBOARDS["back"]
                 )
             else:
                 await message.edit_text(error_text)
@@ -474,9 +486,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         if is_callback:
             await message.edit_text(
                 text=error_text,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-                ])
+                reply_markup=KEYBOARDS["back"]
             )
         else:
             await message.edit_text(error_text)
@@ -503,13 +513,13 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             payment_url = await create_payment_url(context._application.bot.id)
             
             # Отправляем приветственное сообщение с кнопкой для ставки
-            await context.bot.send_message(
+            await scheduler.send_message(
+                context.bot,
                 chat_id=chat_id,
+                priority=PRIORITY_CHANNEL,
                 text=welcome_message,
                 parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)]
-                ])
+                reply_markup=url_keyboard("💰 Сделать ставку", payment_url, with_back=False)
             )
             logger.info(f"Отправлено приветственное сообщение в чат {chat_id}")
         except Exception as e:
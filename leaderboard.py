@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Daily, weekly and all-time leaderboards
+
+Players are ranked by biggest single win, total wagered and games played.
+Every board keeps only its top LEADERBOARD_SIZE entries, as a sorted list,
+and is updated with the user's statistics record each time a bet settles.
+Within a period a player's scores can only grow. A player who drops out
+of the top list therefore never has to be reconsidered until their score
+grows again, so updates and queries both cost O(K).
+
+Day and week boards start afresh when the first bet of a new period
+settles; the finished boards are posted to the results channel. At
+startup the boards are rebuilt from the statistics records of all users.
+"""
+
+import os
+import logging
+from bisect import insort
+from user_data import get_user_data, get_all_users
+from user_stats import stats_of, period_keys
+from channel_publisher import publisher
+from money import Money
+
+logger = logging.getLogger(__name__)
+
+# Entries kept and shown per board
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+
+# metric -> field of the statistics record, amounts in nano-TON
+METRICS = {
+    "biggest_win": "best_win_nano",
+    "wagered": "wagered_nano",
+    "games": "games"
+}
+
+PERIODS = ("day", "week", "all")
+
+PERIOD_TITLES = {"day": "за день", "week": "за неделю", "all": "за всё время"}
+
+PERIOD_RESULTS = {"day": "Итоги дня", "week": "Итоги недели"}
+
+METRIC_TITLES = {
+    "biggest_win": ("💎 Крупнейший выигрыш", "TON"),
+    "wagered": ("💰 Больше всех поставили", "TON"),
+    "games": ("🎮 Больше всех игр", "игр")
+}
+
+
+class TopK:
+    """The K highest scores, for scores that only grow"""
+
+    __slots__ = ("size", "_entries", "_scores")
+
+    def __init__(self, size):
+        self.size = size
+        # (-score, user_id), best first
+        self._entries = []
+        # user_id -> score, for users in _entries
+        self._scores = {}
+
+    def offer(self, user_id, score):
+        """Record a user's current score"""
+        current = self._scores.get(user_id)
+        if current is not None:
+            if score <= current:
+                return
+            self._entries.remove((-current, user_id))
+        elif len(self._entries) >= self.size and (-score, user_id) >= self._entries[-1]:
+            return
+        insort(self._entries, (-score, user_id))
+        self._scores[user_id] = score
+        if len(self._entries) > self.size:
+            _, evicted = self._entries.pop()
+            del self._scores[evicted]
+
+    def top(self, k=None):
+        """(user_id, score) pairs, best first"""
+        return [(user_id, -score) for score, user_id in self._entries[:k]]
+
+
+class Leaderboards:
+    """Top-K boards for every period and metric"""
+
+    def __init__(self, size=LEADERBOARD_SIZE):
+        self.size = size
+        self._boards = {}
+        # period -> key of the day or week its boards belong to
+        self._keys = {}
+        # Coroutine function returning the text of a period's boards across all
+        # shards, set by the workers of the sharded runtime
+        self.render_remote = None
+        # Post finished day and week boards to the channel; workers of the sharded
+        # runtime only see their own players and leave this off
+        self.announce_results = True
+        for period in PERIODS:
+            self._reset(period)
+
+    def _reset(self, period):
+        for metric in METRICS:
+            self._boards[(period, metric)] = TopK(self.size)
+
+    def update(self, user_id, stats, now=None, announce=True):
+        """Add a user's current statistics to the boards"""
+        user_id = str(user_id)
+        keys = period_keys(now)
+        for period in PERIODS:
+            if period == "all":
+                totals = stats
+            else:
+                totals = stats.get(period)
+                if not totals or totals["period"] != keys[period]:
+                    continue
+                if self._keys.get(period) != keys[period]:
+                    self._roll_over(period, keys[period], announce)
+            for metric, field in METRICS.items():
+                score = totals.get(field, 0)
+                if score:
+                    self._boards[(period, metric)].offer(user_id, score)
+
+    def _roll_over(self, period, key, announce):
+        """Start the boards of a new day or week, posting the finished ones"""
+        finished = self._keys.get(period)
+        if finished is not None and announce and self.announce_results:
+            text = self._render(period)
+            if text:
+                publisher.publish(f"{PERIOD_RESULTS[period]} {finished}\n\n{text}")
+        self._keys[period] = key
+        self._reset(period)
+
+    def _is_current(self, period, now=None):
+        """Whether the boards of a period belong to the running day or week"""
+        return period == "all" or self._keys.get(period) == period_keys(now)[period]
+
+    def top(self, period, metric, k=None, now=None):
+        """(user_id, score) pairs of one board, best first"""
+        if not self._is_current(period, now):
+            # No bet has settled in this period yet
+            return []
+        return self._boards[(period, metric)].top(k)
+
+    def rebuild(self):
+        """Fill the boards from the statistics records of all users"""
+        self._keys.clear()
+        for period in PERIODS:
+            self._reset(period)
+        users = 0
+        for user_id in get_all_users():
+            user_data = get_user_data(user_id)
+            if user_data:
+                self.update(user_id, stats_of(user_data), announce=False)
+                users += 1
+        logger.info(f"Rebuilt leaderboards from {users} users")
+
+    def render(self, period, now=None):
+        """Text of all boards of a period, empty if nobody has played"""
+        if not self._is_current(period, now):
+            return ""
+        return self._render(period)
+
+    async def render_all(self, period):
+        """render() over all players; the sharded runtime merges the boards of every worker"""
+        if self.render_remote is not None:
+            return await self.render_remote(period)
+        return self.render(period)
+
+    def export(self, period, now=None):
+        """{metric: [(name, score), ...]} of a period's boards, for merge_boards()"""
+        if not self._is_current(period, now):
+            return {}
+        return self._named(period)
+
+    def _named(self, period):
+        boards = {}
+        for metric in METRICS:
+            entries = []
+            for user_id, score in self._boards[(period, metric)].top():
+                user_data = get_user_data(user_id) or {}
+                entries.append((user_data.get("username") or f"user{user_id}", score))
+            boards[metric] = entries
+        return boards
+
+    def _render(self, period):
+        return render_boards(period, self._named(period))
+
+
+def merge_boards(exports, size=LEADERBOARD_SIZE):
+    """Combine exported boards of several shards; each player is on one shard only"""
+    merged = {}
+    for boards in exports:
+        for metric, entries in boards.items():
+            merged.setdefault(metric, []).extend(entries)
+    return {metric: sorted(entries, key=lambda entry: -entry[1])[:size] for metric, entries in merged.items()}
+
+def render_boards(period, boards):
+    """Text of a period's boards given as {metric: [(name, score), ...]}, empty if all are empty"""
+    sections = []
+    for metric, (title, unit) in METRIC_TITLES.items():
+        is_amount = METRICS[metric].endswith("_nano")
+        entries = boards.get(metric)
+        if not entries:
+            continue
+        lines = [f"{title}:"]
+        for place, (name, score) in enumerate(entries, 1):
+            lines.append(f"{place}. @{name} — {Money(score) if is_amount else score} {unit}")
+        sections.append("\n".join(lines))
+    if not sections:
+        return ""
+    return f"🏆 Лидеры {PERIOD_TITLES[period]}\n\n" + "\n\n".join(sections)
+
+
+# Leaderboards shared by the application
+leaderboards = Leaderboards()
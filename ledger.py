@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Transaction ledger
+
+Deposits and withdrawals are kept in memory with three indexes:
+
+* transaction_id -> entry
+* user_id -> the user's transaction IDs in the order they were created
+* transfer_id / invoice_id -> transaction_id
+
+so lookups and history pages never scan other users' transactions. Every
+change is appended to LEDGER_FILE as one JSON line and replayed on load.
+Appends are group committed: the log is fsynced once per LEDGER_FSYNC_BATCH
+appends or within LEDGER_FSYNC_INTERVAL seconds of the first unsynced one,
+instead of once per entry on the event loop.
+Compaction rewrites the file with only the latest version of each entry and
+moves entries older than LEDGER_RETENTION_DAYS to LEDGER_ARCHIVE_FILE.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from storage import read_journal
+
+logger = logging.getLogger(__name__)
+
+# Append-only log of ledger changes
+LEDGER_FILE = "data/transactions.jsonl"
+
+# Entries past the retention period are moved here on compaction
+LEDGER_ARCHIVE_FILE = "data/transactions-archive.jsonl"
+
+# How long entries stay in the live ledger
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "90"))
+
+# Compact the log once it holds this many superseded records
+LEDGER_COMPACT_EVERY = int(os.getenv("LEDGER_COMPACT_EVERY", "10000"))
+
+# Group commit: fsync the log after this many appends, or this many seconds after an append
+LEDGER_FSYNC_BATCH = int(os.getenv("LEDGER_FSYNC_BATCH", "64"))
+LEDGER_FSYNC_INTERVAL = float(os.getenv("LEDGER_FSYNC_INTERVAL", "0.2"))
+
+# Fields that can be used to look up a transaction
+REFERENCE_FIELDS = ("transfer_id", "invoice_id")
+
+
+def _encode(entry):
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class Ledger:
+    """Indexed, durable store of deposit and withdrawal transactions"""
+
+    def __init__(self, path=LEDGER_FILE, archive_path=LEDGER_ARCHIVE_FILE,
+                 retention_days=LEDGER_RETENTION_DAYS, compact_every=LEDGER_COMPACT_EVERY,
+                 fsync_batch=LEDGER_FSYNC_BATCH, fsync_interval=LEDGER_FSYNC_INTERVAL):
+        self.path = path
+        self.archive_path = archive_path
+        self.retention = retention_days * 86400
+        self.compact_every = compact_every
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._entries = {}
+        self._by_user = {}
+        self._by_reference = {}
+        self._seq = 0
+        self._file = None
+        self._appended = 0
+        self._unsynced = 0
+        # Pending call_later() of sync() and the event loop it belongs to
+        self._sync_timer = None
+        self._sync_loop = None
+
+    def load(self):
+        """Rebuild the ledger and its indexes from the log"""
+        self._entries.clear()
+        self._by_user.clear()
+        self._by_reference.clear()
+        self._seq = 0
+        self._appended = 0
+        if os.path.exists(self.path):
+            entries, intact = read_journal(self.path)
+            for entry in entries:
+                self._index(entry)
+            self._appended = len(entries)
+            size = os.path.getsize(self.path)
+            if size > intact:
+                # Cut the torn tail off, or the next append would be glued onto it
+                # and the next load would stop there, dropping every later entry
+                logger.warning(f"Ledger is corrupted after entry {len(entries)}, "
+                               f"truncating {size - intact} bytes")
+                os.truncate(self.path, intact)
+        logger.info(f"Loaded {len(self._entries)} ledger entries")
+        if self._needs_compaction() or self._has_expired():
+            self.compact()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def sync(self):
+        """fsync entries appended since the last sync"""
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+        if self._file is None or not self._unsynced:
+            return
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            logger.error(f"Error syncing ledger: {e}")
+            return
+        self._unsynced = 0
+
+    def record(self, transaction_id, user_id, **fields):
+        """Add a new transaction and return it"""
+        self._seq += 1
+        entry = dict(fields)
+        entry["transaction_id"] = transaction_id
+        entry["user_id"] = user_id
+        entry["seq"] = self._seq
+        entry["created_at"] = int(time.time())
+        self._index(entry)
+        self._append(entry)
+        return entry
+
+    def update(self, transaction_id, **fields):
+        """Change fields of an existing transaction; returns None if it is unknown"""
+        entry = self._entries.get(transaction_id)
+        if entry is None:
+            return None
+        entry.update(fields)
+        self._index_references(entry)
+        self._append(entry)
+        return entry
+
+    def get(self, transaction_id):
+        return self._entries.get(transaction_id)
+
+    def find(self, transfer_id=None, invoice_id=None):
+        """Look up a transaction by its CryptoBot transfer or invoice ID"""
+        for field, value in (("transfer_id", transfer_id), ("invoice_id", invoice_id)):
+            if value is not None:
+                transaction_id = self._by_reference.get(f"{field}:{value}")
+                if transaction_id is not None:
+                    return self._entries.get(transaction_id)
+        return None
+
+    def history(self, user_id, limit=10, cursor=None):
+        """
+        Get a user's transactions, newest first
+
+        Args:
+            user_id: Telegram user ID
+            limit: Maximum number of entries
+            cursor: "seq" of the last entry of the previous page, None for the first page
+        """
+        transaction_ids = self._by_user.get(str(user_id))
+        if not transaction_ids:
+            return []
+        end = len(transaction_ids)
+        if cursor is not None:
+            end = bisect_left(transaction_ids, cursor, key=lambda tx_id: self._entries[tx_id]["seq"])
+        start = max(0, end - limit)
+        return [self._entries[tx_id] for tx_id in reversed(transaction_ids[start:end])]
+
+    def compact(self):
+        """Rewrite the log with current entries and archive expired ones"""
+        deadline = time.time() - self.retention
+        expired = [entry for entry in self._entries.values() if entry["created_at"] < deadline]
+        try:
+            if expired:
+                os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+                with open(self.archive_path, 'a', encoding='utf-8') as archive:
+                    archive.write("".join(_encode(entry) for entry in expired))
+                    archive.flush()
+                    os.fsync(archive.fileno())
+                for entry in expired:
+                    self._forget(entry)
+
+            temp_file = f"{self.path}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                file.write("".join(_encode(entry) for entry in self._entries.values()))
+                file.flush()
+                os.fsync(file.fileno())
+            self.close()
+            os.replace(temp_file, self.path)
+            self._appended = len(self._entries)
+            logger.info(f"Compacted ledger to {len(self._entries)} entries, archived {len(expired)}")
+        except Exception as e:
+            logger.error(f"Error compacting ledger: {e}")
+
+    def _append(self, entry):
+        """Append the current state of an entry to the log; it is fsynced with the next group commit"""
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(_encode(entry))
+            self._file.flush()
+            self._appended += 1
+            self._unsynced += 1
+        except Exception as e:
+            logger.error(f"Error writing ledger entry {entry.get('transaction_id')}: {e}")
+            return
+        self._schedule_sync()
+        if self._needs_compaction():
+            self.compact()
+
+    def _schedule_sync(self):
+        """fsync now if the batch is full, otherwise within fsync_interval"""
+        if self._unsynced >= self.fsync_batch:
+            self.sync()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to call back later (scripts, maintenance): sync right away
+            self.sync()
+            return
+        if self._sync_timer is None or self._sync_loop is not loop:
+            self._sync_timer = loop.call_later(self.fsync_interval, self.sync)
+            self._sync_loop = loop
+
+    def _needs_compaction(self):
+        """Whether the log holds enough superseded lines to be worth rewriting"""
+        return self._appended - len(self._entries) >= self.compact_every
+
+    def _has_expired(self):
+        """Whether any entry is past the retention period"""
+        deadline = time.time() - self.retention
+        return any(entry["created_at"] < deadline for entry in self._entries.values())
+
+    def _index(self, entry):
+        transaction_id = entry["transaction_id"]
+        if transaction_id not in self._entries:
+            # Entries are created in seq order, so appending keeps the list sorted
+            self._by_user.setdefault(str(entry["user_id"]), []).append(transaction_id)
+        self._entries[transaction_id] = entry
+        self._seq = max(self._seq, entry["seq"])
+        self._index_references(entry)
+
+    def _index_references(self, entry):
+        for field in REFERENCE_FIELDS:
+            if entry.get(field) is not None:
+                self._by_reference[f"{field}:{entry[field]}"] = entry["transaction_id"]
+
+    def _forget(self, entry):
+        transaction_id = entry["transaction_id"]
+        del self._entries[transaction_id]
+        user_key = str(entry["user_id"])
+        transaction_ids = self._by_user.get(user_key)
+        if transaction_ids:
+            transaction_ids.remove(transaction_id)
+            if not transaction_ids:
+                del self._by_user[user_key]
+        for field in REFERENCE_FIELDS:
+            if entry.get(field) is not None:
+                self._by_reference.pop(f"{field}:{entry[field]}", None)
+
+
+# Ledger shared by the application
+ledger = Ledger()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Structured, asynchronous logging
+
+setup_logging() puts a single QueueHandler on the root logger. A record
+costs the event loop only a filter pass and a queue put; formatting and
+writing happen in a QueueListener thread. Records are written as one JSON
+object per line (LOG_FORMAT=json, the default) or as plain text.
+
+Every record carries the correlation fields bound with log_context() in
+the task that logged it: bot.py binds update_id, user_id, chat_id and the
+handler of each update, games.py adds a bet_id per round. Fields passed
+with extra={...} are written as well.
+
+Records at WARNING and below are sampled per call site: each logging line
+may write LOG_SAMPLE_RATE records per second (bursts of up to that many),
+the rest are dropped and counted, and the next record written from that
+line says how many were suppressed. Errors are never sampled. When the
+writer falls LOG_QUEUE_SIZE records behind, new records are dropped
+instead of blocking the event loop.
+
+Debug diagnostics use %-style arguments (logger.debug("url %s", url)), so
+their message is never built while DEBUG is off.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import logging
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from metrics import metrics
+
+# Root log level and output format: "json" or "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Seconds shutdown waits for the writer to make room in a full queue
+LOG_SHUTDOWN_TIMEOUT = float(os.getenv("LOG_SHUTDOWN_TIMEOUT", "5"))
+
+# Records per second each call site may write; 0 disables sampling
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "20"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+RECORDS_DROPPED = metrics.counter(
+    "log_records_dropped", "Log records not written, by reason: sampled or queue_full", ["reason"]
+)
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "context", "suppressed"
+}
+
+_context = contextvars.ContextVar("log_context", default={})
+
+@contextmanager
+def log_context(**fields):
+    """Add correlation fields to every record logged by the current task inside the block"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def current_context():
+    return _context.get()
+
+
+class ContextFilter(logging.Filter):
+    """Attach the correlation fields of the logging task; runs before the record is queued"""
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Per call site token bucket for records at WARNING and below"""
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        # (pathname, lineno) -> [tokens, updated, suppressed]
+        self._sites = {}
+
+    def filter(self, record):
+        if not self.rate or record.levelno > logging.WARNING:
+            return True
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self._sites[(record.pathname, record.lineno)] = [self.rate, now, 0]
+        site[0] = min(self.rate, site[0] + (now - site[1]) * self.rate)
+        site[1] = now
+        if site[0] < 1:
+            site[2] += 1
+            RECORDS_DROPPED.labels("sampled").inc()
+            return False
+        site[0] -= 1
+        if site[2]:
+            record.suppressed = site[2]
+            site[2] = 0
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the writer lags"""
+
+    def prepare(self, record):
+        # Merge the arguments here: they may be mutated after this call returns.
+        # The exception is kept as text for the formatter in the writer thread.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            RECORDS_DROPPED.labels("queue_full").inc()
+
+
+class _QueueListener(QueueListener):
+    """QueueListener whose stop() waits for room in a full queue"""
+
+    def enqueue_sentinel(self):
+        # The writer keeps draining the queue, so room frees up unless it is stuck
+        self.queue.put(self._sentinel, timeout=LOG_SHUTDOWN_TIMEOUT)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with correlation and extra fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "context", None) or {})
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format with the correlation fields appended"""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = {**(getattr(record, "context", None) or {}),
+                  **{k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRIBUTES}}
+        if getattr(record, "suppressed", 0):
+            fields["suppressed"] = record.suppressed
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    """Route all logging through the background writer; safe to call again"""
+    global _listener
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _QueueHandler(records)
+    handler.addFilter(SamplingFilter())
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Library chatter on every request is debug material
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = _QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging():
+    """Write the queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            sys.stderr.write(f"Log writer did not drain its queue within {LOG_SHUTDOWN_TIMEOUT}s\n")
+        _listener = None
@@ -3,24 +3,60 @@
 
 """
 Main entry point for the Telegram casino bot
+
+Usage:
+    python main.py                  # long polling (default)
+    python main.py --mode webhook   # aiohttp server for Telegram and CryptoBot updates
+    python main.py --mode sharded   # webhook front process routing to SHARD_COUNT workers
 """
 
+import os
+import asyncio
 import logging
+import argparse
 from bot import create_bot
+from user_data import close_user_data
+from ledger import ledger
+from crypto_payments import processed_invoices
+from log_pipeline import setup_logging, shutdown_logging
 
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Set up logging: JSON records written by a background thread (LOG_LEVEL, LOG_FORMAT)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Telegram casino bot")
+    parser.add_argument(
+        "--mode",
+        choices=["polling", "webhook", "sharded"],
+        default=os.getenv("BOT_MODE", "polling"),
+        help="how to receive updates (default: polling, or BOT_MODE)"
+    )
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        # Create and run the bot
-        bot = create_bot()
-        bot.run_polling()
-        logger.info("Bot started successfully")
+        if args.mode == "sharded":
+            # The workers own the user data; this process only routes updates
+            from sharding import run_front
+            logger.info("Starting bot in sharded mode")
+            asyncio.run(run_front())
+        else:
+            # Create and run the bot
+            bot = create_bot()
+            logger.info(f"Starting bot in {args.mode} mode")
+            if args.mode == "webhook":
+                from webhook import run_webhook
+                asyncio.run(run_webhook(bot))
+            else:
+                bot.run_polling()
     except Exception as e:
         logger.error(f"Error occurred: {e}")
+    finally:
+        # Flush the journal and leave a fresh snapshot for the next start
+        close_user_data()
+        ledger.close()
+        processed_invoices.close()
+        shutdown_logging()
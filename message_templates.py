@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compiled message templates for game results
+
+The templates a game declares in game_registry are compiled once per game
+into plain Python functions built around a single f-string. Fields that are
+constant for the game (title, emoji, icon) are baked into the string at
+compile time, outcome titles and dice labels become dictionary lookups, and
+the won/lost variants of "result", "result_short" and "verdict" become one
+conditional. Rendering then needs nothing but a settled GameResult record.
+
+lazy() returns a LazyText that renders on first str() and caches the text,
+so messages nobody reads are never formatted.
+"""
+
+import string
+from collections import namedtuple
+
+# Everything a result message can show about one settled bet
+GameResult = namedtuple("GameResult", ["choice", "stake", "payout", "won", "value", "balance",
+                                       "username", "games_played", "mode_games"])
+
+# Fields taken from the game and baked in at compile time
+GAME_FIELDS = ("title", "emoji", "icon")
+
+# Fields read straight from the record
+RECORD_FIELDS = ("stake", "payout", "value", "balance", "username", "games_played", "mode_games")
+
+# Fields rendered from the "<name>_won" or "<name>_lost" template
+CONDITIONAL_FIELDS = ("result", "result_short", "verdict")
+
+_formatter = string.Formatter()
+
+def _literal(text):
+    return "f" + repr(text.replace("{", "{{").replace("}", "}}"))
+
+def compile_template(text, game, allow_conditional=True):
+    """
+    Compile one template of a game into a render function
+
+    Args:
+        text: str.format style template
+        game: Game from game_registry the template belongs to
+        allow_conditional: Whether won/lost fields may be used
+
+    Returns:
+        function: GameResult -> str
+    """
+    namespace = {
+        "choices": {choice: outcome.title for choice, outcome in game.outcomes.items()},
+        "label": lambda value, labels=game.labels: labels.get(value, "")
+    }
+    parts = []
+    for literal, name, spec, conversion in _formatter.parse(text):
+        if literal:
+            parts.append(_literal(literal))
+        if name is None:
+            continue
+        if "{" in spec:
+            raise ValueError(f"Nested fields are not supported: {{{name}:{spec}}}")
+        suffix = (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "")
+        if name in GAME_FIELDS:
+            value = _formatter.convert_field(getattr(game, name), conversion)
+            parts.append(_literal(_formatter.format_field(value, spec)))
+            continue
+        if name in RECORD_FIELDS:
+            expression = f"r.{name}"
+        elif name == "choice":
+            expression = "choices[r.choice]"
+        elif name == "label":
+            expression = "label(r.value)"
+        elif name in CONDITIONAL_FIELDS and allow_conditional:
+            namespace[f"{name}_won"] = compile_template(game.templates[f"{name}_won"], game, False)
+            namespace[f"{name}_lost"] = compile_template(game.templates[f"{name}_lost"], game, False)
+            expression = f"({name}_won(r) if r.won else {name}_lost(r))"
+        else:
+            raise ValueError(f"Unknown field {{{name}}} in a template of {game.key}")
+        parts.append("f'{" + expression + suffix + "}'")
+
+    source = "def render(r):\n    return " + (" ".join(parts) or "''") + "\n"
+    exec(compile(source, f"<template {game.key}>", "exec"), namespace)
+    return namespace["render"]
+
+
+class LazyText:
+    """Message text that is rendered the first time it is needed"""
+
+    __slots__ = ("_render", "_record", "_text")
+
+    def __init__(self, render, record):
+        self._render = render
+        self._record = record
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self._render(self._record)
+        return self._text
+
+    def __repr__(self):
+        return f"LazyText({str(self)!r})"
+
+
+class CompiledTemplates:
+    """All templates of one game, compiled"""
+
+    def __init__(self, game):
+        self.game = game
+        self._renderers = {name: compile_template(text, game) for name, text in game.templates.items()}
+
+    def render(self, name, record):
+        return self._renderers[name](record)
+
+    def lazy(self, name, record):
+        return LazyText(self._renderers[name], record)
+
+
+# game key -> CompiledTemplates
+_compiled = {}
+
+def templates_for(game):
+    """Compiled templates of a game, compiled on first use"""
+    templates = _compiled.get(game.key)
+    if templates is None:
+        templates = _compiled[game.key] = CompiledTemplates(game)
+    return templates
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Hot-path instrumentation and the /metrics endpoint
+
+Counters and histograms are plain in-process objects: recording a value
+is a dict lookup, a bisect over the bucket bounds and two additions, with
+no locks, threads or string formatting. That is cheap enough to leave on
+for every update. Queue depths are gauges backed by a function that is only
+called when /metrics is scraped, so they cost nothing in between.
+
+Modules declare their metrics at import time:
+
+    SEND_LATENCY = metrics.histogram("telegram_send_seconds", "...", ["priority"])
+    SEND_LATENCY.labels("user").observe(elapsed)
+
+and MetricsServer serves all of them in the Prometheus text format on
+METRICS_LISTEN:METRICS_PORT (localhost by default, METRICS_PORT=0 turns
+the endpoint off).
+"""
+
+import os
+import time
+import logging
+import functools
+from bisect import bisect_left
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Address of the /metrics endpoint; keep it local, it is not authenticated
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Default histogram bounds in seconds, from 1 ms to 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bound plus +Inf, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """A named metric with one child per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+
+    def labels(self, *values):
+        """Child for the given label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """(suffix, label text, value) lines of the exposition"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically growing count"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in self._children.items():
+            yield "_total", _label_text(self.label_names, values), child.value
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", _label_text(self.label_names, values, f'le="{_number(bound)}"'), cumulative
+            labels = _label_text(self.label_names, values)
+            yield "_sum", labels, child.sum
+            yield "_count", labels, child.count
+
+
+class Gauge(Metric):
+    """
+    Value read from a function at scrape time
+
+    Without labels the function returns a number; with labels it returns a
+    dict of label value tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            logger.error(f"Gauge {self.name} failed: {e}")
+            return
+        if not self.label_names:
+            yield "", "", value
+            return
+        for values, number in value.items():
+            yield "", _label_text(self.label_names, values), number
+
+
+class MetricsRegistry:
+    """All metrics of the process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None and type(existing) is type(metric) and not isinstance(metric, Gauge):
+            # Declared again, e.g. by a module reloaded in a script
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, function, labels=()):
+        """Register a gauge; registering a name again replaces its function"""
+        return self._register(Gauge(name, documentation, function, labels))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def timed(child):
+    """Decorator recording the run time of a coroutine function in a histogram child"""
+    def decorator(function):
+        observe = child.observe
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """Local aiohttp server answering GET /metrics"""
+
+    def __init__(self, registry, listen=METRICS_LISTEN, port=METRICS_PORT):
+        self.registry = registry
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if not self.port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.listen, self.port).start()
+        except OSError as e:
+            # Metrics are not worth failing the bot over
+            logger.error(f"Could not start metrics endpoint on {self.listen}:{self.port}: {e}")
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        logger.info(f"Metrics endpoint listening on http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+
+# Registry and endpoint shared by the application
+metrics = MetricsRegistry()
+server = MetricsServer(metrics)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fixed-point TON amounts
+
+Money holds an amount as an integer number of nano-TON, so balances,
+stakes, payouts and fees add up exactly instead of drifting like floats.
+Amounts enter through Money.of(), which parses ints, floats, decimal
+strings (as sent by CryptoBot) and Decimals exactly, and leave through
+str(), which prints the shortest exact decimal form, e.g. "1.5".
+
+Multiplying by a multiplier (1.5, 1.875, 12, ...) uses the multiplier as
+an exact fraction and rounds the result down to whole nano-TON, so a payout
+never exceeds the exact product of stake and multiplier.
+"""
+
+from fractions import Fraction
+from functools import lru_cache
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+# nano-TON per TON
+NANO_PER_TON = 10 ** 9
+
+_NANO = Decimal(NANO_PER_TON)
+
+@lru_cache(maxsize=256)
+def _ratio(multiplier):
+    """(numerator, denominator) of a multiplier, floats taken by their decimal form"""
+    ratio = Fraction(repr(multiplier)) if isinstance(multiplier, float) else Fraction(multiplier)
+    return ratio.numerator, ratio.denominator
+
+
+class Money:
+    """An amount of TON stored as integer nano-TON"""
+
+    __slots__ = ("nano",)
+
+    def __init__(self, nano=0):
+        self.nano = nano
+
+    @classmethod
+    def of(cls, amount):
+        """
+        Money for an amount in TON
+
+        Args:
+            amount: Money, int, float, Decimal or decimal string
+
+        Raises:
+            ValueError: amount is not a finite number
+        """
+        if isinstance(amount, Money):
+            return amount
+        if isinstance(amount, int):
+            return cls(amount * NANO_PER_TON)
+        try:
+            value = Decimal(repr(amount) if isinstance(amount, float) else amount)
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValueError(f"Invalid TON amount: {amount!r}") from None
+        # Decimal accepts "inf" and "nan", which have no nano-TON value
+        if not value.is_finite():
+            raise ValueError(f"Invalid TON amount: {amount!r}")
+        return cls(int((value * _NANO).to_integral_value(ROUND_HALF_EVEN)))
+
+    def to_decimal(self):
+        return Decimal(self.nano) / _NANO
+
+    def to_ton(self):
+        """TON amount as a JSON number, an int when it is a whole number"""
+        return nano_to_ton(self.nano)
+
+    # Arithmetic
+
+    def __add__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else Money(self.nano + nano)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else Money(self.nano - nano)
+
+    def __rsub__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else Money(nano - self.nano)
+
+    def __mul__(self, multiplier):
+        if isinstance(multiplier, int):
+            return Money(self.nano * multiplier)
+        try:
+            numerator, denominator = _ratio(multiplier)
+        except TypeError:
+            # Money * Money and other non-numbers
+            return NotImplemented
+        return Money(self.nano * numerator // denominator)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.nano)
+
+    def __abs__(self):
+        return Money(abs(self.nano))
+
+    # Comparisons, with Money or plain TON amounts
+
+    def __eq__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else self.nano == nano
+
+    def __lt__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else self.nano < nano
+
+    def __le__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else self.nano <= nano
+
+    def __gt__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else self.nano > nano
+
+    def __ge__(self, other):
+        nano = _nano(other)
+        return NotImplemented if nano is None else self.nano >= nano
+
+    def __hash__(self):
+        # Equal to the hash of an int, float or Decimal of the same value
+        return hash(Fraction(self.nano, NANO_PER_TON))
+
+    def __bool__(self):
+        return self.nano != 0
+
+    # Conversions
+
+    def __float__(self):
+        return self.nano / NANO_PER_TON
+
+    def __str__(self):
+        whole, fraction = divmod(abs(self.nano), NANO_PER_TON)
+        sign = "-" if self.nano < 0 else ""
+        if not fraction:
+            return f"{sign}{whole}"
+        return f"{sign}{whole}.{fraction:09d}".rstrip("0")
+
+    def __format__(self, spec):
+        return format(self.to_decimal(), spec) if spec else str(self)
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+
+def _nano(amount):
+    """nano-TON of an operand, None if it is not an amount"""
+    if isinstance(amount, Money):
+        return amount.nano
+    if isinstance(amount, int):
+        return amount * NANO_PER_TON
+    if isinstance(amount, (float, Decimal)):
+        return Money.of(amount).nano
+    return None
+
+ZERO = Money(0)
+
+def ton_to_nano(amount):
+    """nano-TON of a TON amount, exact for decimal amounts"""
+    return Money.of(amount).nano
+
+def nano_to_ton(nano):
+    """TON amount of a nano-TON value, an int when it is a whole number"""
+    whole, fraction = divmod(nano, NANO_PER_TON)
+    return whole if fraction == 0 else nano / NANO_PER_TON
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batched reconciliation of open CryptoBot invoices
+
+Instead of asking /getInvoices about one invoice at a time, the reconciler
+keeps the set of open invoice IDs and checks them in batches of up to
+RECONCILE_BATCH_SIZE IDs per request, paging through the results. Paid
+invoices are handed to process_payment_update() (or, in the sharded
+runtime, to the worker owning the paying user); paid and expired ones stop
+being tracked.
+
+The polling interval adapts to the number of open invoices: with nothing
+open the reconciler sleeps, with a few it polls every
+RECONCILE_MAX_INTERVAL seconds and the interval shrinks towards
+RECONCILE_MIN_INTERVAL as more invoices are waiting.
+
+Invoices are tracked when they are created (create_deposit_invoice()) and
+when their status is looked up (check_payment_status() goes through
+lookup(), which joins the next batch instead of sending a request of its
+own), so a deposit is credited even if its webhook never arrives. Only the
+fixed multi-use invoice IV15707697, used when an invoice cannot be
+created, has no per-payment invoice ID to track and relies on the webhook.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from cryptobot_client import cryptobot
+from crypto_payments import process_payment_update
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Invoice IDs per getInvoices request and the page size of its results
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", "100"))
+
+# Bounds of the adaptive polling interval in seconds
+RECONCILE_MIN_INTERVAL = float(os.getenv("RECONCILE_MIN_INTERVAL", "2"))
+RECONCILE_MAX_INTERVAL = float(os.getenv("RECONCILE_MAX_INTERVAL", "30"))
+
+# Number of open invoices at which the interval is halved
+RECONCILE_LOAD_SCALE = int(os.getenv("RECONCILE_LOAD_SCALE", "50"))
+
+# Invoices still open after this many seconds are dropped
+RECONCILE_MAX_AGE = float(os.getenv("RECONCILE_MAX_AGE", str(24 * 3600)))
+
+# Open invoice IDs are kept here between restarts
+PENDING_INVOICES_FILE = "data/pending_invoices.json"
+
+
+class InvoiceReconciler:
+    """Polls open invoices in batches and credits the paid ones"""
+
+    def __init__(self, batch_size=RECONCILE_BATCH_SIZE, page_size=RECONCILE_PAGE_SIZE,
+                 min_interval=RECONCILE_MIN_INTERVAL, max_interval=RECONCILE_MAX_INTERVAL,
+                 load_scale=RECONCILE_LOAD_SCALE, max_age=RECONCILE_MAX_AGE):
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.load_scale = load_scale
+        self.max_age = max_age
+        # Credits a paid invoice; the sharded runtime routes it to the owning worker
+        self.process_payment = process_payment_update
+        # invoice_id -> wall clock time it started being tracked
+        self._pending = {}
+        # invoice_id -> futures of lookup() calls waiting for the next batch
+        self._waiters = {}
+        self._wakeup = None
+        self._poll_now = None
+        self._task = None
+        self.api_calls = 0
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def track(self, invoice_id):
+        """Start watching an invoice until it is paid or expires"""
+        invoice_id = str(invoice_id)
+        if invoice_id not in self._pending:
+            self._pending[invoice_id] = time.time()
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def untrack(self, invoice_id):
+        """Stop watching an invoice"""
+        self._pending.pop(str(invoice_id), None)
+
+    async def lookup(self, invoice_id):
+        """
+        Current state of an invoice, fetched with the next batch
+
+        The invoice is tracked from now on and the reconciler polls right
+        away, so concurrent lookups share one getInvoices request. Returns the
+        invoice, or None if CryptoBot does not know it.
+        """
+        invoice_id = str(invoice_id)
+        if self._task is None:
+            # Not running (scripts, tests): ask for this invoice alone
+            invoices = await self._fetch([invoice_id])
+            return invoices[0] if invoices else None
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(invoice_id, []).append(waiter)
+        self.track(invoice_id)
+        self._wakeup.set()
+        self._poll_now.set()
+        return await waiter
+
+    def next_interval(self):
+        """Polling interval for the current number of open invoices"""
+        interval = self.max_interval * self.load_scale / (self.load_scale + len(self._pending))
+        return max(self.min_interval, interval)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._load_pending()
+        self._wakeup = asyncio.Event()
+        self._poll_now = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Invoice reconciler started with {len(self._pending)} open invoices")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                waiter.cancel()
+        self._waiters.clear()
+        self._save_pending()
+        logger.info(f"Invoice reconciler stopped with {len(self._pending)} open invoices")
+
+    async def reconcile(self):
+        """Check every open invoice once; returns the number of paid ones"""
+        self._drop_expired()
+        invoice_ids = list(self._pending)
+        # Looked-up invoices are fetched even if they stopped being tracked meanwhile
+        invoice_ids.extend(invoice_id for invoice_id in self._waiters if invoice_id not in self._pending)
+        paid = 0
+        for start in range(0, len(invoice_ids), self.batch_size):
+            batch = invoice_ids[start:start + self.batch_size]
+            try:
+                invoices = await self._fetch(batch)
+            except Exception as e:
+                logger.error(f"getInvoices failed for {len(batch)} invoices: {e}")
+                self._resolve(batch, {}, e)
+                continue
+            for invoice in invoices:
+                paid += await self._handle(invoice)
+            self._resolve(batch, {str(invoice.get("invoice_id")): invoice for invoice in invoices})
+        return paid
+
+    def _resolve(self, invoice_ids, invoices, error=None):
+        """Answer lookups of a fetched batch; invoices CryptoBot does not know stop being tracked"""
+        for invoice_id in invoice_ids:
+            if error is None and invoice_id not in invoices:
+                self.untrack(invoice_id)
+            for waiter in self._waiters.pop(invoice_id, ()):
+                if waiter.done():
+                    continue
+                if error is not None:
+                    waiter.set_exception(error)
+                else:
+                    waiter.set_result(invoices.get(invoice_id))
+
+    async def _fetch(self, invoice_ids):
+        """Fetch all invoices of one batch, following pagination; raises RuntimeError on API errors"""
+        invoices = []
+        offset = 0
+        while True:
+            self.api_calls += 1
+            status, result = await cryptobot.call("getInvoices", params={
+                "invoice_ids": ",".join(invoice_ids),
+                "offset": offset,
+                "count": self.page_size
+            })
+            if status != 200 or not result.get("ok"):
+                error_msg = result.get("error", {}).get("message", "Unknown error")
+                raise RuntimeError(f"API error: {error_msg}")
+            items = result.get("result", {}).get("items", [])
+            invoices.extend(items)
+            if len(items) < self.page_size:
+                return invoices
+            offset += self.page_size
+
+    async def _handle(self, invoice):
+        """Credit a paid invoice and forget finished ones"""
+        invoice_id = str(invoice.get("invoice_id"))
+        status = invoice.get("status")
+        if status == "paid":
+            self.untrack(invoice_id)
+            result = await self.process_payment({"update_type": "invoice_paid", "payload": invoice})
+            if not result.get("success") and not result.get("duplicate"):
+                logger.warning(f"Paid invoice {invoice_id} was not credited: {result.get('message')}")
+            return 1
+        if status == "expired":
+            self.untrack(invoice_id)
+        return 0
+
+    def _drop_expired(self):
+        """Forget invoices that have been open for longer than max_age"""
+        deadline = time.time() - self.max_age
+        for invoice_id in [i for i, since in self._pending.items() if since < deadline]:
+            del self._pending[invoice_id]
+            logger.info(f"Stopped tracking invoice {invoice_id} after {self.max_age:.0f}s")
+
+    async def _run(self):
+        while True:
+            if not self._pending and not self._waiters:
+                # Nothing to poll, sleep until an invoice is tracked
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # Lookups made while this round runs start the next one right away
+            self._poll_now.clear()
+            try:
+                paid = await self.reconcile()
+                if paid:
+                    logger.info(f"Reconciled {paid} paid invoices, {len(self._pending)} still open")
+            except Exception as e:
+                logger.error(f"Error reconciling invoices: {e}")
+            try:
+                await asyncio.wait_for(self._poll_now.wait(), self.next_interval())
+            except asyncio.TimeoutError:
+                pass
+
+    def _load_pending(self):
+        try:
+            if os.path.exists(PENDING_INVOICES_FILE):
+                with open(PENDING_INVOICES_FILE, 'r', encoding='utf-8') as file:
+                    self._pending.update(json.load(file))
+        except Exception as e:
+            logger.error(f"Error loading open invoices: {e}")
+
+    def _save_pending(self):
+        try:
+            os.makedirs(os.path.dirname(PENDING_INVOICES_FILE), exist_ok=True)
+            with open(PENDING_INVOICES_FILE, 'w', encoding='utf-8') as file:
+                json.dump(self._pending, file)
+        except Exception as e:
+            logger.error(f"Error saving open invoices: {e}")
+
+
+# Reconciler shared by the application
+reconciler = InvoiceReconciler()
+
+metrics.gauge("reconciler_pending_invoices", "Invoices polled until they are paid or expire",
+              lambda: reconciler.pending_count)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Background persistence of user data
+
+While the worker is running, save_user_data() only records that something
+changed. The worker coalesces those changes and flushes them at most every
+PERSIST_INTERVAL_MS milliseconds, or sooner once PERSIST_MAX_CHANGES saves
+have piled up. Encoding happens on the event loop (it only touches changed
+users), the file or database write runs in a single background thread.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import user_data
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Maximum delay between a change and its write
+PERSIST_INTERVAL_MS = int(os.getenv("PERSIST_INTERVAL_MS", "200"))
+
+# Number of saves that triggers a write before the interval expires
+PERSIST_MAX_CHANGES = int(os.getenv("PERSIST_MAX_CHANGES", "500"))
+
+FLUSH_DURATION = metrics.histogram(
+    "persistence_flush_seconds", "Time to encode and write a batch of user data changes"
+)
+
+
+class PersistenceWorker:
+    """Coalesces user data saves into periodic writes off the event loop"""
+
+    def __init__(self, interval_ms=PERSIST_INTERVAL_MS, max_changes=PERSIST_MAX_CHANGES):
+        self.interval = interval_ms / 1000
+        self.max_changes = max_changes
+        self._pending = 0
+        self._changed = None
+        self._full = None
+        self._task = None
+        self._flush_lock = None
+        # One thread keeps batches in the order they were collected
+        self._executor = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def notify(self):
+        """Record a change; called by save_user_data()"""
+        self._pending += 1
+        self._changed.set()
+        if self._pending >= self.max_changes:
+            self._full.set()
+
+    async def start(self):
+        """Start the worker and route save_user_data() through it"""
+        if self.running:
+            return
+        self._changed = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._task = asyncio.create_task(self._run())
+        user_data.persistence_worker = self
+        logger.info(f"Persistence worker started (interval {self.interval * 1000:.0f} ms, "
+                    f"max {self.max_changes} changes)")
+
+    async def stop(self):
+        """Stop the worker and write everything that is still pending"""
+        if not self.running:
+            return
+        user_data.persistence_worker = None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        logger.info("Persistence worker stopped, pending changes flushed")
+
+    async def flush(self):
+        """Collect pending changes and write them in the background thread; False if the write failed"""
+        async with self._flush_lock:
+            self._pending = 0
+            self._changed.clear()
+            self._full.clear()
+            storage = user_data.storage
+            if storage is None:
+                return True
+            started = time.perf_counter()
+            batch = storage.collect()
+            if batch is None:
+                return True
+            loop = asyncio.get_running_loop()
+            written = await loop.run_in_executor(self._executor, storage.write, batch)
+            # Back on the loop thread, where the backend's change tracking lives
+            storage.complete(batch, written)
+            FLUSH_DURATION.observe(time.perf_counter() - started)
+            if not written:
+                # The backend took the changes back; retry them with the next cycle
+                self._changed.set()
+            return written
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            try:
+                # Give other changes a chance to join the same write
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in persistence worker: {e}")
+
+
+# Worker shared by the application
+worker = PersistenceWorker()
+
+metrics.gauge("persistence_pending_changes", "Saves waiting for the next write", lambda: worker._pending)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Outbound Telegram message scheduler
+
+All bot.send_message calls go through one scheduler that paces them to stay
+under Telegram's flood limits:
+
+* a global token bucket (SEND_GLOBAL_RATE messages per second),
+* a token bucket per chat: SEND_PRIVATE_RATE per second for private chats,
+  SEND_GROUP_RATE per minute for groups and channels.
+
+Messages to the same chat are sent in FIFO order, one at a time: the next
+message of a chat is only scheduled once the previous call has returned.
+Among chats that are allowed to send, the one whose next message has the
+best priority class goes first, so results for players are not stuck
+behind channel broadcasts. A RetryAfter error pauses the chat for the
+requested time and puts the message back at the front of its queue, ahead
+of everything sent to that chat after it.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from collections import deque
+from telegram.error import RetryAfter
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower is sent first
+PRIORITY_USER = 0
+PRIORITY_CHANNEL = 1
+
+PRIORITY_NAMES = {PRIORITY_USER: "user", PRIORITY_CHANNEL: "channel"}
+
+# Flood limits
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", "20"))
+
+# Messages a chat may send in a burst before its rate applies
+SEND_BURST = int(os.getenv("SEND_BURST", "3"))
+
+# How many times a message is re-queued after RetryAfter
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+
+# Per-chat buckets idle for this long are dropped
+BUCKET_IDLE_TIMEOUT = 600
+
+SEND_LATENCY = metrics.histogram(
+    "telegram_send_seconds", "Duration of Telegram send calls", ["priority"]
+)
+SEND_WAIT = metrics.histogram(
+    "telegram_send_queue_seconds", "Time messages waited in the send scheduler", ["priority"]
+)
+
+
+class TokenBucket:
+    """Token bucket with an optional pause imposed by the server"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        self._refill(now)
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class _Job:
+    __slots__ = ("call", "priority", "future", "attempts", "queued_at")
+
+    def __init__(self, call, priority, future):
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+
+class SendScheduler:
+    """Rate-limited, prioritized queue in front of Telegram send calls"""
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, private_rate=SEND_PRIVATE_RATE,
+                 group_rate_per_minute=SEND_GROUP_RATE, burst=SEND_BURST, max_retries=SEND_MAX_RETRIES):
+        self.private_rate = private_rate
+        self.group_rate = group_rate_per_minute / 60
+        self.burst = burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        # chat_id -> deque of jobs
+        self._queues = {}
+        # (priority, seq, chat_id) of chats allowed to send now
+        self._ready = []
+        # (ready_at, seq, chat_id) of chats waiting for their bucket
+        self._waiting = []
+        self._scheduled = set()
+        # Chats with a send call in progress; they are scheduled again when it returns
+        self._busy = set()
+        self._seq = 0
+        self._wakeup = None
+        self._task = None
+        self._in_flight = set()
+        self._last_sweep = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def set_global_rate(self, rate):
+        """Change the global limit, e.g. to this process's share when several processes send for one bot"""
+        self._global = TokenBucket(rate, rate)
+
+    def queue_depth(self, priority=None):
+        """Number of queued messages, optionally of one priority class"""
+        return sum(
+            1 for queue in self._queues.values() for job in queue
+            if priority is None or job.priority == priority
+        )
+
+    def stats(self):
+        """Queue depth per priority class and send counters"""
+        stats = {f"queued_{name}": self.queue_depth(priority) for priority, name in PRIORITY_NAMES.items()}
+        stats.update(in_flight=len(self._in_flight), sent=self.sent, retried=self.retried, failed=self.failed)
+        return stats
+
+    async def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Send scheduler started")
+
+    async def stop(self):
+        """Stop dispatching; queued messages are still sent before returning"""
+        if not self.running:
+            return
+        while self._queues or self._in_flight:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Send scheduler stopped: {self.stats()}")
+
+    async def send(self, call, chat_id, priority=PRIORITY_USER):
+        """
+        Queue a send call and wait for its result
+
+        Args:
+            call: Zero-argument coroutine function performing the request
+            chat_id: Target chat, used for per-chat rate limiting and ordering
+            priority: PRIORITY_USER or PRIORITY_CHANNEL
+        """
+        if not self.running:
+            return await call()
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(_Job(call, priority, future))
+        if len(queue) == 1 and chat_id not in self._busy:
+            self._schedule(chat_id, time.monotonic())
+        return await future
+
+    async def send_message(self, bot, chat_id, text, priority=PRIORITY_USER, **kwargs):
+        """Send a text message through the scheduler"""
+        return await self.send(
+            lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), chat_id, priority
+        )
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if self._is_private(chat_id):
+                bucket = TokenBucket(self.private_rate, self.burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def _is_private(chat_id):
+        """Private chats have positive IDs; groups, channels and @usernames do not"""
+        try:
+            return int(chat_id) > 0
+        except (TypeError, ValueError):
+            return False
+
+    def _schedule(self, chat_id, now):
+        """Put a chat with queued jobs into the ready or the waiting heap"""
+        if chat_id in self._scheduled:
+            return
+        self._scheduled.add(chat_id)
+        self._seq += 1
+        delay = self._bucket(chat_id).delay(now)
+        if delay > 0:
+            heapq.heappush(self._waiting, (now + delay, self._seq, chat_id))
+        else:
+            priority = self._queues[chat_id][0].priority
+            heapq.heappush(self._ready, (priority, self._seq, chat_id))
+        self._wakeup.set()
+
+    def _promote(self, now):
+        """Move chats whose bucket has refilled to the ready heap"""
+        while self._waiting and self._waiting[0][0] <= now:
+            _, seq, chat_id = heapq.heappop(self._waiting)
+            delay = self._bucket(chat_id).delay(now)
+            if delay > 0:
+                heapq.heappush(self._waiting, (now + delay, seq, chat_id))
+                continue
+            heapq.heappush(self._ready, (self._queues[chat_id][0].priority, seq, chat_id))
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._promote(now)
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            _, seq, chat_id = heapq.heappop(self._ready)
+            chat_delay = self._bucket(chat_id).delay(now)
+            if chat_delay > 0:
+                # Paused by a RetryAfter since it became ready
+                heapq.heappush(self._waiting, (now + chat_delay, seq, chat_id))
+                continue
+            self._scheduled.discard(chat_id)
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            self._global.take(now)
+            self._bucket(chat_id).take(now)
+
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._dispatch(chat_id, job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+            if not queue:
+                del self._queues[chat_id]
+            self._forget_idle_buckets(now)
+
+    async def _dispatch(self, chat_id, job):
+        job.attempts += 1
+        priority = PRIORITY_NAMES[job.priority]
+        started = time.monotonic()
+        if job.attempts == 1:
+            SEND_WAIT.labels(priority).observe(started - job.queued_at)
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            now = time.monotonic()
+            self._bucket(chat_id).pause(e.retry_after, now)
+            if job.attempts > self.max_retries:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            self.retried += 1
+            logger.warning(f"Flood limit for chat {chat_id}, retrying in {e.retry_after}s")
+            # Back to the front so the chat keeps its message order
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+            queue.appendleft(job)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            SEND_LATENCY.labels(priority).observe(time.monotonic() - started)
+            self._busy.discard(chat_id)
+            if chat_id in self._queues:
+                self._schedule(chat_id, time.monotonic())
+
+    def _forget_idle_buckets(self, now):
+        """Keep the bucket table bounded by dropping long idle chats"""
+        # A bucket only turns idle after BUCKET_IDLE_TIMEOUT, so a more frequent scan finds nothing new
+        if len(self._buckets) < 10000 or now - self._last_sweep < BUCKET_IDLE_TIMEOUT:
+            return
+        self._last_sweep = now
+        for chat_id in [c for c, b in self._buckets.items()
+                        if now - b.updated > BUCKET_IDLE_TIMEOUT
+                        and c not in self._queues and c not in self._busy]:
+            del self._buckets[chat_id]
+
+
+# Scheduler shared by the application
+scheduler = SendScheduler()
+
+metrics.gauge(
+    "telegram_send_queue", "Messages queued in the send scheduler",
+    lambda: {(name,): scheduler.queue_depth(priority) for priority, name in PRIORITY_NAMES.items()},
+    ["priority"]
+)
+metrics.gauge("telegram_send_in_flight", "Telegram send calls in progress", lambda: len(scheduler._in_flight))
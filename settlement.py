@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Atomic bet settlement
+
+A bet is reserved, rolled and settled while holding the lock of its user,
+so concurrent taps from the same user cannot interleave and the stake can
+never be spent twice. Locks come from a fixed-size sharded table: memory
+stays bounded no matter how many users play, and users in different shards
+settle in parallel.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from crypto_payments import reserve_balance, update_user_balance, get_user_balance
+from user_data import get_user_data, update_user_data, save_user_data
+from user_stats import record_bet
+from leaderboard import leaderboards
+from money import Money
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Number of lock shards; users are mapped to shards by user_id
+SETTLEMENT_LOCK_SHARDS = int(os.getenv("SETTLEMENT_LOCK_SHARDS", "1024"))
+
+_locks = [asyncio.Lock() for _ in range(SETTLEMENT_LOCK_SHARDS)]
+
+SETTLEMENTS = metrics.counter(
+    "settlements", "Bets by game and result: won, lost, rejected or failed", ["game", "result"]
+)
+SETTLEMENT_DURATION = metrics.histogram(
+    "settlement_seconds", "Time a bet holds its user's lock, dice roll included", ["game"]
+)
+
+def user_lock(user_id):
+    """Get the lock that guards balance changes of a user"""
+    return _locks[int(user_id) % SETTLEMENT_LOCK_SHARDS]
+
+def _record_stats(user_id, game, bet_amount, winnings):
+    """Add a settled bet to the user's statistics record and the leaderboards"""
+    user_data = get_user_data(user_id)
+    stats = record_bet(user_data, game, bet_amount, winnings)
+    update_user_data(user_id, user_data)
+    save_user_data()
+    leaderboards.update(user_id, stats)
+    return stats
+
+async def settle_bet(user_id, bet_amount, roll, resolve, game=None):
+    """
+    Reserve the stake, roll and settle a bet as one unit
+
+    Args:
+        user_id: User ID
+        bet_amount: Stake, Money or TON
+        roll: Coroutine function returning the dice value
+        resolve: Function mapping the dice value to the payout as Money (zero for a loss)
+        game: Registered game key; when given, the bet is added to the
+              user's statistics in the same locked section
+
+    Returns:
+        dict: success flag and either dice_value, winnings and balance
+              (Money) and stats (None without game), or an error message
+              when the stake could not be reserved
+    """
+    bet_amount = Money.of(bet_amount)
+    label = game or "other"
+    if bet_amount <= 0:
+        SETTLEMENTS.labels(label, "rejected").inc()
+        return {
+            "success": False,
+            "message": "Сумма ставки должна быть больше нуля"
+        }
+
+    async with user_lock(user_id):
+        started = time.perf_counter()
+        if reserve_balance(user_id, bet_amount) is None:
+            SETTLEMENTS.labels(label, "rejected").inc()
+            return {
+                "success": False,
+                "message": f"Недостаточно средств. Ваш баланс: {get_user_balance(user_id)} TON"
+            }
+
+        try:
+            dice_value = await roll()
+        except Exception:
+            # The bet never happened, give the stake back
+            update_user_balance(user_id, bet_amount)
+            SETTLEMENTS.labels(label, "failed").inc()
+            logger.error(f"Roll failed for user {user_id}, stake of {bet_amount} TON returned")
+            raise
+
+        winnings = resolve(dice_value)
+        if winnings > 0:
+            balance = update_user_balance(user_id, winnings)
+        else:
+            balance = get_user_balance(user_id)
+
+        stats = _record_stats(user_id, game, bet_amount, winnings) if game is not None else None
+        SETTLEMENT_DURATION.labels(label).observe(time.perf_counter() - started)
+        SETTLEMENTS.labels(label, "won" if winnings > 0 else "lost").inc()
+
+    return {
+        "success": True,
+        "dice_value": dice_value,
+        "winnings": winnings,
+        "balance": balance,
+        "stats": stats
+    }
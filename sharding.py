@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sharded multi-process runtime
+
+    python main.py --mode sharded           # front process and SHARD_COUNT workers
+    python sharding.py split [--shards N]   # partition the user store between workers
+
+One Python process handles updates on one core. In sharded mode players are
+partitioned between SHARD_COUNT worker processes by user_id % SHARD_COUNT,
+and every worker owns its players outright: their records, journal, ledger
+entries and processed invoices live in the worker's own data directory,
+SHARD_DIR/shard-<n>/data. Nothing is shared, so no state needs locking
+across processes and throughput grows with the number of cores.
+
+The front process:
+
+* receives Telegram and CryptoBot updates in webhook mode (webhook.py) and
+  forwards each one to the worker owning its user. A worker that is full
+  answers 503, and so does the front, so Telegram redelivers later;
+* runs the singleton roles: the results channel feed, which workers send
+  their entries to, and the invoice reconciler, which hands paid invoices
+  to the owning worker;
+* merges the leaderboards of all workers for /top;
+* starts the workers and restarts any that exit.
+
+Workers and the front talk over HTTP on localhost: the front's control
+server listens on SHARD_BASE_PORT, worker n on SHARD_BASE_PORT + 1 + n and
+serves /metrics on METRICS_PORT + 1 + n. A worker exits when the front's
+end of its stdin pipe closes, so it never outlives the front.
+
+Changing SHARD_COUNT moves players between workers: stop the bot and split
+the data again. Finished day and week boards are not posted to the channel
+in sharded mode, since no single worker sees all players.
+"""
+
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+import argparse
+import aiohttp
+from aiohttp import web
+from telegram import Bot, Update
+from bot import create_bot, TELEGRAM_API_URL
+from webhook import WebhookServer, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET, WEBHOOK_URL
+from crypto_payments import parse_hidden_message, process_payment_update
+from leaderboard import leaderboards, merge_boards, render_boards
+from cryptobot_client import cryptobot
+from payment_reconciler import reconciler
+from send_scheduler import scheduler, SEND_GLOBAL_RATE
+from channel_publisher import publisher
+from metrics import METRICS_PORT, server as metrics_server
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes, one per core by default
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", str(os.cpu_count() or 1)))
+
+# Control server of the front; worker n listens on SHARD_BASE_PORT + 1 + n
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8700"))
+
+# Root of the workers' data directories
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+
+# Seconds to wait for workers to start and to stop
+SHARD_START_TIMEOUT = float(os.getenv("SHARD_START_TIMEOUT", "60"))
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "30"))
+
+# Pause before a worker that exited is started again
+SHARD_RESTART_DELAY = float(os.getenv("SHARD_RESTART_DELAY", "1"))
+
+# Timeout of requests between the front and the workers
+SHARD_REQUEST_TIMEOUT = float(os.getenv("SHARD_REQUEST_TIMEOUT", "30"))
+
+CONTROL_URL = f"http://127.0.0.1:{SHARD_BASE_PORT}"
+
+
+def shard_of(user_id, shards=SHARD_COUNT):
+    """Worker owning a user"""
+    return int(user_id) % shards
+
+def worker_port(shard):
+    return SHARD_BASE_PORT + 1 + shard
+
+def shard_directory(shard, root=SHARD_DIR):
+    return os.path.join(root, f"shard-{shard}")
+
+def update_user_id(payload):
+    """
+    User an update payload is routed by, without building an Update
+
+    Like update_processor.update_key(): the sender, else the chat, else None.
+    """
+    for field, value in payload.items():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user.get("id")
+        chat = value.get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+def _dumps(value):
+    # Payment results carry Money amounts
+    return json.dumps(value, default=str)
+
+
+class ShardClient:
+    """HTTP client for the requests between the front and the workers"""
+
+    def __init__(self, shards=SHARD_COUNT, timeout=SHARD_REQUEST_TIMEOUT):
+        self.shards = shards
+        self.timeout = timeout
+        self._session = None
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=0)
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _worker_url(self, shard, path):
+        return f"http://127.0.0.1:{worker_port(shard)}{path}"
+
+    # Front to workers
+
+    async def forward_update(self, body, user_id):
+        """Hand a raw Telegram update to its worker; returns the worker's HTTP status"""
+        shard = shard_of(user_id or 0, self.shards)
+        try:
+            async with self._session.post(self._worker_url(shard, "/update"), data=body,
+                                          headers={"Content-Type": "application/json"}) as response:
+                return response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Could not forward update to shard {shard}: {e}")
+            return 503
+
+    async def forward_payment(self, update_data):
+        """Credit a CryptoBot update on the worker owning the paying user"""
+        if update_data.get("update_type") != "invoice_paid":
+            # Touches no user state, only logged
+            return await process_payment_update(update_data)
+        invoice = update_data.get("payload", {})
+        try:
+            user_id, _ = parse_hidden_message(invoice.get("hidden_message", ""))
+        except ValueError:
+            user_id = None
+        if user_id is None:
+            logger.warning(f"Payment received but user_id not found: invoice {invoice.get('invoice_id')}")
+            return {"success": False, "message": "User ID not found in payment"}
+        shard = shard_of(user_id, self.shards)
+        try:
+            async with self._session.post(self._worker_url(shard, "/payment"), json=update_data) as response:
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Could not forward payment to shard {shard}: {e}")
+            return {"success": False, "message": f"Shard {shard} unavailable: {e}"}
+
+    async def export_leaderboards(self, period):
+        """Boards of a period from every reachable worker"""
+        async def fetch(shard):
+            try:
+                async with self._session.get(self._worker_url(shard, "/leaders"),
+                                             params={"period": period}) as response:
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"Leaderboards of shard {shard} unavailable: {e}")
+                return {}
+        return await asyncio.gather(*(fetch(shard) for shard in range(self.shards)))
+
+    async def healthy(self, shard):
+        try:
+            async with self._session.get(self._worker_url(shard, "/healthz")) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    # Workers to the front
+
+    async def publish(self, entries, payment_url):
+        """Send channel feed entries to the front, which owns the feed"""
+        async with self._session.post(f"{CONTROL_URL}/publish",
+                                      json={"entries": entries, "payment_url": payment_url}) as response:
+            response.raise_for_status()
+
+    async def render_leaderboards(self, period):
+        """Text of the boards of a period across all workers"""
+        async with self._session.get(f"{CONTROL_URL}/leaders", params={"period": period}) as response:
+            response.raise_for_status()
+            return (await response.json())["text"]
+
+
+class FrontServer(WebhookServer):
+    """Public webhook server of the front: routes updates to the workers instead of handling them"""
+
+    def __init__(self, client, **kwargs):
+        super().__init__(None, process_payment=client.forward_payment, **kwargs)
+        self.client = client
+
+    async def handle_telegram(self, request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            logger.warning("Rejected malformed Telegram update")
+            return web.Response(status=400)
+        status = await self.client.forward_update(body, update_user_id(payload))
+        if status != 200:
+            # Overloaded or unreachable worker: Telegram delivers the update again later
+            return web.Response(status=503)
+        return web.Response()
+
+
+class ControlServer:
+    """The front's localhost server for the workers: channel feed entries and merged leaderboards"""
+
+    def __init__(self, client, port=SHARD_BASE_PORT):
+        self.client = client
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/publish", self.handle_publish)
+        app.router.add_get("/leaders", self.handle_leaders)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_publish(self, request):
+        data = await request.json()
+        if data.get("payment_url"):
+            publisher.payment_url = data["payment_url"]
+        for entry in data.get("entries", []):
+            publisher.publish(entry)
+        return web.Response()
+
+    async def handle_leaders(self, request):
+        period = request.query.get("period", "day")
+        boards = merge_boards(await self.client.export_leaderboards(period), leaderboards.size)
+        return web.json_response({"text": render_boards(period, boards)})
+
+
+class WorkerServer:
+    """A worker's localhost server: updates and payments of its users, its leaderboards"""
+
+    def __init__(self, application, port):
+        self.application = application
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/update", self.handle_update)
+        app.router.add_post("/payment", self.handle_payment)
+        app.router.add_get("/leaders", self.handle_leaders)
+        app.router.add_get("/healthz", self.handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_update(self, request):
+        if getattr(self.application.update_processor, "overloaded", False):
+            return web.Response(status=503)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed Telegram update: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_payment(self, request):
+        result = await process_payment_update(await request.json())
+        return web.json_response(result, dumps=_dumps)
+
+    async def handle_leaders(self, request):
+        return web.json_response(leaderboards.export(request.query.get("period", "day")))
+
+    async def handle_health(self, request):
+        return web.json_response({"ok": True})
+
+
+class ShardSupervisor:
+    """Starts the worker processes and restarts those that exit"""
+
+    def __init__(self, client, shards=SHARD_COUNT, restart_delay=SHARD_RESTART_DELAY):
+        self.client = client
+        self.shards = shards
+        self.restart_delay = restart_delay
+        self.processes = {}
+        self.restarts = 0
+        self._tasks = []
+        self._stopping = False
+        # Telegram's global flood limit is per bot, so the workers and the
+        # front, which posts to the results channel, share it equally
+        self.send_rate = SEND_GLOBAL_RATE / (shards + 1)
+        self.environment = dict(os.environ, SEND_GLOBAL_RATE=str(self.send_rate))
+
+    async def start(self, timeout=SHARD_START_TIMEOUT):
+        """Start all workers and wait until every one answers"""
+        self._tasks = [asyncio.create_task(self._supervise(shard)) for shard in range(self.shards)]
+        deadline = asyncio.get_running_loop().time() + timeout
+        for shard in range(self.shards):
+            while not await self.client.healthy(shard):
+                if asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"Shard worker {shard} did not start within {timeout:.0f}s")
+                await asyncio.sleep(0.1)
+        logger.info(f"Started {self.shards} shard workers")
+
+    async def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        """Ask every worker to finish its queued updates and exit"""
+        self._stopping = True
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._tasks), timeout)
+        except asyncio.TimeoutError:
+            for shard, process in self.processes.items():
+                if process.returncode is None:
+                    logger.error(f"Shard worker {shard} did not stop within {timeout:.0f}s, killing it")
+                    process.kill()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _supervise(self, shard):
+        while True:
+            # The worker watches its stdin and exits when the front goes away
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "worker", "--shard", str(shard),
+                "--shards", str(self.shards), stdin=asyncio.subprocess.PIPE, env=self.environment
+            )
+            self.processes[shard] = process
+            status = await process.wait()
+            if self._stopping:
+                return
+            self.restarts += 1
+            logger.error(f"Shard worker {shard} exited with status {status}, "
+                         f"restarting in {self.restart_delay:.0f}s")
+            await asyncio.sleep(self.restart_delay)
+
+
+def _stop_event(*signals):
+    """Event set by the given signals"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+async def run_front(shards=SHARD_COUNT, url=WEBHOOK_URL):
+    """Run the front process and its workers until SIGINT or SIGTERM"""
+    if not url:
+        raise ValueError("No WEBHOOK_URL found in environment variables")
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise ValueError("No TELEGRAM_BOT_TOKEN found in environment variables")
+
+    stop = _stop_event(signal.SIGINT, signal.SIGTERM)
+    client = ShardClient(shards)
+    await client.start()
+    control = ControlServer(client)
+    await control.start()
+    supervisor = ShardSupervisor(client, shards)
+    await supervisor.start()
+
+    # Singleton roles
+    bot = Bot(token, base_url=f"{TELEGRAM_API_URL}/bot", base_file_url=f"{TELEGRAM_API_URL}/file/bot")
+    await bot.initialize()
+    await cryptobot.start()
+    scheduler.set_global_rate(supervisor.send_rate)
+    await scheduler.start()
+    await publisher.start(bot)
+    reconciler.process_payment = client.forward_payment
+    await reconciler.start()
+    await metrics_server.start()
+
+    server = FrontServer(client)
+    await server.start()
+    await bot.set_webhook(
+        url=f"{url.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}",
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"Sharded runtime with {shards} workers, webhook set to {url.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}")
+
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        # Workers flush their feed entries to the control server while stopping
+        await supervisor.stop()
+        await control.stop()
+        await reconciler.stop()
+        await publisher.stop()
+        await scheduler.stop()
+        await cryptobot.close()
+        await metrics_server.stop()
+        await bot.shutdown()
+        await client.close()
+
+
+async def run_worker(shard, shards=SHARD_COUNT):
+    """Run worker `shard` in its own data directory until the front stops it"""
+    # Interrupts are for the front; it stops the workers with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = _stop_event(signal.SIGTERM)
+
+    # stdin is a pipe from the front; end of file means the front is gone
+    front = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(front), sys.stdin)
+
+    async def watch_front():
+        await front.read()
+        stop.set()
+    watcher = asyncio.create_task(watch_front())
+
+    directory = shard_directory(shard)
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    os.chdir(directory)
+    metrics_server.port = METRICS_PORT + 1 + shard if METRICS_PORT else 0
+
+    client = ShardClient(shards)
+    await client.start()
+    publisher.forward = client.publish
+    leaderboards.render_remote = client.render_leaderboards
+    leaderboards.announce_results = False
+
+    application = create_bot(singletons=False)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    server = WorkerServer(application, worker_port(shard))
+    await server.start()
+    logger.info(f"Shard worker {shard}/{shards} ready in {directory}")
+
+    try:
+        await stop.wait()
+    finally:
+        watcher.cancel()
+        await server.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        await client.close()
+
+def worker_main(shard, shards):
+    """Process entry point of a worker"""
+    from user_data import close_user_data
+    from ledger import ledger
+    from crypto_payments import processed_invoices
+    from log_pipeline import setup_logging, shutdown_logging
+
+    setup_logging()
+    try:
+        # Every record the worker logs says which shard wrote it
+        with log_context(shard=shard):
+            asyncio.run(run_worker(shard, shards))
+    except Exception as e:
+        logger.error(f"Shard worker {shard} failed: {e}")
+        return 1
+    finally:
+        close_user_data()
+        ledger.close()
+        processed_invoices.close()
+        shutdown_logging()
+    return 0
+
+
+def split_users(shards=SHARD_COUNT, root=SHARD_DIR, backend=None):
+    """
+    Partition the user store into the workers' data directories
+
+    The source and the workers' stores use the backend selected by
+    USER_STORAGE_BACKEND unless another one is given, since the workers open
+    their stores with that setting too.
+
+    Returns:
+        list: number of users given to each worker
+    """
+    from user_data import create_storage, USER_STORAGE_BACKEND
+
+    backend = backend or USER_STORAGE_BACKEND
+    source = create_storage(backend)
+    source.load()
+    targets = []
+    for shard in range(shards):
+        directory = shard_directory(shard, root)
+        target = create_storage(backend, directory)
+        target.load()
+        targets.append(target)
+        if target.all_ids():
+            # Splitting again would give some players two records
+            for opened in [source] + targets:
+                opened.close()
+            raise RuntimeError(f"{directory} already holds user data, nothing was changed")
+    counts = [0] * shards
+    for user_id in source.all_ids():
+        shard = shard_of(user_id, shards)
+        targets[shard].put(user_id, source.get(user_id))
+        counts[shard] += 1
+    for target in targets:
+        target.close()
+    source.close()
+    logger.info(f"Split {sum(counts)} users into {shards} shards: {counts}")
+    return counts
+
+def main(argv=None):
+    """Command line entry point: the worker process and data maintenance"""
+    parser = argparse.ArgumentParser(description="Sharded runtime")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker = subparsers.add_parser("worker", help="run one worker (started by the front process)")
+    worker.add_argument("--shard", type=int, required=True)
+    worker.add_argument("--shards", type=int, default=SHARD_COUNT)
+    split = subparsers.add_parser("split", help="partition the user store between the workers")
+    split.add_argument("--shards", type=int, default=SHARD_COUNT)
+    split.add_argument("--root", default=SHARD_DIR, help="root of the workers' data directories")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        return worker_main(args.shard, args.shards)
+    counts = split_users(args.shards, args.root)
+    print(f"Split {sum(counts)} users into {args.shards} shards: {counts}")
+    print(f"Start with: SHARD_COUNT={args.shards} python main.py --mode sharded")
+    return 0
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ["worker"]:
+        logging.basicConfig(
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            level=logging.INFO
+        )
+    sys.exit(main())
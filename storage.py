@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Storage backends for user data
+
+A backend owns the persisted user records and hands out UserRecord objects
+(see user_record.py) to the accessor functions in user_data.py. Records are
+encoded with UserRecord.to_persisted() when written and decoded when read.
+Two implementations are available:
+
+* JsonStorage   - all users in memory, changes appended to a journal and
+                  periodically compacted into a JSON snapshot
+* SqliteStorage - users stored as rows in SQLite (WAL mode), loaded lazily
+                  on first access and kept in a bounded LRU cache
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from user_record import UserRecord
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_user(record):
+    """Encode a user record as compact JSON"""
+    return json.dumps(record.to_persisted(), ensure_ascii=False, separators=(",", ":"))
+
+def _decode_user(data):
+    return UserRecord.from_persisted(data)
+
+def read_journal(path):
+    """
+    Parse the records of a JSON-lines journal file (user journal, ledger)
+
+    Returns the records up to the first line that is cut short or corrupted,
+    and the length in bytes of that intact prefix. Lines are appended whole,
+    so a crash in the middle of an append leaves a line without its newline.
+    """
+    records = []
+    intact = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            intact += len(line)
+    return records, intact
+
+
+class StorageBackend:
+    """Interface shared by all user storage backends"""
+
+    def load(self):
+        """Prepare the backend for use (open files, read snapshots)"""
+        raise NotImplementedError
+
+    def get(self, user_id):
+        """Return the UserRecord of a user or None"""
+        raise NotImplementedError
+
+    def put(self, user_id, data):
+        """Store the UserRecord of a user and mark it changed"""
+        raise NotImplementedError
+
+    def all_ids(self):
+        """Return a list of all user IDs"""
+        raise NotImplementedError
+
+    def collect(self):
+        """
+        Take the changes made since the last call as a write batch
+
+        Runs on the event loop thread. Returns None when nothing changed.
+        The batch must not reference objects that the caller keeps mutating.
+        """
+        raise NotImplementedError
+
+    def write(self, batch):
+        """
+        Persist a batch from collect(); safe to run in a worker thread
+
+        Returns False if the batch could not be written. It must not touch the
+        change tracking that collect() reads, see complete().
+        """
+        raise NotImplementedError
+
+    def complete(self, batch, written):
+        """
+        Finish a batch after write() returned; runs on the event loop thread
+
+        A batch that was not written is marked changed again, so the next
+        flush collects and retries it.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist all changes made since the last flush; False if the write failed"""
+        batch = self.collect()
+        if batch is None:
+            return True
+        written = self.write(batch)
+        self.complete(batch, written)
+        return written
+
+    def close(self):
+        """Flush pending changes and release resources"""
+        raise NotImplementedError
+
+
+class JsonStorage(StorageBackend):
+    """
+    All users in memory, persisted as a JSON snapshot plus an append-only journal
+
+    Every flush appends one compact JSON line per changed user to the journal,
+    so the cost of a write depends on the number of changed users rather than
+    on the total number of users. After snapshot_every records the writer
+    folds the journal into a new snapshot and truncates it; it works from
+    the files alone, so the event loop never encodes the whole user set. On
+    load the snapshot is read and the journal tail is replayed on top of it.
+
+    fsync_policy:
+        "always" - fsync after every flush
+        "batch"  - group commit: one fsync per fsync_batch records or
+                   every fsync_interval seconds, whichever comes first
+        "never"  - leave flushing to the operating system
+    """
+
+    def __init__(self, path, journal_path, fsync_policy="batch", fsync_batch=64,
+                 fsync_interval=1.0, snapshot_every=5000):
+        self.path = path
+        self.journal_path = journal_path
+        self.fsync_policy = fsync_policy
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+
+        self.users = {}
+        self._dirty = set()
+        self._journal = None
+        self._journal_records = 0
+        self._unsynced_records = 0
+        self._last_fsync = 0.0
+        # Bytes written to the journal and the snapshot since creation
+        self.bytes_written = 0
+
+    def load(self):
+        """Load users from the latest snapshot and replay the journal"""
+        self._dirty.clear()
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self.users = {user_id: _decode_user(data) for user_id, data in json.load(file).items()}
+                    logger.info(f"Loaded {len(self.users)} user records from file")
+            else:
+                # Create directory if it doesn't exist
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.users = {}
+                logger.info("No user data file found, starting with empty data")
+            self._replay_journal()
+        except Exception as e:
+            logger.error(f"Error loading user data: {e}")
+            self.users = {}
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    def put(self, user_id, data):
+        self.users[user_id] = data
+        self._dirty.add(user_id)
+
+    def all_ids(self):
+        return list(self.users.keys())
+
+    def collect(self):
+        """Encode records of changed users and decide whether a compaction is due"""
+        if not self._dirty:
+            return None
+        user_ids = list(self._dirty)
+        lines = "".join(self._encode_record(user_id) + "\n" for user_id in user_ids)
+        self._dirty.clear()
+
+        self._journal_records += len(user_ids)
+        compact = self._journal_records >= self.snapshot_every
+        if compact:
+            self._journal_records = 0
+        return lines, user_ids, compact
+
+    def write(self, batch):
+        """Append a batch to the journal and compact it if that is due"""
+        lines, user_ids, compact = batch
+        data = lines.encode("utf-8")
+        try:
+            journal = self._open_journal()
+            offset = journal.tell()
+            try:
+                journal.write(data)
+                journal.flush()
+            except Exception:
+                # Cut off a partial line so the retried records start on a line of their own
+                self._close_journal()
+                os.truncate(self.journal_path, offset)
+                raise
+            self.bytes_written += len(data)
+            self._unsynced_records += len(user_ids)
+            self._sync_journal()
+        except Exception as e:
+            logger.error(f"Error saving user data: {e}")
+            return False
+
+        if compact:
+            self._compact()
+        return True
+
+    def complete(self, batch, written):
+        if not written:
+            # Journal records hold whole users, so writing them again is harmless
+            self._dirty.update(batch[1])
+
+    def snapshot(self):
+        """Write a full snapshot of user data and truncate the journal"""
+        self._journal_records = 0
+        self._write_snapshot({user_id: record.to_persisted() for user_id, record in self.users.items()})
+
+    def _compact(self):
+        """
+        Fold the journal into a new snapshot
+
+        Runs in the writer thread and reads the snapshot and the journal back
+        from disk instead of encoding the users held in memory: the files are
+        consistent with each other and nothing else touches them meanwhile.
+        If it fails, the journal keeps every record and the next compaction
+        tries again.
+        """
+        try:
+            users = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    users = json.load(file)
+            records, _ = read_journal(self.journal_path)
+            for record in records:
+                if record["u"] is None:
+                    users.pop(record["id"], None)
+                else:
+                    users[record["id"]] = record["u"]
+        except Exception as e:
+            logger.error(f"Error compacting the user data journal: {e}")
+            return
+        self._write_snapshot(users)
+
+    def _write_snapshot(self, users):
+        """Atomically replace the snapshot file and truncate the journal"""
+        try:
+            # Create directory if it doesn't exist
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            # Write to a temporary file first so a crash never leaves a partial snapshot
+            temp_file = f"{self.path}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                json.dump(users, file, ensure_ascii=False, indent=2)
+                file.flush()
+                os.fsync(file.fileno())
+                self.bytes_written += file.tell()
+            os.replace(temp_file, self.path)
+
+            # Every record in the journal is now part of the snapshot
+            self._close_journal()
+            self._journal = open(self.journal_path, 'wb')
+            self._unsynced_records = 0
+            logger.info(f"Saved snapshot of {len(users)} user records and compacted the journal")
+        except Exception as e:
+            logger.error(f"Error writing user data snapshot: {e}")
+
+    def close(self):
+        """Save pending changes, write a final snapshot and close the journal"""
+        self.flush()
+        if self._journal_records:
+            self.snapshot()
+        if self._journal is not None:
+            self._sync_journal(force=True)
+            self._close_journal()
+
+    def _encode_record(self, user_id):
+        """Encode a single journal record as one compact JSON line"""
+        record = self.users.get(user_id)
+        data = record.to_persisted() if record is not None else None
+        return json.dumps({"id": user_id, "u": data}, ensure_ascii=False, separators=(",", ":"))
+
+    def _open_journal(self):
+        """Open the journal for appending if it is not open yet"""
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._journal = open(self.journal_path, 'ab')
+        return self._journal
+
+    def _close_journal(self):
+        journal, self._journal = self._journal, None
+        if journal is not None:
+            journal.close()
+
+    def _sync_journal(self, force=False):
+        """fsync the journal according to the fsync policy"""
+        if self._journal is None or self._unsynced_records == 0:
+            return
+        if not force:
+            if self.fsync_policy == "never":
+                return
+            if self.fsync_policy == "batch":
+                due = time.monotonic() - self._last_fsync >= self.fsync_interval
+                if self._unsynced_records < self.fsync_batch and not due:
+                    return
+        os.fsync(self._journal.fileno())
+        self._unsynced_records = 0
+        self._last_fsync = time.monotonic()
+
+    def _replay_journal(self):
+        """Apply journal records on top of the loaded snapshot"""
+        self._journal_records = 0
+        if not os.path.exists(self.journal_path):
+            return
+        records, intact = read_journal(self.journal_path)
+        for record in records:
+            if record["u"] is None:
+                self.users.pop(record["id"], None)
+            else:
+                self.users[record["id"]] = _decode_user(record["u"])
+        self._journal_records = len(records)
+
+        size = os.path.getsize(self.journal_path)
+        if size > intact:
+            # Cut the torn tail off, or the next append would be glued onto it
+            # and the next replay would stop there, dropping every later record
+            logger.warning(f"Journal is corrupted after record {len(records)}, "
+                           f"truncating {size - intact} bytes")
+            os.truncate(self.journal_path, intact)
+        logger.info(f"Replayed {self._journal_records} journal records")
+
+
+class SqliteStorage(StorageBackend):
+    """
+    Users stored as rows in SQLite, loaded lazily and cached in a bounded LRU
+
+    Each user is one row keyed by user_id (the primary key doubles as the
+    index). Rows are decoded on first access and kept in an LRU cache of
+    cache_size entries. Changed users are held in a separate dirty map, and
+    then in an in-flight map until their batch is committed, so evicting
+    them from the cache never loses a write. Reads and writes use separate
+    connections so a batch can be committed from a worker thread.
+    """
+
+    _SELECT_ONE = "SELECT data FROM users WHERE user_id = ?"
+    _SELECT_IDS = "SELECT user_id FROM users"
+    _UPSERT = "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)"
+
+    def __init__(self, path, cache_size=10000):
+        self.path = path
+        self.cache_size = cache_size
+        self._conn = None
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._inflight = {}
+
+    def load(self):
+        """Open the database and create the schema if needed"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Statements are parameterized constants, so sqlite3 reuses them from its statement cache
+        self._conn = sqlite3.connect(self.path, cached_statements=64)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        # WAL lets the writer commit while the reader keeps serving lookups
+        self._writer = sqlite3.connect(self.path, cached_statements=64, check_same_thread=False)
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._cache.clear()
+        self._dirty.clear()
+        self._inflight.clear()
+        logger.info(f"Opened SQLite user store {self.path}")
+
+    def get(self, user_id):
+        data = self._dirty.get(user_id) or self._inflight.get(user_id)
+        if data is not None:
+            return data
+
+        data = self._cache.get(user_id)
+        if data is not None:
+            self._cache.move_to_end(user_id)
+            return data
+
+        row = self._conn.execute(self._SELECT_ONE, (user_id,)).fetchone()
+        if row is None:
+            return None
+        data = _decode_user(json.loads(row[0]))
+        self._remember(user_id, data)
+        return data
+
+    def put(self, user_id, data):
+        self._dirty[user_id] = data
+        self._remember(user_id, data)
+
+    def all_ids(self):
+        # Pending users may not have reached the table yet
+        ids = [row[0] for row in self._conn.execute(self._SELECT_IDS)]
+        stored = set(ids)
+        for pending in (self._inflight, self._dirty):
+            for user_id in pending:
+                if user_id not in stored:
+                    stored.add(user_id)
+                    ids.append(user_id)
+        return ids
+
+    def collect(self):
+        """Encode changed users as rows and move them in flight"""
+        if not self._dirty:
+            return None
+        batch = [(user_id, data, _encode_user(data)) for user_id, data in self._dirty.items()]
+        self._inflight.update(self._dirty)
+        self._dirty = {}
+        return batch
+
+    def write(self, batch):
+        """Write a batch of rows in a single transaction"""
+        try:
+            with self._writer_lock, self._writer:
+                self._writer.executemany(self._UPSERT, [(user_id, row) for user_id, _, row in batch])
+        except Exception as e:
+            logger.error(f"Error saving user data: {e}")
+            return False
+        return True
+
+    def complete(self, batch, written):
+        for user_id, data, _ in batch:
+            if not written:
+                # Collect the row again with the next flush, unless the user was changed since
+                self._dirty.setdefault(user_id, data)
+            # Keep entries that were changed and collected again in the meantime
+            if self._inflight.get(user_id) is data:
+                del self._inflight[user_id]
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._writer.close()
+        self._writer = None
+        self._conn.close()
+        self._conn = None
+
+    def import_users(self, users):
+        """Bulk insert a dict of UserRecords, replacing existing rows"""
+        with self._writer_lock, self._writer:
+            self._writer.executemany(
+                self._UPSERT,
+                [(str(user_id), _encode_user(record)) for user_id, record in users.items()]
+            )
+
+    def _remember(self, user_id, data):
+        """Put a user into the LRU cache, evicting the least recently used one"""
+        self._cache[user_id] = data
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
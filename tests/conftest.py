@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Shared test setup
+
+The bot's modules live at the repository root and keep their data under
+relative "data/" paths, so tests import them from there and run in a
+temporary working directory.
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in an empty directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
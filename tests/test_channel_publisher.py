@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the rolling live feed in the results channel
+"""
+
+import asyncio
+from telegram.error import BadRequest
+from channel_publisher import ChannelPublisher, FEED_HEADER, MAX_MESSAGE_LENGTH
+
+
+class FakeMessage:
+    def __init__(self, bot, text):
+        self.bot = bot
+        self.text = text
+
+    async def edit_text(self, text, **kwargs):
+        if self.bot.edit_error is not None:
+            raise self.bot.edit_error
+        self.bot.edits += 1
+        self.text = text
+
+
+class FakeBot:
+    """Keeps every feed message it sent; edits may fail with edit_error"""
+
+    def __init__(self):
+        self.messages = []
+        self.edits = 0
+        self.edit_error = None
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(FakeMessage(self, text))
+        return self.messages[-1]
+
+
+def entries_of(message):
+    assert message.text.startswith(FEED_HEADER)
+    return message.text[len(FEED_HEADER):].split("\n\n")
+
+
+def run_publisher(scenario, **options):
+    bot = FakeBot()
+
+    async def main():
+        publisher = ChannelPublisher(chat_id="-100", **dict(dict(interval=60), **options))
+        await publisher.start(bot)
+        try:
+            await scenario(publisher, bot)
+        finally:
+            await publisher.stop()
+
+    asyncio.run(main())
+    return bot
+
+
+def test_later_entries_edit_the_feed_message():
+    async def scenario(publisher, bot):
+        publisher.publish("first")
+        await publisher.flush()
+        publisher.publish("second")
+        publisher.publish("third")
+        await publisher.flush()
+
+    bot = run_publisher(scenario)
+    assert len(bot.messages) == 1
+    assert bot.edits == 1
+    assert entries_of(bot.messages[0]) == ["first", "second", "third"]
+
+
+def test_full_feed_message_is_continued_in_a_new_one():
+    async def scenario(publisher, bot):
+        for number in range(5):
+            publisher.publish(f"entry {number}")
+        await publisher.flush()
+
+    bot = run_publisher(scenario, feed_entries=3)
+    assert [entries_of(message) for message in bot.messages] == [
+        ["entry 0", "entry 1", "entry 2"], ["entry 3", "entry 4"]
+    ]
+
+
+def test_feed_message_stays_within_the_length_limit():
+    entry = "x" * 1500
+
+    async def scenario(publisher, bot):
+        for _ in range(5):
+            publisher.publish(entry)
+        await publisher.flush()
+
+    bot = run_publisher(scenario)
+    assert [len(entries_of(message)) for message in bot.messages] == [2, 2, 1]
+    assert all(len(message.text) <= MAX_MESSAGE_LENGTH for message in bot.messages)
+
+
+def test_feed_message_that_cannot_be_edited_is_replaced():
+    async def scenario(publisher, bot):
+        publisher.publish("first")
+        await publisher.flush()
+        bot.edit_error = BadRequest("Message to edit not found")
+        publisher.publish("second")
+        await publisher.flush()
+
+    bot = run_publisher(scenario)
+    assert [entries_of(message) for message in bot.messages] == [["first"], ["first", "second"]]
+
+
+def test_entries_are_escaped_for_markdown():
+    async def scenario(publisher, bot):
+        publisher.publish("user_name *won*")
+        await publisher.flush()
+
+    bot = run_publisher(scenario)
+    assert entries_of(bot.messages[0]) == ["user\\_name \\*won\\*"]
+
+
+def test_full_buffer_is_flushed_before_the_interval():
+    async def scenario(publisher, bot):
+        for number in range(3):
+            publisher.publish(f"entry {number}")
+        # The interval is a minute, only the full buffer can flush this soon
+        await asyncio.sleep(0.05)
+        assert len(bot.messages) == 1
+
+    bot = run_publisher(scenario, flush_size=3)
+    assert entries_of(bot.messages[0]) == ["entry 0", "entry 1", "entry 2"]
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the payment comment parser
+"""
+
+import pytest
+from comment_parser import parse_comment, ParsedComment
+
+
+@pytest.mark.parametrize("comment, game, choice", [
+    ("нечет", "even_odd", "odd"),
+    ("чет", "even_odd", "even"),
+    # Whole words only: "нечет" contains "чет", "незабил" contains "забил"
+    ("ставлю на нечет", "even_odd", "odd"),
+    ("незабил", "basketball", "miss"),
+    ("бол - победа", "bowling", "win"),
+    ("Больше!", "higher_lower", "higher"),
+    ("<4", "higher_lower", "lower"),
+    ("слоты 777", "slots", "jackpot"),
+])
+def test_outcome_words(comment, game, choice):
+    assert parse_comment(comment) == ParsedComment(game, choice, False)
+
+
+@pytest.mark.parametrize("comment", ["НЕЧЕТ", "НеЧеТ", "нечёт", "Нечётное"])
+def test_case_and_yo_are_ignored(comment):
+    assert parse_comment(comment) == ParsedComment("even_odd", "odd", False)
+
+
+@pytest.mark.parametrize("comment, choice", [
+    # Latin "e", "E" and "H" typed in place of the Cyrillic letters
+    ("чeт", "even"),
+    ("ЧEТ", "even"),
+    ("нeчeт", "odd"),
+    ("HЕЧЕТ", "odd"),
+])
+def test_latin_homoglyphs_are_read_as_cyrillic(comment, choice):
+    assert parse_comment(comment) == ParsedComment("even_odd", choice, False)
+
+
+def test_single_typo_in_a_long_word_is_corrected():
+    assert parse_comment("нечтное") == ParsedComment("even_odd", "odd", True)
+    assert parse_comment("боьше") == ParsedComment("higher_lower", "higher", True)
+    # Short words are matched exactly only
+    assert parse_comment("чт") == ParsedComment(None, None, False)
+
+
+def test_game_without_an_outcome():
+    assert parse_comment("дартс") == ParsedComment("darts", None, False)
+    # An outcome of another game does not override the named game
+    assert parse_comment("дартс победа") == ParsedComment("darts", None, False)
+
+
+@pytest.mark.parametrize("comment", [None, "", "привет", "12345"])
+def test_unrecognized_comments(comment):
+    assert parse_comment(comment) == ParsedComment(None, None, False)
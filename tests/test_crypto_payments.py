@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for crediting paid CryptoBot invoices exactly once
+"""
+
+import asyncio
+import pytest
+import user_data
+import crypto_payments
+from crypto_payments import ProcessedInvoiceIndex, process_payment_update, get_user_balance
+from ledger import Ledger
+from money import Money
+from user_record import UserRecord
+
+USER_ID = 42
+
+
+@pytest.fixture(autouse=True)
+def payments(monkeypatch):
+    """Fresh user store, ledger and invoice index in the test directory"""
+    monkeypatch.setattr(crypto_payments, "processed_invoices", ProcessedInvoiceIndex("data/invoices.db"))
+    monkeypatch.setattr(crypto_payments, "ledger", Ledger("data/transactions.jsonl"))
+    user_data.load_user_data()
+    user_data.update_user_data(USER_ID, UserRecord.new(USER_ID, "player"))
+    user_data.save_user_data()
+    yield
+    user_data.close_user_data()
+    crypto_payments.processed_invoices.close()
+    crypto_payments.ledger.close()
+
+def invoice_paid(invoice_id, amount="1.5", user_id=USER_ID):
+    return {
+        "update_type": "invoice_paid",
+        "payload": {"invoice_id": invoice_id, "amount": amount, "asset": "TON",
+                    "hidden_message": f"user_id:{user_id}"}
+    }
+
+def restart():
+    """Reopen the user store and the invoice index as after a crash"""
+    # Drop the store without closing it, so nothing more is written
+    user_data.storage = None
+    user_data.load_user_data()
+    crypto_payments.processed_invoices.close()
+    crypto_payments.processed_invoices = ProcessedInvoiceIndex("data/invoices.db")
+
+
+def test_duplicate_invoice_is_credited_once():
+    first = asyncio.run(process_payment_update(invoice_paid(1001)))
+    second = asyncio.run(process_payment_update(invoice_paid(1001)))
+    assert first["success"] is True
+    assert second["duplicate"] is True
+    assert get_user_balance(USER_ID) == Money.of("1.5")
+
+
+def test_concurrent_deliveries_are_credited_once():
+    async def deliver_twice():
+        return await asyncio.gather(process_payment_update(invoice_paid(1002)),
+                                    process_payment_update(invoice_paid(1002)))
+    results = asyncio.run(deliver_twice())
+    assert sorted(bool(result.get("duplicate")) for result in results) == [False, True]
+    assert get_user_balance(USER_ID) == Money.of("1.5")
+
+
+def test_redelivery_after_restart_is_rejected():
+    asyncio.run(process_payment_update(invoice_paid(1003)))
+    restart()
+    result = asyncio.run(process_payment_update(invoice_paid(1003)))
+    assert result["duplicate"] is True
+    assert get_user_balance(USER_ID) == Money.of("1.5")
+
+
+def test_credit_written_without_claim_is_not_repeated(monkeypatch):
+    # A crash between writing the credit and claiming the invoice
+    monkeypatch.setattr(ProcessedInvoiceIndex, "claim", lambda self, invoice_id: True)
+    asyncio.run(process_payment_update(invoice_paid(1004)))
+    restart()
+    result = asyncio.run(process_payment_update(invoice_paid(1004)))
+    assert result["duplicate"] is True
+    assert get_user_balance(USER_ID) == Money.of("1.5")
+
+
+def test_payment_of_unknown_user_is_not_claimed():
+    result = asyncio.run(process_payment_update(invoice_paid(1005, user_id=7)))
+    assert result["success"] is False
+    assert not crypto_payments.processed_invoices.seen(1005)
+
+    user_data.update_user_data(7, UserRecord.new(7, "late"))
+    result = asyncio.run(process_payment_update(invoice_paid(1005, user_id=7)))
+    assert result["success"] is True
+    assert get_user_balance(7) == Money.of("1.5")
+
+
+def test_invoice_with_failed_write_is_claimed_by_a_later_one(monkeypatch):
+    flushed = [False]
+
+    async def flush_user_data():
+        # The first write fails, the persistence worker's retry goes through later
+        if not flushed[0]:
+            flushed[0] = True
+            return False
+        return user_data.storage.flush()
+
+    monkeypatch.setattr(crypto_payments, "flush_user_data", flush_user_data)
+    asyncio.run(process_payment_update(invoice_paid(2000)))
+    assert crypto_payments.processed_invoices.is_deferred(2000)
+
+    for invoice_id in range(2001, 2001 + crypto_payments.CREDITED_INVOICES_PER_USER + 5):
+        assert asyncio.run(process_payment_update(invoice_paid(invoice_id, amount="1")))["success"]
+    assert "2000" not in user_data.get_user_data(USER_ID).get("credited_invoices")
+
+    result = asyncio.run(process_payment_update(invoice_paid(2000)))
+    assert result["duplicate"] is True
+    assert get_user_balance(USER_ID) == Money.of("1.5") + Money.of(crypto_payments.CREDITED_INVOICES_PER_USER + 5)
+
+
+def test_deferred_invoice_stays_in_the_user_record(monkeypatch):
+    async def flush_user_data():
+        return False
+
+    monkeypatch.setattr(crypto_payments, "flush_user_data", flush_user_data)
+    for invoice_id in range(3000, 3000 + crypto_payments.CREDITED_INVOICES_PER_USER + 5):
+        asyncio.run(process_payment_update(invoice_paid(invoice_id, amount="1")))
+    assert "3000" in user_data.get_user_data(USER_ID).get("credited_invoices")
+
+
+class FakeCryptoBot:
+    """Creates invoices and reports them as paid once settle() was called"""
+
+    def __init__(self):
+        self.invoices = {}
+
+    async def call(self, api_method, params=None, payload=None, **kwargs):
+        if api_method == "createInvoice":
+            invoice_id = str(len(self.invoices) + 5000)
+            self.invoices[invoice_id] = dict(payload, invoice_id=int(invoice_id), status="active",
+                                             bot_invoice_url=f"https://t.me/CryptoBot?start=IV{invoice_id}")
+            return 200, {"ok": True, "result": self.invoices[invoice_id]}
+        items = [self.invoices[i] for i in params["invoice_ids"].split(",") if i in self.invoices]
+        return 200, {"ok": True, "result": {"items": items}}
+
+    def settle(self, invoice_id):
+        self.invoices[invoice_id]["status"] = "paid"
+
+
+def test_deposit_with_a_lost_webhook_is_credited_by_the_reconciler(monkeypatch):
+    import payment_reconciler
+    cryptobot = FakeCryptoBot()
+    reconciler = payment_reconciler.InvoiceReconciler()
+    monkeypatch.setattr(crypto_payments, "cryptobot", cryptobot)
+    monkeypatch.setattr(payment_reconciler, "cryptobot", cryptobot)
+    monkeypatch.setattr(payment_reconciler, "reconciler", reconciler)
+
+    url = asyncio.run(crypto_payments.create_deposit_invoice(USER_ID, 2.5))
+    assert url == "https://t.me/CryptoBot?start=IV5000"
+    assert asyncio.run(reconciler.reconcile()) == 0
+
+    # The user pays, and the invoice_paid webhook never arrives
+    cryptobot.settle("5000")
+    assert asyncio.run(reconciler.reconcile()) == 1
+    assert get_user_balance(USER_ID) == Money.of("2.5")
+    assert reconciler.pending_count == 0
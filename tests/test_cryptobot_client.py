@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the pooled CryptoBot API client against a local stub server
+"""
+
+import asyncio
+import contextlib
+import aiohttp
+import pytest
+from aiohttp import web
+from cryptobot_client import CryptoBotClient
+
+
+class StubApi:
+    """CryptoBot stub answering each request with the next scripted reply"""
+
+    def __init__(self, *replies):
+        # A status code, "disconnect" to drop the connection or ("sleep", seconds)
+        self.replies = list(replies)
+        self.requests = []
+
+    async def handle(self, request):
+        token = request.headers.get("Crypto-Pay-API-Token")
+        self.requests.append((request.method, request.match_info["method"], token))
+        reply = self.replies.pop(0) if self.replies else 200
+        if reply == "disconnect":
+            request.transport.close()
+            return web.Response()
+        if isinstance(reply, tuple):
+            await asyncio.sleep(reply[1])
+            reply = 200
+        if reply == 200:
+            return web.json_response({"ok": True, "result": {"attempt": len(self.requests)}})
+        headers = {"Retry-After": "0"} if reply == 429 else {}
+        return web.json_response({"ok": False, "error": {"code": reply}}, status=reply, headers=headers)
+
+    @contextlib.asynccontextmanager
+    async def serve(self):
+        app = web.Application()
+        app.router.add_route("*", "/api/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        try:
+            yield f"http://{host}:{port}/api"
+        finally:
+            await runner.cleanup()
+
+
+def call(stub, *args, timeout=5, **kwargs):
+    """Make one client call against the stub and close the client"""
+    async def main():
+        async with stub.serve() as url:
+            client = CryptoBotClient("token", base_url=url, timeout=timeout, retries=3, backoff=0.001)
+            try:
+                return await client.call(*args, **kwargs)
+            finally:
+                await client.close()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retryable_statuses_are_retried(status):
+    stub = StubApi(status, status)
+    assert call(stub, "getInvoices") == (200, {"ok": True, "result": {"attempt": 3}})
+    assert [method for _, method, _ in stub.requests] == ["getInvoices"] * 3
+
+
+def test_last_response_is_returned_when_retries_run_out():
+    stub = StubApi(503, 503, 503, 503, 200)
+    status, result = call(stub, "getMe")
+    assert status == 503
+    assert result["error"]["code"] == 503
+    assert len(stub.requests) == 4
+
+
+def test_client_errors_are_not_retried():
+    stub = StubApi(400)
+    assert call(stub, "getMe")[0] == 400
+    assert len(stub.requests) == 1
+
+
+def test_dropped_connection_is_retried():
+    stub = StubApi("disconnect")
+    assert call(stub, "getMe")[0] == 200
+    assert len(stub.requests) == 2
+
+
+def test_timeout_is_retried():
+    stub = StubApi(("sleep", 1))
+    assert call(stub, "getMe", timeout=0.2)[0] == 200
+    assert len(stub.requests) == 2
+
+
+def test_non_idempotent_post_is_not_retried():
+    stub = StubApi(503)
+    assert call(stub, "transfer", payload={"amount": "1"}, http_method="POST")[0] == 503
+    assert stub.requests == [("POST", "transfer", "token")]
+
+
+def test_post_with_spend_id_is_retried():
+    stub = StubApi(503)
+    status, _ = call(stub, "transfer", payload={"spend_id": "s1"}, http_method="POST", idempotent=True)
+    assert status == 200
+    assert len(stub.requests) == 2
+
+
+def test_connection_error_is_raised_after_the_last_retry():
+    async def main():
+        # Nothing listens on the stub's port once it is shut down
+        async with StubApi().serve() as url:
+            pass
+        client = CryptoBotClient("token", base_url=url, retries=2, backoff=0.001)
+        try:
+            await client.call("getMe")
+        finally:
+            await client.close()
+
+    with pytest.raises(aiohttp.ClientConnectionError):
+        asyncio.run(main())
+
+
+def test_session_is_reused_and_closed_on_shutdown():
+    stub = StubApi()
+
+    async def main():
+        async with stub.serve() as url:
+            client = CryptoBotClient("token", base_url=url)
+            await client.start()
+            session = client._session
+            await client.call("getMe")
+            await client.call("getMe")
+            assert client._session is session
+            await client.close()
+            assert session.closed
+            assert client._session is None
+            # Used again after shutdown, e.g. by a script, it opens a new session
+            assert (await client.call("getMe"))[0] == 200
+            await client.close()
+
+    asyncio.run(main())
+    assert len(stub.requests) == 3
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the day, week and all-time leaderboards
+"""
+
+import asyncio
+from datetime import datetime
+import pytest
+import user_data
+import settlement
+import leaderboard
+from settlement import settle_bet
+from leaderboard import Leaderboards, TopK, merge_boards
+from user_stats import record_bet
+from money import Money
+from user_record import UserRecord
+
+MONDAY = datetime(2026, 10, 12, 12, 0)
+TUESDAY = datetime(2026, 10, 13, 12, 0)
+
+
+class Publisher:
+    def __init__(self):
+        self.posts = []
+
+    def publish(self, text):
+        self.posts.append(text)
+
+
+@pytest.fixture
+def boards(monkeypatch):
+    """Fresh boards with three players of 10 TON each"""
+    boards = Leaderboards(size=2)
+    monkeypatch.setattr(settlement, "leaderboards", boards)
+    monkeypatch.setattr(leaderboard, "publisher", Publisher())
+    user_data.load_user_data()
+    for user_id in (1, 2, 3):
+        record = UserRecord.new(user_id, f"player{user_id}")
+        record.balance_nano = Money.of(10).nano
+        user_data.update_user_data(user_id, record)
+    yield boards
+    user_data.close_user_data()
+
+def play(user_id, stake, payout, game="darts"):
+    async def roll():
+        return 1
+    return asyncio.run(settle_bet(user_id, stake, roll, lambda value: Money.of(payout), game=game))
+
+def bet(boards, user_id, stake, payout, now):
+    """Settle a bet at a given time without going through settle_bet()"""
+    record = user_data.get_user_data(user_id)
+    boards.update(user_id, record_bet(record, "darts", stake, payout, now=now), now=now)
+
+
+def test_top_k_keeps_the_highest_growing_scores():
+    top = TopK(2)
+    top.offer("a", 5)
+    top.offer("b", 3)
+    top.offer("c", 1)
+    assert top.top() == [("a", 5), ("b", 3)]
+    # Scores only grow within a period, lower ones are ignored
+    top.offer("a", 2)
+    top.offer("c", 9)
+    assert top.top() == [("c", 9), ("a", 5)]
+
+
+def test_settled_bets_update_the_boards(boards):
+    play(1, 1, 0)
+    play(2, 2, 5)
+    play(3, 1, 3)
+    play(1, 4, 0)
+
+    assert boards.top("all", "biggest_win") == [("2", Money.of(5).nano), ("3", Money.of(3).nano)]
+    assert boards.top("all", "wagered") == [("1", Money.of(5).nano), ("2", Money.of(2).nano)]
+    assert boards.top("day", "games") == [("1", 2), ("2", 1)]
+    text = boards.render("all")
+    assert "1. @player2 — 5 TON" in text
+    assert "1. @player1 — 2 игр" in text
+
+
+def test_new_day_starts_empty_and_posts_the_finished_board(boards):
+    bet(boards, 1, 1, 3, MONDAY)
+    bet(boards, 2, 1, 0, TUESDAY)
+
+    assert boards.top("day", "biggest_win", now=TUESDAY) == []
+    assert boards.top("day", "games", now=TUESDAY) == [("2", 1)]
+    assert boards.top("week", "games", now=TUESDAY) == [("1", 1), ("2", 1)]
+    post, = leaderboard.publisher.posts
+    assert post.startswith("Итоги дня 2026-10-12")
+    assert "@player1 — 3 TON" in post
+
+
+def test_boards_are_rebuilt_from_stored_statistics(boards):
+    play(1, 1, 2)
+    play(3, 3, 0)
+    rebuilt = Leaderboards(size=2)
+    rebuilt.rebuild()
+    assert rebuilt.top("all", "wagered") == boards.top("all", "wagered") == \
+        [("3", Money.of(3).nano), ("1", Money.of(1).nano)]
+
+
+def test_boards_of_several_shards_are_merged():
+    merged = merge_boards([{"games": [("a", 5), ("b", 1)]}, {"games": [("c", 3)]}], size=2)
+    assert merged == {"games": [("a", 5), ("c", 3)]}
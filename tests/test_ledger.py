@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the transaction ledger
+"""
+
+import os
+import asyncio
+import pytest
+from ledger import Ledger
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """Count fsync calls instead of making them"""
+    calls = []
+    monkeypatch.setattr(os, "fsync", calls.append)
+    return calls
+
+def open_ledger(**options):
+    ledger = Ledger("data/transactions.jsonl", "data/archive.jsonl", **options)
+    ledger.load()
+    return ledger
+
+
+def test_appends_are_group_committed(fsyncs):
+    async def scenario():
+        ledger = open_ledger(fsync_batch=10, fsync_interval=0.05)
+        for number in range(25):
+            ledger.record(f"tx{number}", 1, type="deposit", amount="1")
+        # Two full batches were synced, the rest waits for the interval
+        assert len(fsyncs) == 2
+        await asyncio.sleep(0.1)
+        assert len(fsyncs) == 3
+        ledger.close()
+
+    asyncio.run(scenario())
+    assert len(fsyncs) == 3
+
+
+def test_close_syncs_pending_entries(fsyncs):
+    async def scenario():
+        ledger = open_ledger(fsync_interval=60)
+        ledger.record("tx1", 1, type="deposit", amount="1")
+        ledger.update("tx1", status="completed")
+        assert fsyncs == []
+        ledger.close()
+        assert len(fsyncs) == 1
+
+    asyncio.run(scenario())
+    reloaded = open_ledger()
+    assert reloaded.get("tx1")["status"] == "completed"
+    assert [entry["transaction_id"] for entry in reloaded.history(1)] == ["tx1"]
+
+
+def test_torn_entry_is_truncated_before_new_appends(fsyncs):
+    ledger = open_ledger()
+    ledger.record("tx1", 1, type="deposit", amount="1")
+    ledger.close()
+    # A crash in the middle of appending tx2
+    with open("data/transactions.jsonl", "ab") as file:
+        file.write(b'{"type":"deposit","amount":"2","transaction_id":"tx2","us')
+
+    ledger = open_ledger()
+    assert ledger.get("tx2") is None
+    ledger.record("tx3", 1, type="deposit", amount="3")
+    ledger.record("tx4", 1, type="withdrawal", amount="1")
+    ledger.close()
+
+    reloaded = open_ledger()
+    assert [entry["transaction_id"] for entry in reloaded.history(1)] == ["tx4", "tx3", "tx1"]
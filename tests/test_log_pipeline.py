@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the asynchronous log pipeline
+"""
+
+import io
+import json
+import logging
+import threading
+import pytest
+import log_pipeline
+from log_pipeline import setup_logging, shutdown_logging
+
+
+@pytest.fixture(autouse=True)
+def root_logger():
+    """Give the root logger its handlers and level back after the test"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+class SlowStream(io.StringIO):
+    """Output that blocks the writer thread until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.released = threading.Event()
+
+    def write(self, text):
+        self.writing.set()
+        self.released.wait()
+        return super().write(text)
+
+
+def written(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_shutdown_with_a_full_queue_writes_every_record(monkeypatch):
+    monkeypatch.setattr(log_pipeline, "LOG_QUEUE_SIZE", 10)
+    stream = SlowStream()
+    setup_logging(stream=stream)
+    logger = logging.getLogger("test")
+    # Errors are not sampled; the writer holds the first record, the queue the next ten
+    logger.error("record %d", 0)
+    stream.writing.wait()
+    for number in range(1, 11):
+        logger.error("record %d", number)
+
+    threading.Timer(0.1, stream.released.set).start()
+    shutdown_logging()
+    assert [entry["msg"] for entry in written(stream)] == [f"record {number}" for number in range(11)]
+
+
+def log_lines(level="INFO", emit=None):
+    """Run emit() with logging set up at a level and return the written entries"""
+    stream = io.StringIO()
+    setup_logging(level=level, stream=stream)
+    emit(logging.getLogger("test"))
+    shutdown_logging()
+    return written(stream)
+
+
+def test_records_below_the_level_are_not_written_nor_formatted():
+    formatted = []
+
+    class Url:
+        def __str__(self):
+            formatted.append(self)
+            return "https://example.org"
+
+    def emit(logger):
+        logger.debug("url %s", Url())
+        logger.info("started")
+        logger.warning("slow")
+
+    assert [(entry["level"], entry["msg"]) for entry in log_lines("INFO", emit)] == \
+        [("INFO", "started"), ("WARNING", "slow")]
+    assert formatted == []
+    assert [entry["msg"] for entry in log_lines("WARNING", emit)] == ["slow"]
+
+
+def test_warnings_are_sampled_per_call_site_and_errors_never():
+    def emit(logger):
+        # Well above the LOG_SAMPLE_RATE records a call site may write at once
+        for number in range(100):
+            logger.warning("warning %d", number)
+            logger.error("error %d", number)
+        logger.warning("other call site")
+
+    entries = log_lines("INFO", emit)
+    warnings = [entry["msg"] for entry in entries if entry["level"] == "WARNING"]
+    assert warnings[:-1] == [f"warning {number}" for number in range(len(warnings) - 1)]
+    assert log_pipeline.LOG_SAMPLE_RATE <= len(warnings) - 1 < 100
+    assert warnings[-1] == "other call site"
+    assert len([entry for entry in entries if entry["level"] == "ERROR"]) == 100
+
+
+def test_first_record_after_a_pause_reports_the_suppressed_ones(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(log_pipeline.time, "monotonic", lambda: now[0])
+    sampler = log_pipeline.SamplingFilter(rate=2)
+
+    def record():
+        return logging.LogRecord("test", logging.INFO, "games.py", 10, "msg", None, None)
+
+    assert [sampler.filter(record()) for _ in range(5)] == [True, True, False, False, False]
+    now[0] += 1
+    passed = record()
+    assert sampler.filter(passed) is True
+    assert passed.suppressed == 3
+
+
+def test_context_fields_are_written_with_the_record():
+    def emit(logger):
+        with log_pipeline.log_context(update_id=5, user_id=42):
+            logger.info("handled", extra={"game": "darts"})
+        logger.info("outside")
+
+    handled, outside = log_lines("INFO", emit)
+    assert (handled["update_id"], handled["user_id"], handled["game"]) == (5, 42, "darts")
+    assert "user_id" not in outside
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the compiled game result templates
+"""
+
+import pytest
+from game_registry import GAMES
+from message_templates import GameResult, CompiledTemplates, LazyText, compile_template, templates_for
+from money import Money
+
+CONDITIONAL = ("result", "result_short", "verdict")
+
+
+def format_plainly(game, name, record):
+    """What a template says when formatted with str.format on every call"""
+    fields = {
+        **record._asdict(),
+        "title": game.title, "emoji": game.emoji, "icon": game.icon,
+        "choice": game.outcomes[record.choice].title,
+        "label": game.labels.get(record.value, "")
+    }
+    for field in CONDITIONAL:
+        variant = "won" if record.won else "lost"
+        fields[field] = game.templates[f"{field}_{variant}"].format(**fields)
+    return game.templates[name].format(**fields)
+
+
+def results_of(game):
+    """A won and a lost bet on every outcome of a game"""
+    for choice in game.outcomes:
+        for won in (True, False):
+            yield GameResult(choice=choice, stake=Money.of("1.5"), payout=Money.of("2.7") if won else Money(0),
+                             won=won, value=game.values[0], balance=Money.of("10.25"), username="player",
+                             games_played=7, mode_games=3)
+
+
+@pytest.mark.parametrize("game_key", list(GAMES))
+def test_every_template_of_a_game_renders_like_str_format(game_key):
+    game = GAMES[game_key]
+    templates = CompiledTemplates(game)
+    for record in results_of(game):
+        for name in game.templates:
+            if name.endswith(("_won", "_lost")):
+                continue
+            assert templates.render(name, record) == format_plainly(game, name, record)
+
+
+def test_result_shows_the_won_or_lost_variant():
+    game = GAMES["even_odd"]
+    won, lost = list(results_of(game))[:2]
+    templates = templates_for(game)
+    assert "Результат: Выигрыш 2.7 TON" in templates.render("channel", won)
+    assert "Результат: Проигрыш 1.5 TON" in templates.render("channel", lost)
+    assert templates_for(game) is templates
+
+
+def test_lazy_text_renders_once_on_first_use():
+    calls = []
+
+    def render(record):
+        calls.append(record)
+        return "text"
+
+    game = GAMES["darts"]
+    record = next(results_of(game))
+    assert str(CompiledTemplates(game).lazy("user", record)) == format_plainly(game, "user", record)
+
+    text = LazyText(render, record)
+    assert calls == []
+    assert str(text) == str(text) == "text"
+    assert calls == [record]
+
+
+def test_literal_braces_and_format_specs_are_kept():
+    game = GAMES["slots"]
+    render = compile_template("{{x}} {title:>8}|{mode_games:03d}", game)
+    assert render(next(results_of(game))) == "{x} " + f"{game.title:>8}" + "|003"
+
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(ValueError, match="jackpot_size"):
+        compile_template("{jackpot_size}", GAMES["slots"])
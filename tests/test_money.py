@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for fixed-point nano-TON amounts
+"""
+
+from decimal import Decimal
+import pytest
+from money import Money, ton_to_nano
+
+
+@pytest.mark.parametrize("amount, nano", [
+    (1, 1_000_000_000),
+    ("0.1", 100_000_000),
+    (0.3, 300_000_000),
+    (Decimal("2.000000001"), 2_000_000_001),
+    ("0.0000000005", 0),
+    ("-1.5", -1_500_000_000),
+])
+def test_amounts_are_converted_exactly(amount, nano):
+    assert Money.of(amount).nano == nano
+
+
+@pytest.mark.parametrize("amount", [
+    float("inf"), float("-inf"), float("nan"), "inf", "-Infinity", "NaN", "sNaN",
+    Decimal("Infinity"), "", "ten", None, [1]
+])
+def test_invalid_amounts_raise_value_error(amount):
+    with pytest.raises(ValueError, match="Invalid TON amount"):
+        Money.of(amount)
+
+
+def test_ton_to_nano_rejects_non_finite_amounts():
+    with pytest.raises(ValueError):
+        ton_to_nano(float("inf"))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for batched invoice reconciliation
+"""
+
+import asyncio
+import pytest
+import payment_reconciler
+from payment_reconciler import InvoiceReconciler
+
+
+class FakeCryptoBot:
+    """Answers getInvoices from a dict of invoices and records the requests"""
+
+    def __init__(self, invoices):
+        self.invoices = invoices
+        self.requests = []
+
+    async def call(self, api_method, params=None, **kwargs):
+        assert api_method == "getInvoices"
+        invoice_ids = params["invoice_ids"].split(",")
+        self.requests.append(invoice_ids)
+        items = [self.invoices[invoice_id] for invoice_id in invoice_ids if invoice_id in self.invoices]
+        return 200, {"ok": True, "result": {"items": items}}
+
+
+@pytest.fixture
+def cryptobot(monkeypatch):
+    fake = FakeCryptoBot({
+        "1": {"invoice_id": 1, "status": "active"},
+        "2": {"invoice_id": 2, "status": "paid", "amount": "2"},
+        "3": {"invoice_id": 3, "status": "expired"}
+    })
+    monkeypatch.setattr(payment_reconciler, "cryptobot", fake)
+    return fake
+
+
+def test_concurrent_lookups_share_one_request(cryptobot):
+    paid = []
+
+    async def process_payment(update_data):
+        paid.append(update_data["payload"]["invoice_id"])
+        return {"success": True}
+
+    async def scenario():
+        reconciler = InvoiceReconciler(min_interval=60, max_interval=60)
+        reconciler.process_payment = process_payment
+        await reconciler.start()
+        try:
+            return await asyncio.gather(*(reconciler.lookup(invoice_id) for invoice_id in ("1", "2", "3", "4"))), \
+                reconciler.pending_count
+        finally:
+            await reconciler.stop()
+
+    (active, settled, expired, unknown), pending = asyncio.run(scenario())
+    assert len(cryptobot.requests) == 1
+    assert sorted(cryptobot.requests[0]) == ["1", "2", "3", "4"]
+    assert (active["status"], settled["status"], expired["status"], unknown) == ("active", "paid", "expired", None)
+    # The paid invoice was credited before its status was returned
+    assert paid == [2]
+    assert pending == 1
+
+
+def test_lookup_fails_with_the_api_error(monkeypatch):
+    class FailingCryptoBot:
+        async def call(self, api_method, params=None, **kwargs):
+            return 401, {"ok": False, "error": {"message": "UNAUTHORIZED"}}
+
+    monkeypatch.setattr(payment_reconciler, "cryptobot", FailingCryptoBot())
+
+    async def scenario():
+        reconciler = InvoiceReconciler(min_interval=60, max_interval=60)
+        await reconciler.start()
+        try:
+            await reconciler.lookup("1")
+        finally:
+            await reconciler.stop()
+
+    with pytest.raises(RuntimeError, match="UNAUTHORIZED"):
+        asyncio.run(scenario())
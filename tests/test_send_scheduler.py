@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the outbound message scheduler
+"""
+
+import asyncio
+from telegram.error import RetryAfter
+from send_scheduler import SendScheduler, PRIORITY_CHANNEL, BUCKET_IDLE_TIMEOUT
+
+
+class FakeChat:
+    """Records delivered messages; selected messages hit a flood limit on their first attempt"""
+
+    def __init__(self, flooded=()):
+        self.flooded = set(flooded)
+        self.delivered = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def call(self, message):
+        async def send():
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                # Later messages answer faster, as they would on a loaded connection
+                await asyncio.sleep(0.01 if message % 2 else 0.02)
+                if message in self.flooded:
+                    self.flooded.discard(message)
+                    raise RetryAfter(0.05)
+                self.delivered.append(message)
+                return message
+            finally:
+                self.in_flight -= 1
+        return send
+
+
+def run_scheduler(scenario, **limits):
+    async def main():
+        scheduler = SendScheduler(**dict(dict(global_rate=1000, private_rate=1000, burst=3), **limits))
+        await scheduler.start()
+        try:
+            return await scenario(scheduler)
+        finally:
+            await scheduler.stop()
+    return asyncio.run(main())
+
+
+def test_messages_of_a_chat_keep_their_order_under_retry_after():
+    chat = FakeChat(flooded={2})
+
+    async def scenario(scheduler):
+        return await asyncio.gather(*(scheduler.send(chat.call(message), 1) for message in range(1, 7)))
+
+    results = run_scheduler(scenario)
+    assert results == [1, 2, 3, 4, 5, 6]
+    assert chat.delivered == [1, 2, 3, 4, 5, 6]
+    assert chat.max_in_flight == 1
+
+
+def test_user_messages_go_before_channel_messages():
+    order = []
+
+    def call(name):
+        async def send():
+            order.append(name)
+        return send
+
+    async def scenario(scheduler):
+        # Both are queued before the scheduler runs, so it picks by priority class
+        await asyncio.gather(scheduler.send(call("channel"), -100, PRIORITY_CHANNEL),
+                             scheduler.send(call("user"), 5))
+
+    run_scheduler(scenario)
+    assert order == ["user", "channel"]
+
+
+def test_cancelled_send_that_runs_out_of_retries():
+    chat = FakeChat(flooded={1})
+
+    async def scenario(scheduler):
+        send = asyncio.create_task(scheduler.send(chat.call(1), 1))
+        await asyncio.sleep(0.005)
+        dispatch, = scheduler._in_flight
+        # The caller gives up while the last attempt is in flight
+        send.cancel()
+        await dispatch
+        return send.cancelled(), scheduler.failed
+
+    assert run_scheduler(scenario, max_retries=0) == (True, 1)
+
+
+def test_idle_buckets_are_swept_at_most_once_per_timeout():
+    scheduler = SendScheduler()
+    for chat_id in range(10000):
+        scheduler._bucket(chat_id).updated = 0.0
+    scheduler._forget_idle_buckets(1000.0)
+    assert scheduler._buckets == {}
+
+    for chat_id in range(10000):
+        scheduler._bucket(chat_id).updated = 0.0
+    scheduler._forget_idle_buckets(1001.0)
+    assert len(scheduler._buckets) == 10000
+    scheduler._forget_idle_buckets(1000.0 + BUCKET_IDLE_TIMEOUT)
+    assert scheduler._buckets == {}
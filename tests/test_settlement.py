@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for atomic bet settlement
+"""
+
+import asyncio
+import pytest
+from telegram.error import TimedOut
+import user_data
+import settlement
+from settlement import settle_bet
+from crypto_payments import get_user_balance
+from leaderboard import Leaderboards
+from money import Money, ZERO
+from user_record import UserRecord
+
+USER_ID = 42
+
+
+@pytest.fixture(autouse=True)
+def player(monkeypatch):
+    """A user with 10 TON and empty leaderboards"""
+    monkeypatch.setattr(settlement, "leaderboards", Leaderboards())
+    user_data.load_user_data()
+    record = UserRecord.new(USER_ID, "player")
+    record.balance_nano = Money.of(10).nano
+    user_data.update_user_data(USER_ID, record)
+    yield
+    user_data.close_user_data()
+
+def dice(value, balances=None):
+    """roll() returning a fixed value and recording the balance seen while rolling"""
+    async def roll():
+        if balances is not None:
+            balances.append(get_user_balance(USER_ID))
+        return value
+    return roll
+
+def pays(amount):
+    return lambda dice_value: Money.of(amount)
+
+
+def test_stake_is_reserved_before_the_roll():
+    balances = []
+    result = asyncio.run(settle_bet(USER_ID, 2, dice(3, balances), pays(0), game="even_odd"))
+    assert balances == [Money.of(8)]
+    assert result["success"] is True
+    assert (result["dice_value"], result["winnings"], result["balance"]) == (3, ZERO, Money.of(8))
+
+
+def test_win_is_paid_on_top_of_the_reserved_stake():
+    result = asyncio.run(settle_bet(USER_ID, 2, dice(4), pays("3.6"), game="even_odd"))
+    assert result["balance"] == Money.of("11.6")
+    assert get_user_balance(USER_ID) == Money.of("11.6")
+
+
+def test_stake_is_refunded_when_the_dice_cannot_be_sent():
+    async def reply_dice():
+        raise TimedOut()
+
+    with pytest.raises(TimedOut):
+        asyncio.run(settle_bet(USER_ID, 2, reply_dice, pays(0), game="even_odd"))
+    assert get_user_balance(USER_ID) == Money.of(10)
+    # A bet that never happened is not in the statistics either
+    assert user_data.get_user_data(USER_ID).stats is None
+
+
+def test_bet_above_the_balance_is_rejected_without_a_roll():
+    balances = []
+    result = asyncio.run(settle_bet(USER_ID, 11, dice(3, balances), pays(0)))
+    assert result["success"] is False
+    assert "10" in result["message"]
+    assert balances == []
+    assert get_user_balance(USER_ID) == Money.of(10)
+
+
+def test_concurrent_bets_cannot_spend_the_stake_twice():
+    async def slow_roll():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def bet_twice():
+        return await asyncio.gather(settle_bet(USER_ID, 6, slow_roll, pays(0)),
+                                    settle_bet(USER_ID, 6, slow_roll, pays(0)))
+
+    results = asyncio.run(bet_twice())
+    assert sorted(result["success"] for result in results) == [False, True]
+    assert get_user_balance(USER_ID) == Money.of(4)
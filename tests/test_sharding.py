@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the sharded runtime's routing and shared limits
+"""
+
+import pytest
+from sharding import ShardSupervisor, shard_of, shard_directory, split_users
+from send_scheduler import SEND_GLOBAL_RATE
+from user_data import create_storage
+from user_record import UserRecord
+
+
+def test_users_are_routed_by_id():
+    assert [shard_of(user_id, 3) for user_id in (3, "4", 5)] == [0, 1, 2]
+
+
+def test_workers_and_front_share_the_global_send_rate():
+    supervisor = ShardSupervisor(None, shards=3)
+    assert supervisor.send_rate * 4 == SEND_GLOBAL_RATE
+    assert float(supervisor.environment["SEND_GLOBAL_RATE"]) == supervisor.send_rate
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_split_users_partitions_the_configured_store(backend):
+    source = create_storage(backend)
+    source.load()
+    for user_id in range(1, 8):
+        source.put(str(user_id), UserRecord(user_id=user_id, balance_nano=user_id))
+    source.close()
+
+    assert split_users(shards=2, root="shards", backend=backend) == [3, 4]
+    for shard, expected in ((0, ["2", "4", "6"]), (1, ["1", "3", "5", "7"])):
+        target = create_storage(backend, shard_directory(shard, "shards"))
+        target.load()
+        assert sorted(target.all_ids()) == expected
+        assert all(target.get(user_id).balance_nano == int(user_id) for user_id in expected)
+        target.close()
+
+    with pytest.raises(RuntimeError):
+        split_users(shards=2, root="shards", backend=backend)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the user storage backends
+"""
+
+import os
+import sqlite3
+from storage import JsonStorage, SqliteStorage
+from user_record import UserRecord
+
+
+def open_storage(directory, **options):
+    storage = JsonStorage(str(directory / "users.json"), str(directory / "users.journal"),
+                          fsync_policy="never", **options)
+    storage.load()
+    return storage
+
+def put_user(storage, user_id, balance_nano):
+    storage.put(user_id, UserRecord(user_id=int(user_id), username=f"user{user_id}", balance_nano=balance_nano))
+
+
+def test_journal_is_replayed_on_load(workdir):
+    storage = open_storage(workdir)
+    put_user(storage, "1", 100)
+    storage.flush()
+    put_user(storage, "1", 150)
+    put_user(storage, "2", 200)
+    storage.flush()
+    storage._journal.close()
+
+    reopened = open_storage(workdir)
+    assert reopened.get("1").balance_nano == 150
+    assert reopened.get("2").balance_nano == 200
+
+
+def test_torn_tail_is_truncated_before_new_appends(workdir):
+    storage = open_storage(workdir)
+    put_user(storage, "1", 100)
+    put_user(storage, "2", 200)
+    storage.flush()
+    storage._journal.close()
+    journal = workdir / "users.journal"
+    intact = journal.read_bytes()
+
+    # A crash in the middle of an append leaves half a line behind
+    with open(journal, "ab") as file:
+        file.write(b'{"id":"3","u":{"user_id":3,"bala')
+
+    storage = open_storage(workdir)
+    assert storage.get("3") is None
+    assert journal.read_bytes() == intact
+
+    # Records appended after the recovery survive a second restart
+    put_user(storage, "3", 300)
+    storage.flush()
+    storage._journal.close()
+
+    reopened = open_storage(workdir)
+    assert reopened.get("1").balance_nano == 100
+    assert reopened.get("2").balance_nano == 200
+    assert reopened.get("3").balance_nano == 300
+
+
+def test_snapshot_compacts_the_journal(workdir):
+    storage = open_storage(workdir, snapshot_every=3)
+    for user_id in range(4):
+        put_user(storage, str(user_id), user_id * 10)
+    storage.flush()
+    assert os.path.getsize(workdir / "users.journal") == 0
+    storage.close()
+
+    reopened = open_storage(workdir)
+    assert {user_id: reopened.get(user_id).balance_nano for user_id in reopened.all_ids()} == \
+        {"0": 0, "1": 10, "2": 20, "3": 30}
+
+
+def test_failed_write_is_retried_by_the_next_flush(workdir):
+    storage = open_storage(workdir)
+    put_user(storage, "1", 100)
+    # The journal cannot be opened while a directory is in its place
+    os.mkdir(workdir / "users.journal")
+    assert storage.flush() is False
+
+    os.rmdir(workdir / "users.journal")
+    assert storage.flush() is True
+    storage._journal.close()
+    assert open_storage(workdir).get("1").balance_nano == 100
+
+
+def test_failed_write_is_taken_back_on_the_calling_thread(workdir):
+    storage = open_storage(workdir)
+    put_user(storage, "1", 100)
+    os.mkdir(workdir / "users.journal")
+    batch = storage.collect()
+    # write() runs in the persistence thread and leaves the change tracking alone
+    assert storage.write(batch) is False
+    assert storage.collect() is None
+
+    storage.complete(batch, False)
+    os.rmdir(workdir / "users.journal")
+    assert storage.flush() is True
+    storage._journal.close()
+    assert open_storage(workdir).get("1").balance_nano == 100
+
+
+def test_failed_sqlite_write_is_retried_by_the_next_flush(workdir):
+    storage = SqliteStorage(str(workdir / "users.db"))
+    storage.load()
+    put_user(storage, "1", 100)
+    writer = storage._writer
+    storage._writer = sqlite3.connect(":memory:", check_same_thread=False)
+    assert storage.flush() is False
+    assert storage.get("1").balance_nano == 100
+
+    storage._writer = writer
+    assert storage.flush() is True
+    storage.close()
+    reopened = SqliteStorage(str(workdir / "users.db"))
+    reopened.load()
+    assert reopened.get("1").balance_nano == 100
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for per-user ordered concurrent update processing
+"""
+
+import asyncio
+import random
+import pytest
+from telegram import Update, CallbackQuery, User
+from update_processor import OrderedUpdateProcessor
+
+
+def update_of(user_id, update_id):
+    user = User(id=user_id, first_name="player", is_bot=False)
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), user, "chat"))
+
+
+class Recorder:
+    """Handler stand-in recording start and end of every update per user"""
+
+    def __init__(self):
+        self.handled = {}
+        self.running = set()
+        self.running_users = set()
+        self.max_running = 0
+        self.overlaps = 0
+        self.gate = None
+
+    async def handle(self, user_id, update_id):
+        if user_id in self.running_users:
+            self.overlaps += 1
+        self.running_users.add(user_id)
+        self.running.add((user_id, update_id))
+        self.max_running = max(self.max_running, len(self.running))
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            await asyncio.sleep(random.uniform(0, 0.003))
+            self.handled.setdefault(user_id, []).append(update_id)
+        finally:
+            self.running.discard((user_id, update_id))
+            self.running_users.discard(user_id)
+
+
+def submit(processor, recorder, user_id, update_id):
+    """Hand an update to the processor as Application.process_update() would"""
+    coroutine = processor.process_update(update_of(user_id, update_id), recorder.handle(user_id, update_id))
+    return asyncio.create_task(coroutine)
+
+def run(processor, scenario):
+    async def main():
+        await processor.initialize()
+        try:
+            return await scenario()
+        finally:
+            await processor.shutdown()
+    return asyncio.run(main())
+
+
+def test_updates_of_a_user_run_in_order_and_users_run_concurrently():
+    processor = OrderedUpdateProcessor(workers=8, queue_size=1000, user_queue_size=100)
+    recorder = Recorder()
+    random.seed(1)
+    updates = [(user_id, update_id) for update_id in range(20) for user_id in range(1, 11)]
+
+    async def scenario():
+        await asyncio.gather(*(submit(processor, recorder, user_id, update_id) for user_id, update_id in updates))
+
+    run(processor, scenario)
+    assert recorder.handled == {user_id: list(range(20)) for user_id in range(1, 11)}
+    assert recorder.overlaps == 0
+    assert 1 < recorder.max_running <= 8
+    assert processor.stats()["processed"] == 200
+
+
+@pytest.mark.parametrize("overflow, kept", [
+    ("drop_newest", [0, 1, 2, 3, 4]),
+    ("drop_oldest", [0, 16, 17, 18, 19]),
+])
+def test_overflow_policy_of_a_full_user_queue(overflow, kept):
+    processor = OrderedUpdateProcessor(workers=2, queue_size=1000, user_queue_size=4, overflow=overflow)
+    recorder = Recorder()
+
+    async def scenario():
+        recorder.gate = asyncio.Event()
+        tasks = [submit(processor, recorder, 7, 0)]
+        while not recorder.running:
+            await asyncio.sleep(0)
+        # Update 0 holds a worker while 1..19 arrive for the same user
+        tasks += [submit(processor, recorder, 7, update_id) for update_id in range(1, 20)]
+        await asyncio.sleep(0.01)
+        recorder.gate.set()
+        await asyncio.gather(*tasks)
+
+    run(processor, scenario)
+    assert recorder.handled == {7: kept}
+    assert processor.stats()["dropped"] == 15
+
+
+def test_wait_policy_keeps_every_update():
+    processor = OrderedUpdateProcessor(workers=2, queue_size=4, user_queue_size=1, overflow="wait")
+    recorder = Recorder()
+
+    async def scenario():
+        recorder.gate = asyncio.Event()
+        tasks = [submit(processor, recorder, 7, update_id) for update_id in range(20)]
+        await asyncio.sleep(0.01)
+        overloaded = processor.overloaded
+        recorder.gate.set()
+        await asyncio.gather(*tasks)
+        return overloaded
+
+    assert run(processor, scenario) is True
+    assert recorder.handled == {7: list(range(20))}
+    assert processor.stats()["dropped"] == 0
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for user data maintenance
+"""
+
+import os
+import json
+from user_data import migrate_balances
+
+
+def test_balances_are_migrated_in_the_given_snapshot(workdir):
+    os.mkdir(workdir / "backup")
+    path = workdir / "backup" / "users.json"
+    path.write_text(json.dumps({
+        "1": {"user_id": 1, "username": "one", "balance": 0.30000000000000004},
+        "2": {"user_id": 2, "username": "two", "balance": 2}
+    }), encoding="utf-8")
+
+    assert migrate_balances(str(path)) == (2, 1)
+    users = json.loads(path.read_text(encoding="utf-8"))
+    assert {user_id: data["balance_nano"] for user_id, data in users.items()} == \
+        {"1": 300000000, "2": 2000000000}
+    # The configured store next to the working directory is left alone
+    assert not os.path.exists(workdir / "data")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for per-user game statistics
+"""
+
+import asyncio
+from datetime import datetime
+import pytest
+import user_data
+import settlement
+from settlement import settle_bet
+from leaderboard import Leaderboards
+from user_stats import record_bet, stats_of, new_stats
+from money import Money
+from user_record import UserRecord
+
+MONDAY = datetime(2026, 10, 12, 12, 0)
+TUESDAY = datetime(2026, 10, 13, 12, 0)
+NEXT_MONDAY = datetime(2026, 10, 19, 12, 0)
+
+
+def test_wins_and_losses_update_totals_and_streaks():
+    user = {}
+    record_bet(user, "darts", Money.of(1), Money.of(3), now=MONDAY)
+    record_bet(user, "darts", Money.of(2), Money.of(5), now=MONDAY)
+    stats = record_bet(user, "bowling", Money.of("0.5"), Money(0), now=MONDAY)
+
+    assert user["stats"] is stats
+    assert (stats["games"], stats["wins"]) == (3, 2)
+    assert (stats["wagered_nano"], stats["won_nano"]) == (Money.of("3.5").nano, Money.of(8).nano)
+    assert (stats["streak"], stats["best_streak"]) == (-1, 2)
+    assert stats["best_win_nano"] == Money.of(5).nano
+    assert stats["modes"] == {"darts": 2, "bowling": 1}
+    assert stats["favorite"] == "darts"
+
+
+def test_favorite_changes_only_when_another_game_is_played_more():
+    user = {}
+    record_bet(user, "darts", 1, 0, now=MONDAY)
+    record_bet(user, "slots", 1, 0, now=MONDAY)
+    assert user["stats"]["favorite"] == "darts"
+    record_bet(user, "slots", 1, 0, now=MONDAY)
+    assert user["stats"]["favorite"] == "slots"
+
+
+def test_day_and_week_totals_start_over_in_a_new_period():
+    user = {}
+    record_bet(user, "darts", 1, 2, now=MONDAY)
+    stats = record_bet(user, "darts", 1, 0, now=TUESDAY)
+    assert (stats["day"]["period"], stats["day"]["games"]) == ("2026-10-13", 1)
+    assert (stats["week"]["period"], stats["week"]["games"]) == ("2026-W42", 2)
+    assert stats["week"]["best_win_nano"] == Money.of(2).nano
+
+    stats = record_bet(user, "darts", 1, 0, now=NEXT_MONDAY)
+    assert (stats["week"]["period"], stats["week"]["games"]) == ("2026-W43", 1)
+    assert stats["games"] == 3
+
+
+def test_a_settlement_replaces_the_record_instead_of_mutating_it():
+    user = {}
+    before = record_bet(user, "darts", 1, 0, now=MONDAY)
+    record_bet(user, "darts", 1, 0, now=MONDAY)
+    assert before["games"] == 1
+
+
+def test_legacy_counters_and_ton_amounts_are_converted_on_read():
+    assert stats_of(None) == new_stats()
+    stats = stats_of({"games_played": 5, "darts_games": 3, "slots_games": 2})
+    assert (stats["games"], stats["modes"], stats["favorite"]) == (5, {"darts": 3, "slots": 2}, "darts")
+
+    old = dict(new_stats(), wagered=1.5, won=0.1, best_win=0.1)
+    del old["wagered_nano"], old["won_nano"], old["best_win_nano"]
+    stats = stats_of({"stats": old})
+    assert (stats["wagered_nano"], stats["won_nano"]) == (1500000000, 100000000)
+
+
+@pytest.fixture
+def player(monkeypatch):
+    monkeypatch.setattr(settlement, "leaderboards", Leaderboards())
+    user_data.load_user_data()
+    record = UserRecord.new(7, "player")
+    record.balance_nano = Money.of(10).nano
+    user_data.update_user_data(7, record)
+    yield 7
+    user_data.close_user_data()
+
+
+def test_settled_bets_are_stored_in_the_user_record(player):
+    async def roll():
+        return 6
+
+    async def play():
+        await settle_bet(player, 1, roll, lambda value: Money.of("1.8"), game="even_odd")
+        return await settle_bet(player, 2, roll, lambda value: Money(0), game="darts")
+
+    result = asyncio.run(play())
+    stored = user_data.get_user_data(player).stats
+    assert result["stats"] == stored
+    assert (stored["games"], stored["wins"], stored["streak"]) == (2, 1, -1)
+    assert stored["wagered_nano"] == Money.of(3).nano
+    assert stored["modes"] == {"even_odd": 1, "darts": 1}
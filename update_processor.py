@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Concurrent update processing with per-user ordering
+
+python-telegram-bot handles one update at a time by default, so one slow
+handler (a CryptoBot call, a dice round trip) stalls every other player.
+Its plain concurrent mode would fix that but lets two updates of the same
+player run at once, out of order and racing on the same balance.
+
+OrderedUpdateProcessor keeps a FIFO queue per key: the user of the update,
+or its chat when there is no user. UPDATE_WORKERS workers take keys in
+round-robin order and run the oldest update of each, so updates of
+different players run concurrently and updates of one player run strictly
+one after another, in the order they arrived.
+
+At most UPDATE_QUEUE_SIZE updates wait for a worker, UPDATE_USER_QUEUE_SIZE
+of them per key. What happens to an update beyond those limits depends on
+UPDATE_OVERFLOW_POLICY:
+
+* "wait": the update waits, in arrival order, until the queue has room;
+  meanwhile the webhook answers Telegram with 503 so it redelivers later.
+  The per-key limit does not apply.
+* "drop_newest": the update is dropped.
+* "drop_oldest": the oldest waiting update of the same key is dropped to
+  make room; if that key has none waiting, the new update is dropped.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Updates handled at the same time
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+
+# Updates waiting for a worker, in total and per user or chat
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "10000"))
+UPDATE_USER_QUEUE_SIZE = int(os.getenv("UPDATE_USER_QUEUE_SIZE", "20"))
+
+# What to do with updates beyond those limits: "wait", "drop_newest" or "drop_oldest"
+UPDATE_OVERFLOW_POLICY = os.getenv("UPDATE_OVERFLOW_POLICY", "wait")
+
+OVERFLOW_POLICIES = ("wait", "drop_newest", "drop_oldest")
+
+UPDATE_WAIT = metrics.histogram(
+    "update_queue_seconds", "Time updates waited for a worker"
+)
+UPDATES_DROPPED = metrics.counter(
+    "updates_dropped", "Updates dropped by the overflow policy, by the limit hit: user or total", ["limit"]
+)
+
+
+def update_key(update):
+    """Ordering key of an update: its user, else its chat, else None"""
+    if not isinstance(update, Update):
+        return None
+    user = update.effective_user
+    if user is not None:
+        return user.id
+    chat = update.effective_chat
+    return chat.id if chat is not None else None
+
+
+class _Entry:
+    __slots__ = ("update", "coroutine", "future", "queued_at")
+
+    def __init__(self, update, coroutine, future):
+        self.update = update
+        self.coroutine = coroutine
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Update processor running different users concurrently and each user in order"""
+
+    def __init__(self, workers=UPDATE_WORKERS, queue_size=UPDATE_QUEUE_SIZE,
+                 user_queue_size=UPDATE_USER_QUEUE_SIZE, overflow=UPDATE_OVERFLOW_POLICY):
+        if workers < 1:
+            raise ValueError("workers must be a positive integer")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown update overflow policy: {overflow}")
+        # The base class admits this many updates into do_process_update at once;
+        # with "wait" the rest queue for its semaphore, which wakes them in order
+        super().__init__(queue_size + workers)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.user_queue_size = user_queue_size
+        self.overflow = overflow
+        # key -> deque of waiting entries; a key is present while it has
+        # waiting entries or one of its updates is running
+        self._queues = {}
+        # Keys with waiting entries and no running update, in round-robin order
+        self._ready = None
+        self._tasks = []
+        self.waiting = 0
+        self.running = 0
+        self.processed = 0
+        self.dropped = 0
+        metrics.gauge("update_queue", "Updates waiting for a worker", lambda: self.waiting)
+        metrics.gauge("updates_running", "Updates being handled", lambda: self.running)
+
+    @property
+    def overloaded(self):
+        """True while the queue is full; the webhook then asks Telegram to retry later"""
+        return self.waiting >= self.queue_size
+
+    def stats(self):
+        return {
+            "waiting": self.waiting, "running": self.running, "users": len(self._queues),
+            "processed": self.processed, "dropped": self.dropped
+        }
+
+    async def initialize(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Update processor started: {self.workers} workers, overflow policy {self.overflow}")
+
+    async def shutdown(self):
+        """Stop the workers; Application.stop() has already waited for queued updates"""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for entries in self._queues.values():
+            for entry in entries:
+                entry.coroutine.close()
+                entry.future.cancel()
+        self._queues.clear()
+        self.waiting = 0
+        logger.info(f"Update processor stopped: {self.stats()}")
+
+    async def do_process_update(self, update, coroutine):
+        """Queue the update behind earlier updates of its key and wait until it was handled"""
+        key = update_key(update)
+        entries = self._queues.get(key)
+        if not self._admit(update, key, entries):
+            coroutine.close()
+            return
+        entry = _Entry(update, coroutine, asyncio.get_running_loop().create_future())
+        if entries is None:
+            self._queues[key] = deque((entry,))
+            self._ready.put_nowait(key)
+        else:
+            entries.append(entry)
+        self.waiting += 1
+        await entry.future
+
+    def _admit(self, update, key, entries):
+        """Apply the overflow policy; False if the new update is to be dropped"""
+        if self.overflow == "wait":
+            return True
+        if entries is not None and len(entries) >= self.user_queue_size:
+            limit = "user"
+        elif self.waiting >= self.queue_size:
+            limit = "total"
+        else:
+            return True
+        UPDATES_DROPPED.labels(limit).inc()
+        self.dropped += 1
+        if self.overflow == "drop_oldest" and entries:
+            oldest = entries.popleft()
+            oldest.coroutine.close()
+            oldest.future.set_result(None)
+            self.waiting -= 1
+            logger.warning("Dropped update %s of %s, %s queue full",
+                           getattr(oldest.update, "update_id", None), key, limit)
+            return True
+        logger.warning("Dropped update %s of %s, %s queue full", getattr(update, "update_id", None), key, limit)
+        return False
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            entries = self._queues[key]
+            entry = entries.popleft()
+            self.waiting -= 1
+            self.running += 1
+            UPDATE_WAIT.observe(time.monotonic() - entry.queued_at)
+            try:
+                await entry.coroutine
+            except asyncio.CancelledError:
+                entry.future.cancel()
+                raise
+            except Exception as e:
+                # Application.process_update handles handler errors; this is anything else
+                if not entry.future.done():
+                    entry.future.set_exception(e)
+            else:
+                if not entry.future.done():
+                    entry.future.set_result(None)
+            finally:
+                self.running -= 1
+                self.processed += 1
+            # The key goes to the back of the line, so a busy user cannot starve the others
+            if entries:
+                self._ready.put_nowait(key)
+            else:
+                del self._queues[key]
+
+
+# Processor shared by the application
+processor = OrderedUpdateProcessor()
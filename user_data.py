@@ -3,68 +3,122 @@
 
 """
 User data storage and management
+
+Accessor functions delegate to a storage backend from storage.py, selected
+with the USER_STORAGE_BACKEND environment variable ("json" by default, or
+"sqlite"). Users are held as UserRecord objects (user_record.py), which
+still support the dict-style access of the old layout. Existing JSON data
+can be moved into SQLite with:
+
+    python user_data.py migrate
+
+and a data/users.json written with float balances is rewritten with exact
+nano-TON balances (money.py) with:
+
+    python user_data.py migrate-balances
 """
 
 import os
+import sys
 import json
 import logging
-from datetime import datetime
+import argparse
+from storage import JsonStorage, SqliteStorage
+from user_stats import stats_of
+from user_record import as_user_record
+from money import Money
 
 logger = logging.getLogger(__name__)
 
-# Path to user data file
+# Storage backend: "json" (snapshot + journal) or "sqlite"
+USER_STORAGE_BACKEND = os.getenv("USER_STORAGE_BACKEND", "json")
+
+# Path to user data file (latest full snapshot)
 USER_DATA_FILE = "data/users.json"
 
-# In-memory storage for user data
-users = {}
+# Path to the journal with changes made since the last snapshot
+USER_JOURNAL_FILE = "data/users.journal"
+
+# Path to the SQLite user database
+USER_DB_FILE = "data/users.db"
+
+# Journal fsync policy for the JSON backend: "always", "batch" or "never"
+JOURNAL_FSYNC_POLICY = os.getenv("USER_JOURNAL_FSYNC", "batch")
+JOURNAL_FSYNC_BATCH = int(os.getenv("USER_JOURNAL_FSYNC_BATCH", "64"))
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("USER_JOURNAL_FSYNC_INTERVAL", "1.0"))
+
+# Write a new snapshot and compact the journal after this many records
+JOURNAL_SNAPSHOT_EVERY = int(os.getenv("USER_JOURNAL_SNAPSHOT_EVERY", "5000"))
+
+# Number of users kept in memory by the SQLite backend
+SQLITE_CACHE_SIZE = int(os.getenv("USER_SQLITE_CACHE_SIZE", "10000"))
+
+# Active storage backend
+storage = None
+
+# Background persistence worker, set while persistence.worker is running
+persistence_worker = None
+
+def create_storage(backend=USER_STORAGE_BACKEND, directory=""):
+    """Create a storage backend by name, with its files below directory"""
+    if backend == "json":
+        return JsonStorage(
+            os.path.join(directory, USER_DATA_FILE),
+            os.path.join(directory, USER_JOURNAL_FILE),
+            fsync_policy=JOURNAL_FSYNC_POLICY,
+            fsync_batch=JOURNAL_FSYNC_BATCH,
+            fsync_interval=JOURNAL_FSYNC_INTERVAL,
+            snapshot_every=JOURNAL_SNAPSHOT_EVERY
+        )
+    if backend == "sqlite":
+        return SqliteStorage(os.path.join(directory, USER_DB_FILE), cache_size=SQLITE_CACHE_SIZE)
+    raise ValueError(f"Unknown user storage backend: {backend}")
 
 def load_user_data():
-    """Load user data from JSON file"""
-    global users
-    try:
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r', encoding='utf-8') as file:
-                users = json.load(file)
-                logger.info(f"Loaded {len(users)} user records from file")
-        else:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
-            users = {}
-            logger.info("No user data file found, starting with empty data")
-    except Exception as e:
-        logger.error(f"Error loading user data: {e}")
-        users = {}
+    """Open the configured storage backend"""
+    global storage
+    if storage is not None:
+        storage.close()
+    storage = create_storage()
+    storage.load()
 
 def save_user_data():
-    """Save user data to JSON file"""
-    try:
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
-        
-        with open(USER_DATA_FILE, 'w', encoding='utf-8') as file:
-            json.dump(users, file, ensure_ascii=False, indent=2)
-        logger.info(f"Saved {len(users)} user records to file")
-    except Exception as e:
-        logger.error(f"Error saving user data: {e}")
+    """Persist changes made since the last save"""
+    if persistence_worker is not None:
+        # The worker coalesces saves and writes them off the event loop
+        persistence_worker.notify()
+    else:
+        storage.flush()
+
+async def flush_user_data():
+    """Write pending changes now rather than with the next coalesced save; False if the write failed"""
+    if persistence_worker is not None:
+        return await persistence_worker.flush()
+    return storage.flush()
+
+def close_user_data():
+    """Persist pending changes and close the storage backend"""
+    global storage
+    if storage is not None:
+        storage.close()
+        storage = None
 
 def get_user_data(user_id):
-    """Get user data for a specific user"""
+    """Get the UserRecord of a specific user, None for unknown users"""
     user_id = str(user_id)  # Convert to string for use as dictionary key
-    return users.get(user_id)
+    return storage.get(user_id)
 
 def update_user_data(user_id, data):
-    """Update user data for a specific user"""
+    """Update user data for a specific user (a UserRecord or a dict)"""
     user_id = str(user_id)  # Convert to string for use as dictionary key
-    users[user_id] = data
+    record = as_user_record(data)
     # Update last activity timestamp
-    users[user_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    record.touch()
+    storage.put(user_id, record)
 
 def get_games_played(user_id):
     """Get the number of games played by user"""
-    user_data = get_user_data(str(user_id))
-    if user_data:
-        return user_data.get("games_played", 0)
-    return 0
+    return stats_of(get_user_data(user_id))["games"]
 
 def get_registration_date(user_id):
     """Get user registration date"""
@@ -74,12 +128,94 @@ def get_registration_date(user_id):
     return "Unknown"
 
 def get_favorite_game(user_id):
-    """Get user's favorite game mode"""
-    user_data = get_user_data(str(user_id))
-    if user_data:
-        return user_data.get("favorite_game")
-    return None
+    """Get the key of the user's most played game mode"""
+    return stats_of(get_user_data(user_id))["favorite"]
+
+def get_user_stats(user_id):
+    """Get the statistics record of a user"""
+    return stats_of(get_user_data(user_id))
 
 def get_all_users():
     """Get a list of all user IDs"""
-    return list(users.keys())
+    return storage.all_ids()
+
+def migrate_json_to_sqlite(db_file=USER_DB_FILE):
+    """Copy all users from the JSON snapshot and journal into SQLite"""
+    source = JsonStorage(
+        path,
+        os.path.splitext(path)[0] + ".journal",
+        fsync_policy=JOURNAL_FSYNC_POLICY,
+        snapshot_every=JOURNAL_SNAPSHOT_EVERY
+    )
+    source.load()
+    target = SqliteStorage(db_file, cache_size=SQLITE_CACHE_SIZE)
+    target.load()
+    target.import_users(source.users)
+    target.close()
+    logger.info(f"Migrated {len(source.users)} user records into {db_file}")
+    return len(source.users)
+
+def migrate_balances(path=USER_DATA_FILE):
+    """
+    Rewrite the JSON snapshot with integer nano-TON balances
+
+    Legacy float balances are converted by their decimal form, so a stored
+    0.30000000000000004 becomes exactly 0.3 TON. Statistics records are
+    rewritten with nano-TON amounts as well, and the journal next to the
+    snapshot (users.journal beside users.json) is folded into the new one.
+
+    Returns:
+        tuple: (users converted, users whose balance lost float noise)
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path, 'r', encoding='utf-8') as file:
+        users = json.load(file)
+    legacy = {user_id: data["balance"] for user_id, data in users.items()
+              if "balance_nano" not in data and "balance" in data}
+
+    rounded = sum(1 for balance in legacy.values()
+                  if isinstance(balance, float) and Money.of(balance).to_ton() != balance)
+
+    # Loading decodes the legacy balances, the snapshot stores them in nano-TON
+    source = JsonStorage(
+        path,
+        os.path.splitext(path)[0] + ".journal",
+        fsync_policy=JOURNAL_FSYNC_POLICY,
+        snapshot_every=JOURNAL_SNAPSHOT_EVERY
+    )
+    source.load()
+    if len(source.users) < len(users):
+        # The backend logs load errors and starts empty; never snapshot that over the data
+        raise RuntimeError(f"Could not load all users from {path}, nothing was changed")
+    for record in source.users.values():
+        if record.stats is not None:
+            record.stats = stats_of(record)
+    source.snapshot()
+    source.close()
+    logger.info(f"Converted {len(legacy)} legacy balances in {path}, {rounded} of them rounded")
+    return len(legacy), rounded
+
+def main(argv=None):
+    """Command line entry point for storage maintenance"""
+    parser = argparse.ArgumentParser(description="User data maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="convert data/users.json into the SQLite store")
+    migrate.add_argument("--db", default=USER_DB_FILE, help="path of the SQLite database")
+    subparsers.add_parser("migrate-balances", help="store data/users.json balances as integer nano-TON")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        count = migrate_json_to_sqlite(args.db)
+        print(f"Migrated {count} users into {args.db}")
+        print("Set USER_STORAGE_BACKEND=sqlite to use it")
+    elif args.command == "migrate-balances":
+        converted, rounded = migrate_balances()
+        print(f"Converted {converted} balances to nano-TON ({rounded} had float rounding noise)")
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    sys.exit(main())
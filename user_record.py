@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compact in-memory user record
+
+UserRecord keeps one user in fixed __slots__ instead of a free-form dict:
+timestamps are integer epoch seconds and the balance is an integer number
+of nano-TON. Fields that have no slot of their own (counters of older
+versions, for example) go into an "extra" dict that only exists for users
+who have such fields.
+
+For the accessor code UserRecord still behaves like the old dict: "balance"
+reads as Money (money.py) and accepts any TON amount, "registration_date" and "last_activity" read and
+write the "%Y-%m-%d %H:%M:%S" strings, and any other key maps to a slot or
+to the extra fields.
+
+to_persisted() and from_persisted() are the codec between records and the
+JSON form stored by the backends in storage.py. from_persisted() also
+accepts the dict layout written before UserRecord existed.
+"""
+
+import time
+from datetime import datetime
+from money import Money, ton_to_nano
+
+# Format of the legacy date strings
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def _format_time(epoch):
+    return datetime.fromtimestamp(epoch).strftime(DATE_FORMAT) if epoch else None
+
+def _parse_time(value):
+    if value is None or isinstance(value, (int, float)):
+        return int(value) if value else 0
+    try:
+        return int(datetime.strptime(value, DATE_FORMAT).timestamp())
+    except ValueError:
+        return 0
+
+
+class UserRecord:
+    """One user: identity, balance, activity timestamps and statistics"""
+
+    __slots__ = ("user_id", "username", "registered_at", "last_active", "balance_nano", "stats", "extra")
+
+    def __init__(self, user_id=None, username=None, registered_at=0, last_active=0,
+                 balance_nano=0, stats=None, extra=None):
+        self.user_id = user_id
+        self.username = username
+        self.registered_at = registered_at
+        self.last_active = last_active
+        self.balance_nano = balance_nano
+        self.stats = stats
+        self.extra = extra
+
+    @classmethod
+    def new(cls, user_id, username):
+        """Record of a user registering now"""
+        now = int(time.time())
+        return cls(user_id=user_id, username=username, registered_at=now, last_active=now)
+
+    def touch(self):
+        """Mark the user as active now"""
+        self.last_active = int(time.time())
+
+    # Codec
+
+    def to_persisted(self):
+        """Encode into the dict stored by the storage backends"""
+        data = {
+            "user_id": self.user_id,
+            "username": self.username,
+            "registered_at": self.registered_at,
+            "last_active": self.last_active,
+            "balance_nano": self.balance_nano
+        }
+        if self.stats is not None:
+            data["stats"] = self.stats
+        if self.extra:
+            data["extra"] = self.extra
+        return data
+
+    @classmethod
+    def from_persisted(cls, data):
+        """Decode a stored dict, in the current or the legacy layout"""
+        if "balance_nano" in data:
+            return cls(data.get("user_id"), data.get("username"), data.get("registered_at", 0),
+                       data.get("last_active", 0), data["balance_nano"], data.get("stats"),
+                       data.get("extra"))
+        record = cls()
+        for key, value in data.items():
+            record[key] = value
+        return record
+
+    # Dict-style access for the accessor functions
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if key == "balance":
+            return Money(self.balance_nano)
+        if key == "registration_date":
+            return _format_time(self.registered_at) or default
+        if key == "last_activity":
+            return _format_time(self.last_active) or default
+        if key in _SLOT_KEYS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        if key == "balance":
+            self.balance_nano = ton_to_nano(value or 0)
+        elif key == "registration_date":
+            self.registered_at = _parse_time(value)
+        elif key == "last_activity":
+            self.last_active = _parse_time(value)
+        elif key in _SLOT_KEYS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def items(self):
+        """(key, value) pairs in the legacy dict layout"""
+        pairs = [(key, self.get(key)) for key in _LEGACY_KEYS]
+        pairs = [(key, value) for key, value in pairs if value is not None]
+        if self.extra:
+            pairs.extend(self.extra.items())
+        return pairs
+
+    def __eq__(self, other):
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return self.to_persisted() == other.to_persisted()
+
+    def __repr__(self):
+        return f"UserRecord({self.to_persisted()!r})"
+
+
+_MISSING = object()
+
+# Keys that map straight to a slot
+_SLOT_KEYS = frozenset(("user_id", "username", "stats"))
+
+# Keys of the legacy dict layout that have a slot
+_LEGACY_KEYS = ("user_id", "username", "registration_date", "last_activity", "balance", "stats")
+
+def as_user_record(data):
+    """Accept a UserRecord or a dict in either persisted layout"""
+    if data is None or isinstance(data, UserRecord):
+        return data
+    return UserRecord.from_persisted(data)
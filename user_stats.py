@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per-user game statistics
+
+Each user's statistics are one compact record stored under "stats" in the
+user's data: games played, games per mode, wins, amounts wagered and won,
+the current streak, the best winning streak, the biggest win, the favorite
+game and the totals of the current day and week. The record is updated
+incrementally when a bet is settled, so reading a profile is a single
+lookup with nothing to recompute. Amounts are integer nano-TON (money.py)
+in the fields ending in "_nano", so totals never drift.
+
+A settlement replaces the record instead of mutating it in place. Storage
+snapshots copy user dicts shallowly, and because the record is replaced,
+a snapshot never sees a half-updated record.
+"""
+
+from datetime import datetime
+from money import Money, ton_to_nano
+
+def new_stats():
+    """Statistics of a user who has not played yet"""
+    return {
+        "games": 0,
+        "wins": 0,
+        "wagered_nano": 0,
+        "won_nano": 0,
+        # Positive: wins in a row, negative: losses in a row
+        "streak": 0,
+        "best_streak": 0,
+        # Largest single payout
+        "best_win_nano": 0,
+        "favorite": None,
+        # game key -> games played in that mode
+        "modes": {},
+        # Totals of the current day and week, see period_keys()
+        "day": None,
+        "week": None
+    }
+
+def period_keys(now=None):
+    """Keys of the day and the ISO week a moment belongs to"""
+    today = (now or datetime.now()).date()
+    year, week, _ = today.isocalendar()
+    return {"day": today.isoformat(), "week": f"{year}-W{week:02d}"}
+
+def stats_of(user_data):
+    """
+    Statistics record of a user
+
+    Users created before the statistics subsystem only have the flat
+    "games_played" and "<game>_games" counters, and records written before
+    money.py hold amounts in TON; both are converted on read.
+    """
+    if not user_data:
+        return new_stats()
+    stats = user_data.get("stats")
+    if stats is not None:
+        return stats if "wagered_nano" in stats else _nano_amounts(stats)
+    stats = new_stats()
+    stats["games"] = user_data.get("games_played", 0)
+    stats["modes"] = {
+        key[:-len("_games")]: count for key, count in user_data.items()
+        if key.endswith("_games") and count
+    }
+    if stats["modes"]:
+        stats["favorite"] = max(stats["modes"], key=stats["modes"].get)
+    return stats
+
+def _nano_amounts(stats):
+    """Copy of a statistics record with TON amounts converted to nano-TON"""
+    stats = dict(stats)
+    for field in ("wagered", "won", "best_win"):
+        stats[f"{field}_nano"] = ton_to_nano(stats.pop(field, 0) or 0)
+    for period in ("day", "week"):
+        totals = stats.get(period)
+        if totals and "wagered_nano" not in totals:
+            stats[period] = {
+                "period": totals["period"],
+                "games": totals["games"],
+                "wagered_nano": ton_to_nano(totals.get("wagered", 0)),
+                "best_win_nano": ton_to_nano(totals.get("best_win", 0))
+            }
+    return stats
+
+def record_bet(user_data, game, stake, payout, now=None):
+    """
+    Add one settled bet to a user's statistics
+
+    Args:
+        user_data: The user's data dict, updated in place
+        game: Registered game key
+        stake: Bet amount, Money or TON
+        payout: Amount paid out, zero for a loss
+        now: Settlement time, the current time by default
+
+    Returns:
+        dict: The new statistics record
+    """
+    old = stats_of(user_data)
+    stake = stake.nano if isinstance(stake, Money) else ton_to_nano(stake)
+    payout = payout.nano if isinstance(payout, Money) else ton_to_nano(payout)
+    won = payout > 0
+    mode_games = old["modes"].get(game, 0) + 1
+
+    stats = dict(old)
+    stats["games"] = old["games"] + 1
+    stats["wagered_nano"] = old["wagered_nano"] + stake
+    stats["modes"] = {**old["modes"], game: mode_games}
+    if won:
+        stats["wins"] = old["wins"] + 1
+        stats["won_nano"] = old["won_nano"] + payout
+        stats["streak"] = old["streak"] + 1 if old["streak"] > 0 else 1
+        stats["best_streak"] = max(old["best_streak"], stats["streak"])
+    else:
+        stats["streak"] = old["streak"] - 1 if old["streak"] < 0 else -1
+    stats["best_win_nano"] = max(old["best_win_nano"], payout)
+    for period, key in period_keys(now).items():
+        totals = old.get(period)
+        if not totals or totals["period"] != key:
+            totals = {"period": key, "games": 0, "wagered_nano": 0, "best_win_nano": 0}
+        stats[period] = {
+            "period": key,
+            "games": totals["games"] + 1,
+            "wagered_nano": totals["wagered_nano"] + stake,
+            "best_win_nano": max(totals["best_win_nano"], payout)
+        }
+    favorite = old["favorite"]
+    if favorite is None or (favorite != game and mode_games > old["modes"].get(favorite, 0)):
+        stats["favorite"] = game
+
+    user_data["stats"] = stats
+    return stats
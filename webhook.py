@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Webhook runtime mode
+
+One aiohttp application receives both Telegram updates and CryptoBot
+payment callbacks:
+
+    POST /telegram   - Telegram updates, checked against TELEGRAM_WEBHOOK_SECRET
+    POST /cryptobot  - CryptoBot updates, checked against the API token signature
+
+Both endpoints answer 200 as soon as the update is validated and queued.
+Telegram updates go to the Application's update queue, payment updates to
+a queue drained by PAYMENT_WORKERS background workers. While the update
+processor is overloaded, /telegram answers 503 and Telegram redelivers the
+update later.
+"""
+
+import os
+import hmac
+import json
+import signal
+import asyncio
+import hashlib
+import logging
+from aiohttp import web
+from telegram import Update
+from crypto_payments import CRYPTOBOT_TOKEN, process_payment_update
+from payment_reconciler import reconciler
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Address the webhook server listens on
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Public HTTPS base URL of the server, e.g. https://bot.example.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# Secret Telegram sends back in X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+TELEGRAM_WEBHOOK_PATH = "/telegram"
+CRYPTOBOT_WEBHOOK_PATH = "/cryptobot"
+
+# Background workers processing payment callbacks and the queue in front of them
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+PAYMENT_QUEUE_SIZE = int(os.getenv("PAYMENT_QUEUE_SIZE", "10000"))
+
+
+def verify_cryptobot_signature(token, body, signature):
+    """
+    Check the crypto-pay-api-signature header of a CryptoBot update
+
+    The signature is HMAC-SHA256 of the raw body, keyed with SHA256 of the API token.
+    """
+    if not token or not signature:
+        return False
+    secret = hashlib.sha256(token.encode()).digest()
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class WebhookServer:
+    """aiohttp server feeding Telegram and CryptoBot updates to the bot"""
+
+    def __init__(self, application, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                 secret=TELEGRAM_WEBHOOK_SECRET, workers=PAYMENT_WORKERS,
+                 process_payment=process_payment_update):
+        self.application = application
+        self.process_payment = process_payment
+        self.listen = listen
+        self.port = port
+        self.secret = secret
+        self.workers = workers
+        self.payments = asyncio.Queue(maxsize=PAYMENT_QUEUE_SIZE)
+        self._runner = None
+        self._worker_tasks = []
+        metrics.gauge("payment_queue", "CryptoBot callbacks waiting for a payment worker", self.payments.qsize)
+
+    def build_app(self):
+        """Create the aiohttp application with all routes"""
+        app = web.Application()
+        app.router.add_post(TELEGRAM_WEBHOOK_PATH, self.handle_telegram)
+        app.router.add_post(CRYPTOBOT_WEBHOOK_PATH, self.handle_cryptobot)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def start(self):
+        """Start payment workers and the HTTP server"""
+        self._worker_tasks = [
+            asyncio.create_task(self._payment_worker()) for _ in range(self.workers)
+        ]
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}")
+
+    async def stop(self):
+        """Stop accepting requests and finish queued payments"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.payments.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def handle_telegram(self, request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        if getattr(self.application.update_processor, "overloaded", False):
+            # Telegram keeps the update and delivers it again later
+            return web.Response(status=503)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed Telegram update: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_cryptobot(self, request):
+        body = await request.read()
+        if not verify_cryptobot_signature(CRYPTOBOT_TOKEN, body, request.headers.get("crypto-pay-api-signature")):
+            logger.warning("Rejected CryptoBot update with an invalid signature")
+            return web.Response(status=401)
+        try:
+            update_data = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.payments.put_nowait(update_data)
+        except asyncio.QueueFull:
+            # CryptoBot retries deliveries that do not get a 200
+            logger.error("Payment queue is full, asking CryptoBot to retry later")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_health(self, request):
+        return web.json_response({"ok": True, "payment_queue": self.payments.qsize()})
+
+    async def _payment_worker(self):
+        while True:
+            update_data = await self.payments.get()
+            try:
+                invoice_id = update_data.get("payload", {}).get("invoice_id")
+                if invoice_id is not None:
+                    # The callback beat the poller to it
+                    reconciler.untrack(invoice_id)
+                await self.process_payment(update_data)
+            except Exception as e:
+                logger.error(f"Error processing CryptoBot update: {e}")
+            finally:
+                self.payments.task_done()
+
+
+async def run_webhook(application, url=WEBHOOK_URL):
+    """Run the application in webhook mode until SIGINT or SIGTERM"""
+    if not url:
+        raise ValueError("No WEBHOOK_URL found in environment variables")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    server = WebhookServer(application)
+    await server.start()
+    await application.bot.set_webhook(
+        url=f"{url.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}",
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"Webhook set to {url.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)